@@ -1,2 +1,5 @@
-from atl_observe.decorator import observe  # noqa: F401
-from atl_observe.lib.slack import Slack  # noqa: F401
+from atl_observe.decorator import observe
+from atl_observe.lib.metrics import set_default_metric
+from atl_observe.lib.slack import BackgroundSlack, CoalescingSlack, Slack
+
+__all__ = ["observe", "set_default_metric", "BackgroundSlack", "CoalescingSlack", "Slack"]
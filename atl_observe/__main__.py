@@ -0,0 +1,5 @@
+import sys
+
+from atl_observe.cli import main
+
+sys.exit(main())
@@ -0,0 +1,69 @@
+"""Implements the `atl_observe` command, analyzing spooled @observe telemetry, see atl_observe.lib.analyze.
+
+Usage:
+    atl_observe analyze /var/spool/observe --by tenant --since 10:00 --until 10:15
+    atl_observe analyze /var/spool/observe --metric process --tag type:a --sort p99 --top 10 --jobs 4
+    atl_observe replay /var/spool/observe
+"""
+import argparse
+import json
+import sys
+from typing import List, Optional
+
+from atl_observe.lib.analyze import Analysis, analyze, format_rows, parse_time
+from atl_observe.lib.metrics import get_default_metric
+from atl_observe.lib.spool import replay
+
+
+def _time(value: str) -> float:
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid time %r, expected epoch seconds, ISO 8601 or HH:MM." % value)
+
+
+def parser() -> argparse.ArgumentParser:
+    """Returns the parser of the command line arguments.
+    """
+    root = argparse.ArgumentParser(prog="atl_observe", description="Analyzes spooled @observe telemetry.")
+    commands = root.add_subparsers(dest="command")
+    commands.required = True
+
+    analyzer = commands.add_parser("analyze", help="counts, outcome ratios, latency percentiles and observed_sli")
+    analyzer.add_argument("paths", nargs="+", help="the spool files or directories")
+    analyzer.add_argument("--by", action="append", default=[], help="a tag key to group by, repeatable")
+    analyzer.add_argument("--metric", help="only the metrics starting with the prefix")
+    analyzer.add_argument("--tag", action="append", default=[], help="only the calls with the tag, repeatable")
+    analyzer.add_argument("--since", type=_time, help="only the calls at or after, epoch seconds, ISO 8601 or HH:MM")
+    analyzer.add_argument("--until", type=_time, help="only the calls before, epoch seconds, ISO 8601 or HH:MM")
+    analyzer.add_argument("--sort", default="count", help="the descending sort field, e.g. count, p99, raised_ratio")
+    analyzer.add_argument("--top", type=int, help="only the first rows")
+    analyzer.add_argument("--jobs", type=int, default=1, help="the processes analyzing files in parallel")
+    analyzer.add_argument("--json", action="store_true", help="prints one JSON object per row")
+
+    replayer = commands.add_parser("replay", help="sends the spooled metrics to the statsd agent (DD_AGENT_HOST)")
+    replayer.add_argument("paths", nargs="+", help="the spool files or directories")
+    return root
+
+
+def main(argv: Optional[List[str]] = None) -> int:  # pylint: disable=E1136
+    """Runs the command, returns the exit code.
+    """
+    options = parser().parse_args(argv)
+
+    if options.command == "replay":
+        replayed = replay(options.paths, get_default_metric())
+        print("replayed %d records" % replayed)
+        return 0
+
+    analysis = analyze(options.paths, Analysis(by=options.by, metric=options.metric, tags=options.tag,
+                                               since=options.since, until=options.until), jobs=options.jobs)
+    rows = analysis.rows(sort=options.sort, top=options.top)
+    if options.json:
+        for row in rows:
+            print(json.dumps(row, sort_keys=True))
+    else:
+        sys.stdout.write(format_rows(rows))
+    if analysis.skipped:
+        print("skipped %d malformed lines" % analysis.skipped, file=sys.stderr)
+    return 0
@@ -5,13 +5,18 @@ categorized into one of the following four categories:
     * b. raised an expected exception, to be acknowledged, see accept_on[] -> return True
     * c. raised an expected exception, NOT to be acknowledged, see decline_on[] -> return False
     * d. raised an unexpected exception, -> re-raise
+
+Functions, `async def` coroutine functions and `async def` generators are supported.
 """
-import time
-import traceback
+import inspect
 from functools import wraps
-from typing import Any, Callable, Dict, List, Optional, Type
+from typing import Any, Callable, Dict, List, Optional, Type, Union
 
-from atl_observe.lib.utils import Provider, Resolver
+from atl_observe.lib.clock import UNIT_MS, Clock
+from atl_observe.lib.context import current_span, current_trace_id, leave
+from atl_observe.lib.notifier import notifier
+from atl_observe.lib.plan import ACCEPTED, DECLINED, Plan
+from atl_observe.lib.utils import Provider
 
 
 def observe(metric: str,
@@ -19,7 +24,20 @@ def observe(metric: str,
             decline_on: List[Type[Exception]] = [],  # pylint: disable=E1136
             static_tags: List[str] = [],  # pylint: disable=E1136
             tags_from: Optional[Dict[str, List[str]]] = None,  # pylint: disable=E1136
-            trace_id_from: Optional[Dict[str, str]] = None) -> Any:  # pylint: disable=E1136
+            trace_id_from: Optional[Dict[str, str]] = None,  # pylint: disable=E1136
+            sample_rate: Optional[float] = None,  # pylint: disable=E1136
+            sample_budget: Optional[float] = None,  # pylint: disable=E1136
+            sketch: bool = False,
+            sketch_tags: bool = False,
+            sli_thresholds: Optional[Dict[Union[int, float], str]] = None,  # pylint: disable=E1136
+            unit: str = UNIT_MS,
+            clock: Optional[Clock] = None,  # pylint: disable=E1136
+            traceback_limit: Optional[int] = None,  # pylint: disable=E1136
+            traceback_on_accept: bool = True,
+            max_tag_values: Union[int, Dict[str, int], None] = None,  # pylint: disable=E1136
+            self_time: bool = False,
+            parent_tag: bool = False,
+            overhead: bool = False) -> Any:
     """This operator will, based on the provided setup generate logs, metrics, notifications on each call for that execution.
 
     Args:
@@ -27,91 +45,229 @@ def observe(metric: str,
         accept_on (Optional[List[Exception]], optional): A list of exceptions on which the message will be acknowledged.
         decline_on (Optional[List[Exception]], optional): A list of exceptions on which the message will be declined.
         static_tags (Optional[List[str]], optional): A list of tags to be appended on each metric update.
-        tags_from (Optional[Dict[str, List[str]]], optional): A list of tags to be dynamically extracted from the key dictionary.
-        trace_id_from (Optional[Dict[str, str]], optional): A trace_id to be appended on each log from the key dictionary.
+        tags_from (Optional[Dict[str, List[str]]], optional): A list of tags to be dynamically extracted from the key dictionary,
+            each field is a path like `headers.region` or `records[0].type`, optionally named `tenant=headers.tenantId`,
+            see atl_observe.lib.paths.
+        trace_id_from (Optional[Dict[str, str]], optional): A trace_id to be appended on each log from the key dictionary,
+            the field is a path like `headers.traceId`.
+        sample_rate (Optional[float], optional): The share of successful calls reported, decided once per call. The
+            counts of a reported call are scaled by 1/sample_rate, its timing is sent once: the `.count` of the timing
+            histogram counts reported calls only, use `<metric>.finished` for the call rate, see atl_observe.lib.sampling.
+        sample_budget (Optional[float], optional): The successful calls per second to report, lowers the sample_rate
+            adaptively if the function is called more often. Exceptions are always reported.
+        sketch (bool, optional): Maintains an in-process latency sketch per timing metric, sent as gauges each 60s to the
+            client of the first call unless `sketches.start` or `sketches.stop` was called, see atl_observe.lib.sketch.
+        sketch_tags (bool, optional): Maintains the latency sketches per timing metric and tags.
+        sli_thresholds (Optional[Dict[Union[int, float], str]], optional): The `observed_sli` thresholds in ms mapped to
+            the tag, validated at decoration. Defaults to observe_threshold_map.
+        unit (str, optional): The unit of the reported timing and gauge, "ms" or "us" (float). Defaults to "ms".
+        clock (Optional[Clock], optional): The clock measuring the process time, e.g. injected in tests.
+        traceback_limit (Optional[int], optional): The innermost frames of the tracebacks in logs and notifications.
+        traceback_on_accept (bool, optional): Whether accepted exceptions are logged with traceback. Defaults to True.
+        max_tag_values (Union[int, Dict[str, int], None], optional): The distinct values per 'tags_from' key (or per
+            key in a dictionary) per hour, further values are collapsed into `key:__other__`, see CardinalityGuard.
+            Defaults to unlimited.
+        self_time (bool, optional): Sends `<metric>.self_time.<outcome>`, the process time without the nested
+            observed calls, next to the total `time`. Defaults to False.
+        parent_tag (bool, optional): Tags the metrics `parent_metric:<metric>` with the metric of the enclosing observed
+            call, if any. Defaults to False.
+        overhead (bool, optional): Measures the time spent in @observe itself, before and after the call, and sends
+            the aggregate as `<metric>.observe_overhead` gauges every 10s, see atl_observe.lib.overhead.
     """
     def arrange(func: Callable[..., Any]):
+        # compile once per decorated function, see atl_observe.lib.plan
+        plan = Plan(func=func,
+                    metric=metric,
+                    accept_on=accept_on,
+                    decline_on=decline_on,
+                    static_tags=static_tags,
+                    tags_from=tags_from,
+                    trace_id_from=trace_id_from,
+                    sample_rate=sample_rate,
+                    sample_budget=sample_budget,
+                    sketch=sketch,
+                    sketch_tags=sketch_tags,
+                    sli_thresholds=sli_thresholds,
+                    unit=unit,
+                    clock=clock,
+                    traceback_limit=traceback_limit,
+                    traceback_on_accept=traceback_on_accept,
+                    max_tag_values=max_tag_values,
+                    self_time=self_time,
+                    parent_tag=parent_tag,
+                    overhead=overhead)
+
+        if inspect.isasyncgenfunction(func):
+            return _arrange_async_generator(func, plan)
+        if inspect.iscoroutinefunction(func):
+            return _arrange_coroutine(func, plan)
+
         @wraps(func)
         def inner(*args: Any, **kwargs: Any) -> Any:
+            entered_ns: int = plan.now_ns() if plan.overhead is not None else 0
 
-            # setup tracing and tags
-            trace_id = Resolver.resolve_trace_id(trace_id_from=trace_id_from, **kwargs)
-            identity = Resolver.resolve_identity(*args, func=func, trace_id=trace_id)
-            additional_tags = Resolver.resolve_tags_from(tags_from=tags_from, **kwargs)
-            all_tags = additional_tags + static_tags
+            # open the span if needed and setup tracing and tags, the trace_id is published for nested calls
+            trace_id, parent, span, token = plan.enter(args, plan.resolve_trace_id(kwargs, args))
+            all_tags = plan.tags(kwargs, args, parent)
 
-            imetric = Provider.get_metric(*args)
+            imetric = Provider.get_metric(*args, owner=plan.method)
 
             # start timing
-            time_start: float = time.monotonic()
+            time_start: int = plan.now_ns()
+            elapsed_ns = 0
+            weight: float = 1
 
             try:
                 # actual function execution
                 response: Any = func(*args, **kwargs)
 
-                # calculate process time
-                process_time = int(time.monotonic() - time_start) * 1000
-                # append extra tags
-                all_tags.append(Resolver.resolve_observed_sli_tag(process_time=process_time))
-
-                # send metrics, finished successfully
-                imetric.timing("%s.time.finished" % metric, process_time, all_tags)
-                imetric.gauge("%s.time_gauge.finished" % metric, process_time, all_tags)
-                imetric.increment("%s.finished" % metric, 1, all_tags)
+                # measure process time, send metrics, finished successfully
+                elapsed_ns = plan.now_ns() - time_start
+                weight = plan.finished(imetric, elapsed_ns, all_tags, span)
 
             except Exception as ex:
-                # calculate process time
-                process_time = int(time.monotonic() - time_start) * 1000
-                # append extra tags
-                all_tags.append('exception:%s' % type(ex).__name__)
-                all_tags.append(Resolver.resolve_observed_sli_tag(process_time=process_time))
-
-                # accept on, returns True
-                if type(ex) in accept_on:
-                    # log warning
-                    Provider.get_logger(*args).warning("%s: %s(%s) during '%s' accepted.\n%s" % (
-                        identity, type(ex).__name__, ex, func.__name__, traceback.format_exc()))
-                    # send metrics, raised but accepted
-                    imetric.timing("%s.time.accepted" % metric, process_time, all_tags)
-                    imetric.gauge("%s.time_gauge.accepted" % metric, process_time, all_tags)
-                    imetric.increment('%s.exception.accepted' % metric, 1, all_tags)
+                # measure process time, log and send metrics
+                elapsed_ns = plan.now_ns() - time_start
+                outcome, failure = plan.failed(args, imetric, ex, elapsed_ns, all_tags, trace_id, span)
+
+                if outcome == ACCEPTED:
                     # return truthy, to be acknowledged
                     return True
-
-                # decline on, returns False
-                if type(ex) in decline_on:
-                    # log error
-                    Provider.get_logger(*args).error("%s: %s(%s) during '%s' declined.\n%s" % (
-                        identity, type(ex).__name__, ex, func.__name__, traceback.format_exc()))
-                    # send metrics, raised but declined
-                    imetric.timing("%s.time.declined" % metric, process_time, all_tags)
-                    imetric.gauge("%s.time_gauge.declined" % metric, process_time, all_tags)
-                    imetric.increment('%s.exception.declined' % metric, 1, all_tags)
+                if outcome == DECLINED:
                     # return falsy, not to be acknowledged
                     return False
 
-                # unhandled exception, log error
-                Provider.get_logger(*args).error("%s: %s(%s) during '%s' raised.\n%s" % (
-                    identity, type(ex).__name__, ex, func.__name__, traceback.format_exc()))
-
-                # send metrics, raised and unhandled
-                imetric.timing("%s.time.raised" % metric, process_time, all_tags)
-                imetric.gauge("%s.time_gauge.raised" % metric, process_time, all_tags)
-                imetric.increment('%s.exception.raised' % metric, 1, all_tags)
-
-                # check if notification client available
-                slack = Provider.get_slack(*args)
-                if slack:
-                    # notify
-                    slack.error(header=identity, title=type(ex).__name__, text=f"{ex}\n{traceback.format_exc()}")
-                # re-raise
+                # unhandled, notify and re-raise
+                plan.notify(failure)
                 raise ex
 
             finally:
-                # send metric, start
-                imetric.increment("%s.start" % metric, 1, all_tags)
+                # send metric, start, and close the span
+                plan.started(imetric, all_tags, weight)
+                if span is not None:
+                    leave(span, token, elapsed_ns)
+                if plan.overhead is not None:
+                    plan.account(imetric, entered_ns, time_start, elapsed_ns)
 
             # return actual response of the function
             return response
         return inner
     return arrange
+
+
+def _arrange_coroutine(func: Callable[..., Any], plan: Plan) -> Callable[..., Any]:
+    """Wraps an `async def` function, the awaited execution is measured.
+
+    Note: the notification is handed to a bounded worker thread, so a slow notification client does not block the loop,
+    see atl_observe.lib.notifier. The failure is logged inline, the traceback only formatted if a handler builds it.
+    """
+    @wraps(func)
+    async def inner(*args: Any, **kwargs: Any) -> Any:
+        entered_ns: int = plan.now_ns() if plan.overhead is not None else 0
+
+        # open the span if needed and setup tracing and tags, the trace_id is published for nested calls
+        trace_id, parent, span, token = plan.enter(args, plan.resolve_trace_id(kwargs, args))
+        all_tags = plan.tags(kwargs, args, parent)
+
+        imetric = Provider.get_metric(*args, owner=plan.method)
+
+        # start timing
+        time_start: int = plan.now_ns()
+        elapsed_ns = 0
+        weight: float = 1
+
+        try:
+            # actual function execution, awaited
+            response: Any = await func(*args, **kwargs)
+
+            # measure process time, send metrics, finished successfully
+            elapsed_ns = plan.now_ns() - time_start
+            weight = plan.finished(imetric, elapsed_ns, all_tags, span)
+
+        except Exception as ex:
+            # measure process time, log and send metrics
+            elapsed_ns = plan.now_ns() - time_start
+            outcome, failure = plan.failed(args, imetric, ex, elapsed_ns, all_tags, trace_id, span)
+
+            if outcome == ACCEPTED:
+                # return truthy, to be acknowledged
+                return True
+            if outcome == DECLINED:
+                # return falsy, not to be acknowledged
+                return False
+
+            # unhandled, notify in the background and re-raise
+            notifier.submit(failure)
+            raise ex
+
+        finally:
+            # send metric, start, and close the span
+            plan.started(imetric, all_tags, weight)
+            if span is not None:
+                leave(span, token, elapsed_ns)
+            if plan.overhead is not None:
+                plan.account(imetric, entered_ns, time_start, elapsed_ns)
+
+        # return actual response of the function
+        return response
+    return inner
+
+
+def _arrange_async_generator(func: Callable[..., Any], plan: Plan) -> Callable[..., Any]:
+    """Wraps an `async def` generator, the whole iteration is measured.
+
+    Note: an async generator can't return a value, on accept_on and decline_on the iteration just stops.
+    If the consumer stops early, e.g. `break`, the call is considered finished. No span is opened and the trace_id is
+    not published, as the generator runs in the context of its consumer: nested calls count to the enclosing span.
+    """
+    @wraps(func)
+    async def inner(*args: Any, **kwargs: Any) -> Any:
+        entered_ns: int = plan.now_ns() if plan.overhead is not None else 0
+
+        # setup tracing and tags, no span is opened and the trace_id is inherited only, the context can't span yields
+        trace_id = plan.resolve_trace_id(kwargs, args) or current_trace_id()
+        all_tags = plan.tags(kwargs, args, current_span())
+
+        imetric = Provider.get_metric(*args, owner=plan.method)
+
+        # start timing
+        time_start: int = plan.now_ns()
+        elapsed_ns = 0
+        weight: float = 1
+
+        generator = func(*args, **kwargs)
+        try:
+            # actual function execution, iterated
+            async for item in generator:
+                yield item
+
+            # measure process time, send metrics, finished successfully
+            elapsed_ns = plan.now_ns() - time_start
+            weight = plan.finished(imetric, elapsed_ns, all_tags)
+
+        except GeneratorExit:
+            # closed by the consumer, finished successfully
+            elapsed_ns = plan.now_ns() - time_start
+            weight = plan.finished(imetric, elapsed_ns, all_tags)
+            await generator.aclose()
+            raise
+
+        except Exception as ex:
+            # measure process time, log and send metrics
+            elapsed_ns = plan.now_ns() - time_start
+            outcome, failure = plan.failed(args, imetric, ex, elapsed_ns, all_tags, trace_id)
+
+            if outcome in (ACCEPTED, DECLINED):
+                # stop the iteration
+                return
+
+            # unhandled, notify in the background and re-raise
+            notifier.submit(failure)
+            raise ex
+
+        finally:
+            # send metric, start
+            plan.started(imetric, all_tags, weight)
+            if plan.overhead is not None:
+                plan.account(imetric, entered_ns, time_start, elapsed_ns)
+    return inner
@@ -0,0 +1,320 @@
+"""This module aggregates spooled @observe telemetry, see atl_observe.lib.spool, streaming the files line by line.
+
+Each reported call spools one timing `<metric>.time.<outcome>` and one increment of its outcome count,
+`<metric>.finished` or `<metric>.exception.<outcome>`, both tagged with its tags and `observed_sli`. The Analysis
+aggregates them per metric and the selected tag keys: the calls per outcome (the sum of the increments, scaled by
+1/sample_rate if sampled, see atl_observe.lib.sampling), the latency percentiles (in the reported unit, see
+@observe(unit=...)) and the `observed_sli` distribution, of the timings weighted like the calls of their outcome.
+The other records are skipped before they are decoded. Analyses of different files are merged, e.g. when built in a
+process pool.
+"""
+import json
+import math
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple)
+
+from atl_observe.lib.plan import ACCEPTED, DECLINED, FINISHED, RAISED
+from atl_observe.lib.sketch import LatencySketch
+from atl_observe.lib.spool import spool_files
+
+OUTCOMES = (FINISHED, ACCEPTED, DECLINED, RAISED)
+_OUTCOMES = frozenset(OUTCOMES)
+
+SLI_PREFIX = "observed_sli:"
+
+# the byte pattern of the timing and increment records, as written by the Spool
+_TIMING = b'"kind":"timing"'
+_INCREMENT = b'"kind":"increment"'
+_TS = b'{"ts":'
+
+
+def parse_time(value: str) -> float:
+    """Returns the epoch seconds of the value: epoch seconds, an ISO 8601 time or `HH:MM[:SS]` of today (local time).
+
+    Raises:
+        ValueError: if the value is none of these.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if len(value) <= 8 and ":" in value:
+        parts = [int(part) for part in value.split(":")]
+        if not 2 <= len(parts) <= 3:
+            raise ValueError("invalid time %r." % value)
+        today = datetime.now().replace(hour=parts[0], minute=parts[1], second=parts[2] if len(parts) == 3 else 0,
+                                       microsecond=0)
+        return today.timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+
+def iter_lines(path: str) -> Iterator[bytes]:  # pylint: disable=E1136
+    """Yields the lines of the file, memory-mapped so that only the pages read are loaded.
+    """
+    with open(path, "rb") as spool_file:
+        if os.fstat(spool_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(spool_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b""):
+                yield line
+
+
+class Group:
+    """The aggregation of the calls of one metric and tags, per outcome.
+
+    The timings of an outcome are weighted by its calls (the sum of its count increments) per timing, as only the
+    successful calls are sampled. Without count increments, e.g. in older spool files, each timing is one call.
+    """
+    __slots__ = ("timings", "calls", "sli", "sketches", "relative_accuracy")
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self.timings: Dict[str, int] = dict.fromkeys(OUTCOMES, 0)  # pylint: disable=E1136
+        self.calls: Dict[str, float] = dict.fromkeys(OUTCOMES, 0.0)  # pylint: disable=E1136
+        self.sli: Dict[str, Dict[str, int]] = {outcome: {} for outcome in OUTCOMES}  # pylint: disable=E1136
+        self.sketches = {outcome: LatencySketch(relative_accuracy=relative_accuracy) for outcome in OUTCOMES}
+        self.relative_accuracy = relative_accuracy
+
+    def __getstate__(self) -> Tuple[Any, ...]:  # pylint: disable=E1136
+        return self.timings, self.calls, self.sli, self.sketches, self.relative_accuracy
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:  # pylint: disable=E1136
+        self.timings, self.calls, self.sli, self.sketches, self.relative_accuracy = state
+
+    def add(self, outcome: str, value: float, sli: Optional[str]) -> None:  # pylint: disable=E1136
+        """Adds the timing of a reported call.
+        """
+        self.timings[outcome] += 1
+        if sli is not None:
+            self.sli[outcome][sli] = self.sli[outcome].get(sli, 0) + 1
+        self.sketches[outcome].add(value)
+
+    def add_calls(self, outcome: str, calls: float) -> None:
+        """Adds the count increment of a reported call, 1/sample_rate if sampled.
+        """
+        self.calls[outcome] += calls
+
+    def merge(self, other: "Group") -> None:
+        for outcome in OUTCOMES:
+            self.timings[outcome] += other.timings[outcome]
+            self.calls[outcome] += other.calls[outcome]
+            for sli, count in other.sli[outcome].items():
+                self.sli[outcome][sli] = self.sli[outcome].get(sli, 0) + count
+            self.sketches[outcome].merge(other.sketches[outcome])
+
+    def weight(self, outcome: str) -> float:
+        """Returns the calls per timing of the outcome.
+        """
+        timings, calls = self.timings[outcome], self.calls[outcome]
+        return calls / timings if timings and calls else 1.0
+
+    def summary(self) -> Dict[str, Any]:  # pylint: disable=E1136
+        """Returns the count, the count and ratio per outcome, p50, p90, p99, max and the sli ratios.
+        """
+        weights = {outcome: self.weight(outcome) for outcome in OUTCOMES}
+        calls = {outcome: self.timings[outcome] * weights[outcome] for outcome in OUTCOMES}
+        count = sum(calls.values())
+        summary: Dict[str, Any] = {"count": round(count)}  # pylint: disable=E1136
+        for outcome in OUTCOMES:
+            summary[outcome] = round(calls[outcome])
+            summary["%s_ratio" % outcome] = calls[outcome] / count if count else 0.0
+
+        sketch = LatencySketch(relative_accuracy=self.relative_accuracy)
+        sli: Dict[str, float] = {}  # pylint: disable=E1136
+        for outcome in OUTCOMES:
+            sketch.merge(self.sketches[outcome], weights[outcome])
+            for name, sli_count in self.sli[outcome].items():
+                sli[name] = sli.get(name, 0.0) + sli_count * weights[outcome]
+        summary.update((name, value) for name, value in sketch.summary().items() if name != "count")
+        summary["sli"] = {name: sli_count / count for name, sli_count in sorted(sli.items())} if count else {}
+        return summary
+
+
+class Analysis:
+    """The Analysis aggregates the spooled calls per metric and the values of the `by` tag keys.
+    """
+
+    def __init__(self,
+                 by: Sequence[str] = (),  # pylint: disable=E1136
+                 metric: Optional[str] = None,  # pylint: disable=E1136
+                 tags: Sequence[str] = (),  # pylint: disable=E1136
+                 since: Optional[float] = None,  # pylint: disable=E1136
+                 until: Optional[float] = None,  # pylint: disable=E1136
+                 relative_accuracy: float = 0.01) -> None:
+        """Initializes the Analysis.
+
+        Args:
+            by (Sequence[str], optional): the tag keys to group by, e.g. ["tenant"]. Defaults to the metric only.
+            metric (Optional[str], optional): only the metrics starting with the prefix. Defaults to all.
+            tags (Sequence[str], optional): only the calls tagged with all of the tags, e.g. ["type:a"].
+            since (Optional[float], optional): only the calls at or after the epoch seconds.
+            until (Optional[float], optional): only the calls before the epoch seconds.
+            relative_accuracy (float, optional): the accuracy of the percentiles, see LatencySketch.
+        """
+        self.by = tuple(by)
+        self.metric = metric
+        self.tags = frozenset(tags)
+        self.since = since
+        self.until = until
+        self.relative_accuracy = relative_accuracy
+        self.groups: Dict[Tuple[str, Tuple[str, ...]], Group] = {}  # pylint: disable=E1136
+        self.skipped = 0
+
+    def _in_range(self, line: bytes) -> bool:
+        """Returns whether the ts of the line, the first field written by the Spool, is in [since, until).
+        """
+        if not line.startswith(_TS):
+            return True
+        try:
+            ts = float(line[len(_TS):line.index(b",", len(_TS))])
+        except ValueError:
+            return True
+        return (self.since is None or ts >= self.since) and (self.until is None or ts < self.until)
+
+    def add_line(self, line: bytes) -> None:
+        """Adds the line if it is a timing or count record of a call in the filters.
+        """
+        if _TIMING not in line and _INCREMENT not in line:
+            return
+        if (self.since is not None or self.until is not None) and not self._in_range(line):
+            return
+        try:
+            record = json.loads(line)
+        except ValueError:
+            self.skipped += 1
+            return
+        if isinstance(record, dict):
+            self.add(record)
+
+    def add(self, record: Dict[str, Any]) -> None:  # pylint: disable=E1136
+        """Adds the record if it is the timing `<metric>.time.<outcome>` or the count `<metric>.finished`,
+        `<metric>.exception.<outcome>` of a call in the filters.
+        """
+        name, _, outcome = str(record.get("metric", "")).rpartition(".")
+        if outcome not in _OUTCOMES:
+            return
+        kind = record.get("kind")
+        if kind == "timing" and name.endswith(".time"):
+            metric = name[:-len(".time")]
+        elif kind == "increment" and outcome == FINISHED:
+            metric = name
+        elif kind == "increment" and name.endswith(".exception"):
+            metric = name[:-len(".exception")]
+        else:
+            return
+        if self.metric is not None and not metric.startswith(self.metric):
+            return
+        ts = record.get("ts", 0)
+        if self.since is not None and ts < self.since or self.until is not None and ts >= self.until:
+            return
+        tags = record.get("tags") or []
+        if self.tags and not self.tags.issubset(tags):
+            return
+
+        sli = None
+        values: Dict[str, str] = {}  # pylint: disable=E1136
+        for tag in tags:
+            if tag.startswith(SLI_PREFIX):
+                sli = tag[len(SLI_PREFIX):]
+            elif self.by:
+                key, _, value = tag.partition(":")
+                values[key] = value
+        key = (metric, tuple("%s:%s" % (by, values[by]) for by in self.by if by in values))
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = Group(self.relative_accuracy)
+        if kind == "timing":
+            group.add(outcome, record.get("value", 0.0), sli)
+        else:
+            group.add_calls(outcome, record.get("value", 1))
+
+    def add_file(self, path: str) -> "Analysis":
+        """Adds the calls of the spool file, streaming it line by line.
+        """
+        for line in iter_lines(path):
+            self.add_line(line)
+        return self
+
+    def merge(self, other: "Analysis") -> None:
+        """Merges the groups of the other Analysis, built with the same filters.
+        """
+        for key, group in other.groups.items():
+            mine = self.groups.get(key)
+            if mine is None:
+                self.groups[key] = group
+            else:
+                mine.merge(group)
+        self.skipped += other.skipped
+
+    def empty(self) -> "Analysis":
+        """Returns an Analysis with the same filters and no groups.
+        """
+        return Analysis(by=self.by, metric=self.metric, tags=tuple(self.tags), since=self.since, until=self.until,
+                        relative_accuracy=self.relative_accuracy)
+
+    def rows(self, sort: str = "count", top: Optional[int] = None) -> List[Dict[str, Any]]:  # pylint: disable=E1136
+        """Returns the summary of each group with its metric and tags, sorted descending by the summary field.
+        """
+        rows = []
+        for (metric, tags), group in self.groups.items():
+            if not any(group.timings.values()):
+                continue
+            row: Dict[str, Any] = {"metric": metric, "tags": list(tags)}  # pylint: disable=E1136
+            row.update(group.summary())
+            rows.append(row)
+        rows.sort(key=lambda row: (-_sortable(row.get(sort)), row["metric"], row["tags"]))
+        return rows[:top] if top else rows
+
+
+def _sortable(value: Any) -> float:
+    return value if isinstance(value, (int, float)) and not math.isnan(value) else -math.inf
+
+
+def _analyze_file(analysis: Analysis, path: str) -> Analysis:
+    return analysis.empty().add_file(path)
+
+
+def analyze(paths: Iterable[str], analysis: Analysis, jobs: int = 1) -> Analysis:  # pylint: disable=E1136
+    """Adds the calls of the spool files (or directories) to the analysis, in a process pool if jobs > 1.
+
+    Args:
+        paths (Iterable[str]): the spool files or directories, see atl_observe.lib.spool.spool_files.
+        analysis (Analysis): the analysis to add to.
+        jobs (int, optional): the processes analyzing the files in parallel, one file per task. Defaults to 1.
+
+    Returns:
+        Analysis: the analysis.
+    """
+    files = spool_files(list(paths))
+    if jobs <= 1 or len(files) <= 1:
+        for path in files:
+            analysis.add_file(path)
+        return analysis
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as executor:
+        for partial in executor.map(_analyze_file, [analysis] * len(files), files):
+            analysis.merge(partial)
+    return analysis
+
+
+def format_rows(rows: List[Dict[str, Any]]) -> str:  # pylint: disable=E1136
+    """Returns the rows as a text table.
+    """
+    header = ("metric", "tags", "count", "finished", "accepted", "declined", "raised", "p50", "p90", "p99", "max",
+              "observed_sli")
+    lines = [header]
+    for row in rows:
+        lines.append((
+            row["metric"], ",".join(row["tags"]), str(row["count"]),
+            *("%.1f%%" % (row["%s_ratio" % outcome] * 100) for outcome in OUTCOMES),
+            *(_format_number(row.get(name)) for name in ("p50", "p90", "p99", "max")),
+            " ".join("%s=%.0f%%" % (sli, ratio * 100) for sli, ratio in row["sli"].items())))
+    widths = [max(len(line[column]) for line in lines) for column in range(len(header))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in lines) + "\n"
+
+
+def _format_number(value: Optional[float]) -> str:  # pylint: disable=E1136
+    return "-" if value is None else "%.2f" % value
@@ -0,0 +1,50 @@
+"""This module defines the clock used by the @observe decorator to measure the process time.
+"""
+import time
+from typing import Callable, Dict
+
+# the reported units of the process time, see @observe(unit=...)
+UNIT_MS = "ms"
+UNIT_US = "us"
+
+# nanoseconds per reported unit
+NS_PER_UNIT: Dict[str, float] = {  # pylint: disable=E1136
+    UNIT_MS: 1e6,
+    UNIT_US: 1e3,
+}
+
+
+class Clock:
+    """The Clock returns a monotonic time in nanoseconds, based on time.perf_counter_ns.
+
+    Note: subclass and overwrite now_ns to inject a clock, e.g. in tests.
+    """
+
+    def now_ns(self) -> int:
+        """Returns the current monotonic time in nanoseconds.
+        """
+        return time.perf_counter_ns()
+
+
+class ManualClock(Clock):
+    """The ManualClock returns a time which only changes when advanced, used in tests.
+    """
+
+    def __init__(self, start_ns: int = 0) -> None:
+        self.time_ns = start_ns
+
+    def now_ns(self) -> int:
+        return self.time_ns
+
+    def advance(self, nanoseconds: int = 0, milliseconds: float = 0) -> None:
+        """Advances the time by the nanoseconds and milliseconds.
+        """
+        self.time_ns += nanoseconds + int(milliseconds * 1e6)
+
+
+def get_now_ns(clock: Clock) -> Callable[[], int]:
+    """Returns the fastest callable for the clock, time.perf_counter_ns itself for the default Clock.
+    """
+    if type(clock) is Clock:  # pylint: disable=C0123
+        return time.perf_counter_ns
+    return clock.now_ns
@@ -0,0 +1,184 @@
+"""This module propagates the Span of the active @observe call in a contextvars.ContextVar.
+
+A decorated call opens a Span if needed: with a trace_id, with self time, nested in another span, or once any
+function uses parent_tag. Nested decorated calls open child spans: the child time is summed up in the parent to
+derive its self time. A decorated function which resolves a trace_id publishes it in its Span, nested decorated
+functions without an own trace_id inherit it. asyncio tasks copy the context on creation, the helpers below carry it
+into threads, e.g. ThreadPoolExecutor work items and loop.run_in_executor.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Optional, Tuple
+
+
+class TraceContext:
+    """The trace_id and identity of the active @observe call.
+
+    Note: the identity is resolved lazily, only if consumed, e.g. by current_identity, and at most once.
+    """
+    __slots__ = ("trace_id", "_identity", "_resolve", "_args")
+
+    def __init__(self,
+                 trace_id: str,
+                 identity: Optional[str] = None,  # pylint: disable=E1136
+                 resolve: Optional[Callable[..., str]] = None,  # pylint: disable=E1136
+                 args: Tuple[Any, ...] = ()) -> None:  # pylint: disable=E1136
+        """Initializes the TraceContext.
+
+        Args:
+            trace_id (str): the trace_id.
+            identity (Optional[str], optional): the identity, else resolved on first use.
+            resolve (Optional[Callable[..., str]], optional): called with the args and trace_id to resolve the identity.
+            args (Tuple[Any, ...], optional): the positional args of the call.
+        """
+        self.trace_id = trace_id
+        self._identity = identity
+        self._resolve = resolve
+        self._args = args
+
+    @property
+    def identity(self) -> str:
+        """Returns the identity of the call, e.g. `Engine(abcd)`, see Resolver.resolve_identity.
+        """
+        if self._identity is None:
+            resolve = self._resolve
+            self._identity = resolve(*self._args, trace_id=self.trace_id) if resolve is not None else ""
+            self._resolve, self._args = None, ()
+        return self._identity
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, TraceContext):
+            return NotImplemented
+        return self.trace_id == other.trace_id and self.identity == other.identity
+
+    def __hash__(self) -> int:
+        return hash(self.trace_id)
+
+    def __repr__(self) -> str:
+        return "TraceContext(trace_id=%r, identity=%r)" % (self.trace_id, self.identity)
+
+
+class Span:
+    """The Span of an active @observe call, the spans of nested calls form a stack through their parents.
+
+    Note: the process time of the finished child spans is summed up in child_ns, to derive the self time.
+    Children running concurrently, e.g. in tasks or threads, may sum up to more than the total time.
+    """
+    __slots__ = ("metric", "tag", "parent", "trace", "child_ns")
+
+    def __init__(self,
+                 metric: str,
+                 tag: str,
+                 parent: Optional["Span"] = None,  # pylint: disable=E1136
+                 trace: Optional[TraceContext] = None) -> None:  # pylint: disable=E1136
+        self.metric = metric
+        self.tag = tag
+        self.parent = parent
+        self.trace = trace
+        self.child_ns = 0
+
+    def self_ns(self, elapsed_ns: int) -> int:
+        """Returns the elapsed nanoseconds excluding the time of the child spans, never negative.
+        """
+        self_ns = elapsed_ns - self.child_ns
+        return self_ns if self_ns > 0 else 0
+
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar(  # pylint: disable=E1136
+    "atl_observe_span", default=None)
+
+
+# whether every @observe call opens a span, e.g. to be found as parent by a nested call with parent_tag
+_tracking = False
+
+
+def track() -> None:
+    """Makes every @observe call open a span from now on, not only the calls with a trace_id or self time.
+    """
+    global _tracking  # pylint: disable=W0603
+    _tracking = True
+
+
+def tracking() -> bool:
+    """Returns whether every @observe call opens a span, see track.
+    """
+    return _tracking
+
+
+def current_span() -> Optional[Span]:  # pylint: disable=E1136
+    """Returns the Span of the active @observe call, None outside.
+    """
+    return _current.get()
+
+
+def current() -> Optional[TraceContext]:  # pylint: disable=E1136
+    """Returns the active TraceContext, None outside of a traced @observe call.
+    """
+    span = _current.get()
+    return span.trace if span is not None else None
+
+
+def current_trace_id() -> str:
+    """Returns the active trace_id, empty string outside of a traced @observe call.
+    """
+    trace = current()
+    return trace.trace_id if trace is not None else ""
+
+
+def current_identity() -> str:
+    """Returns the identity of the active traced @observe call, e.g. `Engine(abcd)`, empty string outside.
+    """
+    trace = current()
+    return trace.identity if trace is not None else ""
+
+
+def enter(metric: str,
+          tag: str,
+          trace: Optional[TraceContext] = None) -> Tuple[Span, "contextvars.Token[Optional[Span]]"]:  # pylint: disable=E1136
+    """Opens a child Span of the active one, inheriting its trace if no trace was provided.
+
+    Returns:
+        Tuple[Span, contextvars.Token]: the Span and the token to pass to leave.
+    """
+    parent = _current.get()
+    if trace is None and parent is not None:
+        trace = parent.trace
+    span = Span(metric, tag, parent, trace)
+    return span, _current.set(span)
+
+
+def leave(span: Span, token: "contextvars.Token[Optional[Span]]", elapsed_ns: int) -> None:  # pylint: disable=E1136
+    """Closes the Span, adding the elapsed nanoseconds to the child time of its parent.
+    """
+    _current.reset(token)
+    parent = span.parent
+    if parent is not None:
+        parent.child_ns += elapsed_ns
+
+
+def wrap(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Returns a callable which runs the function in a copy of the current context, e.g. in another thread.
+
+    Note: the context is captured once, each call runs in its own copy of it, so the callable can run concurrently,
+    e.g. mapped over a ThreadPoolExecutor.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def inner(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(func, *args, **kwargs)
+    return inner
+
+
+def submit(executor: Executor, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """Submits the function to the executor, e.g. a ThreadPoolExecutor, running in a copy of the current context.
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def run_in_executor(executor: Optional[Executor], func: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":  # pylint: disable=E1136
+    """Runs the function in the executor of the running loop (None for the default), in a copy of the current context.
+    """
+    return asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, func, *args)
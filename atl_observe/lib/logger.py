@@ -3,7 +3,15 @@
 import logging
 import os
 import sys
+import threading
 from logging import Logger as L
+from typing import List, Optional, Union
+
+# the name of the default logger, part of the logging.getLogger hierarchy
+DEFAULT_LOGGER_NAME = "Observe"
+
+_default_logger: Optional[logging.Logger] = None  # pylint: disable=E1136
+_default_lock = threading.Lock()
 
 
 class Logger(L):
@@ -18,3 +26,51 @@ class Logger(L):
         super().__init__(name=name)
         self.setLevel(os.environ.get("LOG_LEVEL", logging.INFO))
         self.addHandler(logging.StreamHandler(sys.stdout))
+
+
+def get_default_logger() -> logging.Logger:
+    """Returns the default logger used by @observe when no logger was found, logging.getLogger("Observe").
+
+    Note: on first use, a logger without handlers and level gets one stdout handler and the os.environ LOG_LEVEL
+    (else INFO). Handlers, level and propagate set by the application are kept, see configure_default_logger.
+    """
+    global _default_logger  # pylint: disable=W0603
+    logger = _default_logger
+    if logger is not None:
+        return logger
+    with _default_lock:
+        if _default_logger is None:
+            logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+            if not logger.handlers and logger.level == logging.NOTSET:
+                logger.setLevel(os.environ.get("LOG_LEVEL", logging.INFO))
+                logger.addHandler(logging.StreamHandler(sys.stdout))
+            _default_logger = logger
+        return _default_logger  # type: ignore
+
+
+def configure_default_logger(
+        level: Union[int, str, None] = None,  # pylint: disable=E1136
+        handlers: Optional[List[logging.Handler]] = None,  # pylint: disable=E1136
+        propagate: bool = False) -> logging.Logger:
+    """(Re)configures the default logger, logging.getLogger("Observe"), replacing its handlers.
+
+    Args:
+        level (Union[int, str, None], optional): the log level. Defaults to os.environ LOG_LEVEL, else INFO.
+        handlers (Optional[List[logging.Handler]], optional): replaces the handlers. Defaults to one stdout handler,
+            pass an empty list together with propagate=True to route the logs through your own (root) handlers.
+        propagate (bool, optional): whether records are passed to the parent loggers. Defaults to False.
+
+    Returns:
+        logging.Logger: the configured default logger.
+    """
+    global _default_logger  # pylint: disable=W0603
+    with _default_lock:
+        logger = logging.getLogger(DEFAULT_LOGGER_NAME)
+        logger.setLevel(level if level is not None else os.environ.get("LOG_LEVEL", logging.INFO))
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        for handler in (handlers if handlers is not None else [logging.StreamHandler(sys.stdout)]):
+            logger.addHandler(handler)
+        logger.propagate = propagate
+        _default_logger = logger
+    return logger
@@ -1,6 +1,11 @@
 """This module defines an example of a custom IMetric implementation.
 """
-from typing import Any, List, Optional, Text
+import atexit
+import os
+import threading
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Text, Tuple, Union
 
 from datadog import DogStatsd
 
@@ -15,8 +20,16 @@ class IncrementNotImplementedError(NotImplementedError):
     """
 
 
+class GaugeNotImplementedError(NotImplementedError):
+    """Raised if the gauge method of an IMetric implementation is missing.
+    """
+
+
 class IMetric:
     """This interface defines methods the @observe decorator is going to call, it is a sub-set of DogStatsd.
+
+    Note: the implementations which aggregate or record in process, e.g. AggregatedMetric, ignore the sample_rate:
+    nothing is sent per call, so every value is kept. @observe passes none, see atl_observe.lib.sampling.
     """
 
     def timing(
@@ -39,6 +52,16 @@ class IMetric:
         """
         raise IncrementNotImplementedError("%s: the method is not implemented." % self.__class__.__name__)
 
+    def gauge(
+            self,
+            metric: Text,
+            value: float,
+            tags: Optional[List[str]] = None,  # pylint: disable=E1136
+            sample_rate: Optional[float] = None) -> Any:  # pylint: disable=E1136
+        """Record the current value of the metric, appends tags.
+        """
+        raise GaugeNotImplementedError("%s: the method is not implemented." % self.__class__.__name__)
+
 
 class Metric(DogStatsd, IMetric):
     """This is an example of a custom IMetric implementation, using the actual DogStatsd client which @observers would
@@ -55,3 +78,268 @@ class Metric(DogStatsd, IMetric):
         """Initializes the Metric client.
         """
         super(Metric, self).__init__(**kwargs)
+
+
+class MemoryMetric(IMetric):
+    """This IMetric implementation keeps the last max_records calls in memory, e.g. for tests and benchmarks.
+
+    Each record is a tuple (kind, metric, value, tags), kind being "timing", "increment" or "gauge".
+    """
+
+    def __init__(self, max_records: int = 10000) -> None:
+        """Initializes the MemoryMetric.
+
+        Args:
+            max_records (int, optional): the records kept, the oldest are dropped. Defaults to 10000.
+        """
+        self.records: Deque[Tuple[str, Text, float, Optional[List[str]]]] = deque(maxlen=max_records)  # pylint: disable=E1136
+        self.count = 0
+
+    def timing(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        self.count += 1
+        self.records.append(("timing", metric, value, tags))
+
+    def increment(self, metric: Text, value: float = 1, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        self.count += 1
+        self.records.append(("increment", metric, value, tags))
+
+    def gauge(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        self.count += 1
+        self.records.append(("gauge", metric, value, tags))
+
+    def clear(self) -> None:
+        """Drops all records.
+        """
+        self.records.clear()
+        self.count = 0
+
+
+class AggregatedMetric(IMetric):
+    """This IMetric implementation aggregates in memory and flushes to the underlying client, on an interval or when
+    the number of aggregated contexts (metric, tags) reaches max_contexts.
+
+    Aggregation per (metric, tags):
+        * increment -> one increment with the sum
+        * gauge -> one gauge with the last value
+        * timing -> gauges `<metric>.avg`, `<metric>.min`, `<metric>.max` and increment `<metric>.count`
+
+    Note: buffered values are dropped in a forked child, the parent flushes them. AggregatedMetric.close stops the flush
+    thread, the values aggregated afterwards are sent on flush and on interpreter shutdown.
+    """
+
+    def __init__(self,
+                 client: Union[IMetric, DogStatsd, None] = None,  # pylint: disable=E1136
+                 flush_interval: float = 10.0,
+                 max_contexts: int = 10000) -> None:
+        """Initializes the AggregatedMetric client.
+
+        Args:
+            client (IMetric | DogStatsd, optional): the client to flush to. Defaults to the process-wide default.
+            flush_interval (float, optional): the seconds between flushes. Defaults to 10.0.
+            max_contexts (int, optional): the number of contexts which triggers an early flush. Defaults to 10000.
+        """
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_contexts = max_contexts
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        self._reset()
+        _aggregated_clients.add(self)
+
+    def _reset(self) -> None:
+        self._counters: Dict[Tuple[Text, Tuple[str, ...]], float] = {}  # pylint: disable=E1136
+        self._gauges: Dict[Tuple[Text, Tuple[str, ...]], float] = {}  # pylint: disable=E1136
+        self._timings: Dict[Tuple[Text, Tuple[str, ...]], List[float]] = {}  # pylint: disable=E1136
+        self._contexts = 0
+
+    def timing(
+            self,
+            metric: Text,
+            value: float,
+            tags: Optional[List[str]] = None,  # pylint: disable=E1136
+            sample_rate: Optional[float] = None) -> Any:  # pylint: disable=E1136
+        """Aggregates count, sum, min and max of the timing value for the metric and tags.
+        """
+        key = (metric, tuple(tags) if tags else ())
+        with self._lock:
+            summary = self._timings.get(key)
+            if summary is None:
+                self._timings[key] = [1, value, value, value]
+                self._contexts += 1
+            else:
+                summary[0] += 1
+                summary[1] += value
+                if value < summary[2]:
+                    summary[2] = value
+                if value > summary[3]:
+                    summary[3] = value
+        self._touch()
+
+    def increment(
+            self,
+            metric: Text,
+            value: float = 1,
+            tags: Optional[List[str]] = None,  # pylint: disable=E1136
+            sample_rate: Optional[float] = None) -> Any:  # pylint: disable=E1136
+        """Aggregates the sum of the values for the metric and tags.
+        """
+        key = (metric, tuple(tags) if tags else ())
+        with self._lock:
+            current = self._counters.get(key)
+            if current is None:
+                self._counters[key] = value
+                self._contexts += 1
+            else:
+                self._counters[key] = current + value
+        self._touch()
+
+    def gauge(
+            self,
+            metric: Text,
+            value: float,
+            tags: Optional[List[str]] = None,  # pylint: disable=E1136
+            sample_rate: Optional[float] = None) -> Any:  # pylint: disable=E1136
+        """Keeps the last value for the metric and tags.
+        """
+        key = (metric, tuple(tags) if tags else ())
+        with self._lock:
+            if key not in self._gauges:
+                self._contexts += 1
+            self._gauges[key] = value
+        self._touch()
+
+    def _touch(self) -> None:
+        """Starts the flush thread on first use (and in a forked child) unless closed, wakes it early on max_contexts.
+        """
+        worker = self._worker
+        if (worker is None or not worker.is_alive()) and not self._closed.is_set():
+            with self._lock:
+                if (self._worker is None or not self._worker.is_alive()) and not self._closed.is_set():
+                    self._worker = threading.Thread(target=self._run, name="observe-aggregate", daemon=True)
+                    self._worker.start()
+        if self._contexts >= self.max_contexts:
+            self._wake.set()
+
+    def _run(self) -> None:
+        """Flushes each flush_interval until closed, runs in the flush thread.
+        """
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self, timeout: Optional[float] = None) -> None:  # pylint: disable=E1136
+        """Stops and joins the flush thread, then sends the remaining aggregated values.
+
+        Args:
+            timeout (Optional[float], optional): the seconds to wait for the flush thread. Defaults to None, wait forever.
+        """
+        with self._lock:
+            self._closed.set()
+            worker = self._worker
+        self._wake.set()
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+        self.flush()
+
+    def flush(self) -> None:
+        """Sends all aggregated values to the underlying client, resets the aggregation.
+        """
+        with self._lock:
+            counters, gauges, timings = self._counters, self._gauges, self._timings
+            self._reset()
+
+        client = self.client or get_default_metric()
+        for (metric, tags), value in counters.items():
+            client.increment(metric, value, list(tags))
+        for (metric, tags), value in gauges.items():
+            client.gauge(metric, value, list(tags))
+        for (metric, tags), (count, total, minimum, maximum) in timings.items():
+            send_summary(client, metric, list(tags), count, total, minimum, maximum)
+
+    def _after_fork_in_child(self) -> None:
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._reset()
+
+
+def send_summary(client: Union[IMetric, DogStatsd],  # pylint: disable=E1136
+                 metric: Text,
+                 tags: List[str],  # pylint: disable=E1136
+                 count: float,
+                 total: float,
+                 minimum: float,
+                 maximum: float) -> None:
+    """Sends the aggregated timings of a metric, gauges `<metric>.avg`, `.min`, `.max` and increment `<metric>.count`.
+    """
+    client.gauge("%s.avg" % metric, total / count, tags)
+    client.gauge("%s.min" % metric, minimum, tags)
+    client.gauge("%s.max" % metric, maximum, tags)
+    client.increment("%s.count" % metric, count, tags)
+
+
+# all AggregatedMetric clients, flushed on interpreter shutdown, reset in forked children
+_aggregated_clients: "weakref.WeakSet[AggregatedMetric]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_aggregated() -> None:
+    for client in list(_aggregated_clients):
+        try:
+            client.flush()
+        except Exception:  # pylint: disable=W0703
+            pass
+
+
+# the process-wide default client, used when no client was found for a call
+_default_metric: Union[IMetric, DogStatsd, None] = None  # pylint: disable=E1136
+_default_registered: bool = False
+_default_lock = threading.Lock()
+
+
+def get_default_metric() -> Union[IMetric, DogStatsd]:  # pylint: disable=E1136
+    """Returns the process-wide default client, creates a Metric() on first use unless one was registered.
+
+    Note: the created Metric() is configured via os.environ, e.g. DD_AGENT_HOST, DD_DOGSTATSD_PORT, DATADOG_TAGS.
+    """
+    metric = _default_metric
+    if metric is not None:
+        return metric
+    with _default_lock:
+        if _default_metric is None:
+            _set_default_metric(Metric(), registered=False)
+        return _default_metric  # type: ignore
+
+
+def set_default_metric(metric: Union[IMetric, DogStatsd, None]) -> None:  # pylint: disable=E1136
+    """Registers the process-wide default client, e.g. at startup. None resets to the lazily created Metric().
+    """
+    with _default_lock:
+        _set_default_metric(metric, registered=metric is not None)
+
+
+def _set_default_metric(metric: Union[IMetric, DogStatsd, None], registered: bool) -> None:  # pylint: disable=E1136
+    global _default_metric, _default_registered  # pylint: disable=W0603
+    _default_metric = metric
+    _default_registered = registered
+
+
+def _after_fork_in_child() -> None:
+    """Drops the lazily created default in a forked child, so the child creates its own client (and socket).
+    Drops the values buffered by AggregatedMetric clients, those are flushed by the parent.
+
+    Note: a registered client is kept, DogStatsd handles forks of its own instances.
+    """
+    global _default_lock  # pylint: disable=W0603
+    _default_lock = threading.Lock()
+    if not _default_registered:
+        _set_default_metric(None, registered=False)
+    for client in list(_aggregated_clients):
+        client._after_fork_in_child()  # pylint: disable=W0212
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
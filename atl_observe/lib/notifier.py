@@ -0,0 +1,127 @@
+"""This module defines the worker delivering the notifications of failed coroutines and async generators, see
+atl_observe.decorator.
+
+The notification of a failed call is sent synchronously by default, see Slack. In a coroutine this would block the
+event loop, so it is handed to a dedicated worker thread with a bounded queue instead of the default executor of the
+loop, which is shared with the application and unbounded.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+from atl_observe.lib.metrics import get_default_metric
+from atl_observe.lib.slack import DEFAULT_TIMEOUT
+from atl_observe.lib.utils import Provider
+
+if TYPE_CHECKING:
+    from atl_observe.lib.plan import Failure, Plan
+
+# notifications waiting for the worker, further notifications are dropped
+DEFAULT_QUEUE_SIZE = 100
+
+
+class Notifier:
+    """This class delivers the notifications of failed calls in a worker thread.
+
+    The payload is resolved on the calling thread before the hand-off, so the worker never reads the arguments of the
+    call, which may be modified after it failed. If the queue is full the notification is dropped and counted as
+    `observe.notify.dropped`. The failure is still logged inline by the calling thread, see Plan.report: the traceback
+    is only formatted there if a handler builds the message.
+    """
+
+    def __init__(self, max_queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        """Initializes the Notifier.
+
+        Args:
+            max_queue_size (int, optional): the maximum of queued notifications. Defaults to DEFAULT_QUEUE_SIZE.
+
+        Raises:
+            ValueError: if max_queue_size is not positive.
+        """
+        if max_queue_size <= 0:
+            raise ValueError("max_queue_size must be positive, got %r" % max_queue_size)
+        self.dropped = 0
+        self._queue: "queue.Queue[Failure]" = queue.Queue(maxsize=max_queue_size)
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        self._lock = threading.Lock()
+
+    def submit(self, failure: "Failure") -> bool:
+        """Resolves the identity and traceback of the failure and queues its notification.
+
+        Returns:
+            bool: False if the queue was full and the notification dropped.
+        """
+        failure.identity  # pylint: disable=W0104
+        failure.traceback  # pylint: disable=W0104
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(failure)
+            return True
+        except queue.Full:
+            pass
+        with self._lock:
+            self.dropped += 1
+        try:
+            get_default_metric().increment("observe.notify.dropped", 1)
+        except Exception:  # pylint: disable=W0703
+            pass
+        return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:  # pylint: disable=E1136
+        """Waits until all queued notifications have been delivered (or failed).
+
+        Args:
+            timeout (Optional[float], optional): the seconds to wait at most. Defaults to None, wait forever.
+
+        Returns:
+            bool: True if the queue was drained.
+        """
+        if self._worker is None or not self._worker.is_alive():
+            return self._queue.unfinished_tasks == 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _ensure_worker(self) -> None:
+        """Starts the worker thread on first use, and again in a forked child.
+        """
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._drain, name="observe-notify", daemon=True)
+                self._worker.start()
+
+    def _drain(self) -> None:
+        """Sends the queued notifications, runs in the worker thread, failures are logged.
+        """
+        while True:
+            failure = self._queue.get()
+            plan: "Plan" = failure.plan
+            try:
+                plan.notify(failure)
+            except Exception as ex:  # pylint: disable=W0703
+                Provider.get_logger(*failure.args, owner=plan.method).error(
+                    "@observe: failed to send notification for %s, %r" % (failure.identity, ex))
+            finally:
+                self._queue.task_done()
+
+
+# the process-wide notifier of the coroutine and async generator wrappers
+notifier = Notifier()
+
+
+@atexit.register
+def flush(timeout: float = DEFAULT_TIMEOUT) -> None:
+    """Flushes the queued notifications, registered to run on interpreter shutdown.
+    """
+    notifier.flush(timeout=timeout)
@@ -0,0 +1,144 @@
+"""This module measures the overhead of @observe itself, see @observe(overhead=True).
+
+The decorator measures the time it spends before calling the function (resolvers, client lookups) and after it
+returned (logging, string building, emission), excluding the function itself. The OverheadCounter sums it up and sends
+the aggregate of each interval as gauges, never per call:
+    * `<metric>.observe_overhead`: the mean overhead per call
+    * `<metric>.observe_overhead.max`: the maximum overhead of a call
+    * `<metric>.observe_overhead.pre`, `<metric>.observe_overhead.post`: the mean overhead before and after the call
+The functions decorated with the same metric and static tags send the same gauges, so they share one counter, the
+functions with other static tags have their own. The cumulative counts are available in-process, see snapshot.
+"""
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# the nanoseconds between the sends of the aggregated overhead
+DEFAULT_OVERHEAD_INTERVAL_NS = 10 * 10 ** 9
+
+
+class OverheadCounter:
+    """The OverheadCounter sums up the overhead of @observe for one metric, in nanoseconds.
+    """
+
+    def __init__(self, metric: str, interval_ns: int = DEFAULT_OVERHEAD_INTERVAL_NS) -> None:
+        """Initializes the OverheadCounter.
+
+        Args:
+            metric (str): the root-metric, see @observe.
+            interval_ns (int, optional): the nanoseconds between the sends. Defaults to DEFAULT_OVERHEAD_INTERVAL_NS.
+        """
+        self.metric = metric
+        self.interval_ns = interval_ns
+        self.names: Tuple[str, str, str, str] = (  # pylint: disable=E1136
+            sys.intern("%s.observe_overhead" % metric),
+            sys.intern("%s.observe_overhead.max" % metric),
+            sys.intern("%s.observe_overhead.pre" % metric),
+            sys.intern("%s.observe_overhead.post" % metric))
+        self.count = 0
+        self.pre_ns = 0
+        self.post_ns = 0
+        self.max_ns = 0
+        self._window: List[int] = [0, 0, 0, 0]  # pylint: disable=E1136
+        self._window_start: Optional[int] = None  # pylint: disable=E1136
+        self._lock = threading.Lock()
+
+    def record(self, pre_ns: int, post_ns: int, now_ns: int) -> Optional[List[int]]:  # pylint: disable=E1136
+        """Adds the overhead of one call.
+
+        Returns:
+            Optional[List[int]]: the window [count, pre_ns, post_ns, max_ns] to send if the interval elapsed, else None.
+        """
+        total_ns = pre_ns + post_ns
+        with self._lock:
+            self.count += 1
+            self.pre_ns += pre_ns
+            self.post_ns += post_ns
+            if total_ns > self.max_ns:
+                self.max_ns = total_ns
+            window = self._window
+            window[0] += 1
+            window[1] += pre_ns
+            window[2] += post_ns
+            if total_ns > window[3]:
+                window[3] = total_ns
+            if self._window_start is None:
+                self._window_start = now_ns
+            if now_ns - self._window_start < self.interval_ns:
+                return None
+            self._window = [0, 0, 0, 0]
+            self._window_start = now_ns
+        return window
+
+    def emit(self,
+             imetric: Any,
+             window: List[int],  # pylint: disable=E1136
+             ns_per_unit: float,
+             tags: Tuple[str, ...]) -> None:  # pylint: disable=E1136
+        """Sends the window as gauges, in the reported unit, tagged with the static tags only.
+        """
+        count, pre_ns, post_ns, max_ns = window
+        mean, maximum, pre, post = self.names
+        imetric.gauge(mean, (pre_ns + post_ns) / count / ns_per_unit, list(tags))
+        imetric.gauge(maximum, max_ns / ns_per_unit, list(tags))
+        imetric.gauge(pre, pre_ns / count / ns_per_unit, list(tags))
+        imetric.gauge(post, post_ns / count / ns_per_unit, list(tags))
+
+    def summary(self) -> Dict[str, float]:  # pylint: disable=E1136
+        """Returns the cumulative count, pre_ns, post_ns, max_ns and mean_ns.
+        """
+        with self._lock:
+            count, pre_ns, post_ns, max_ns = self.count, self.pre_ns, self.post_ns, self.max_ns
+        return {"count": count, "pre_ns": pre_ns, "post_ns": post_ns, "max_ns": max_ns,
+                "mean_ns": (pre_ns + post_ns) / count if count else 0.0}
+
+    def reset(self) -> None:
+        """Drops all counts.
+        """
+        with self._lock:
+            self.count = self.pre_ns = self.post_ns = self.max_ns = 0
+            self._window = [0, 0, 0, 0]
+            self._window_start = None
+
+
+_counters: Dict[Tuple[str, Tuple[str, ...]], OverheadCounter] = {}  # pylint: disable=E1136
+_counters_lock = threading.Lock()
+
+
+def get_counter(metric: str, tags: Tuple[str, ...] = ()) -> OverheadCounter:  # pylint: disable=E1136
+    """Returns the OverheadCounter of the metric and static tags, shared by the functions sending the same gauges.
+    """
+    key = (metric, tuple(tags))
+    with _counters_lock:
+        counter = _counters.get(key)
+        if counter is None:
+            counter = _counters[key] = OverheadCounter(metric)
+        return counter
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:  # pylint: disable=E1136
+    """Returns the cumulative overhead per metric, summed over its static tags, see OverheadCounter.summary.
+    """
+    with _counters_lock:
+        counters = list(_counters.values())
+    result: Dict[str, Dict[str, float]] = {}  # pylint: disable=E1136
+    for counter in counters:
+        summary = counter.summary()
+        total = result.get(counter.metric)
+        if total is not None:
+            summary = {"count": total["count"] + summary["count"],
+                       "pre_ns": total["pre_ns"] + summary["pre_ns"],
+                       "post_ns": total["post_ns"] + summary["post_ns"],
+                       "max_ns": max(total["max_ns"], summary["max_ns"])}
+            summary["mean_ns"] = (summary["pre_ns"] + summary["post_ns"]) / summary["count"] if summary["count"] else 0.0
+        result[counter.metric] = summary
+    return result
+
+
+def reset() -> None:
+    """Drops the counts of all metrics.
+    """
+    with _counters_lock:
+        counters = list(_counters.values())
+    for counter in counters:
+        counter.reset()
@@ -0,0 +1,112 @@
+"""This module compiles the field paths of 'tags_from' and 'trace_id_from' into accessors, once at decoration time.
+
+A path is a sequence of names and list indices, e.g. `type`, `headers.traceId` or `records[0].user.id`:
+a name reads the key of a dict, else the attribute of an object (e.g. a dataclass), an index reads a list or tuple.
+A dictionary key which equals the whole path, e.g. `{"headers.traceId": ...}`, is read first, as before paths.
+
+A 'tags_from' field may name its tag `<name>=<path>`, e.g. `tenant=headers.tenantId`, by default the tag is named
+after the path without its indices, see tag_field.
+"""
+import re
+from typing import Any, Callable, List, Optional, Tuple
+
+# the indices of a path, removed from the default tag name
+_INDEX = re.compile(r"\[-?\d+\]")
+
+# one step of a path, a name (optionally after a dot) or an index in brackets
+_STEP = re.compile(r"(\.?)([^.\[\]]+)|\[(-?\d+)\]")
+
+
+def parse_path(path: str) -> List[Tuple[Optional[str], Optional[int]]]:  # pylint: disable=E1136
+    """Parses the path into its steps, each either (name, None) or (None, index).
+
+    Args:
+        path (str): the path, e.g. `headers.traceId` or `records[0].id`.
+
+    Raises:
+        ValueError: if the path is empty or malformed.
+
+    Returns:
+        List[Tuple[Optional[str], Optional[int]]]: the steps of the path.
+    """
+    steps: List[Tuple[Optional[str], Optional[int]]] = []  # pylint: disable=E1136
+    position = 0
+    while position < len(path):
+        match = _STEP.match(path, position)
+        # a name is preceded by a dot, except the first step
+        if match is None or (match.group(2) is not None and bool(match.group(1)) != (position > 0)):
+            raise ValueError("invalid path '%s' at position %d." % (path, position))
+        if match.group(2) is not None:
+            steps.append((match.group(2), None))
+        else:
+            steps.append((None, int(match.group(3))))
+        position = match.end()
+    if not steps:
+        raise ValueError("invalid path '%s', the path is empty." % path)
+    return steps
+
+
+def compile_path(path: str) -> Callable[[Any], Any]:
+    """Compiles the path into an accessor, which returns the value at the path of a root object, None if missing.
+
+    Note: a dictionary key equal to the path is read first, a malformed path is only read as such a key, as before
+    paths were supported.
+
+    Args:
+        path (str): the path, see parse_path.
+
+    Returns:
+        Callable[[Any], Any]: the accessor, it never raises.
+    """
+    try:
+        steps = tuple(parse_path(path))
+    except ValueError:
+        return lambda root: root.get(path) if isinstance(root, dict) else None
+
+    # ff16, the common single-level path, e.g. `type`
+    if len(steps) == 1 and steps[0][0] is not None:
+        name = steps[0][0]
+
+        def get_name(root: Any) -> Any:
+            if isinstance(root, dict):
+                return root.get(name)
+            try:
+                return getattr(root, name, None)
+            except Exception:  # pylint: disable=W0703
+                return None
+
+        return get_name
+
+    def get(root: Any) -> Any:
+        # a literal key takes precedence, e.g. `{"a.b": ...}`
+        if isinstance(root, dict) and path in root:
+            return root[path]
+        value = root
+        try:
+            for name, index in steps:
+                if value is None:
+                    return None
+                if name is not None:
+                    value = value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+                elif isinstance(value, (list, tuple)) and -len(value) <= index < len(value):  # type: ignore
+                    value = value[index]
+                else:
+                    return None
+        except Exception:  # pylint: disable=W0703
+            return None
+        return value
+
+    return get
+
+
+def tag_field(field: str) -> Tuple[str, str]:  # pylint: disable=E1136
+    """Returns the tag name and the path of a 'tags_from' field.
+
+    The field `<name>=<path>` names the tag explicitly, e.g. `tenant=headers.tenantId` -> (`tenant`,
+    `headers.tenantId`). Otherwise the tag is named after the path without its indices, valid for Datadog and
+    Prometheus, e.g. `records[0].type` -> (`records.type`, `records[0].type`), `a.b` -> (`a.b`, `a.b`).
+    """
+    name, separator, path = field.partition("=")
+    if separator and name and path:
+        return name, path
+    return (_INDEX.sub("", field) or field), field
@@ -0,0 +1,367 @@
+"""This module defines the Plan, the per-function setup of the @observe decorator.
+All work which only depends on the decorator arguments (metric names, static tags, resolvers) is done once at
+decoration time, to keep the work done on each call to a minimum: time, call, emit.
+"""
+import functools
+import logging
+import sys
+import traceback
+from typing import (Any, Callable, Dict, FrozenSet, List, Optional, Tuple,
+                    Type, Union)
+
+from atl_observe.lib import context
+from atl_observe.lib.clock import NS_PER_UNIT, UNIT_MS, Clock, get_now_ns
+from atl_observe.lib.context import Span, TraceContext
+from atl_observe.lib.overhead import OverheadCounter, get_counter
+from atl_observe.lib.sampling import Sampler
+from atl_observe.lib.sketch import SketchRegistry, sketches
+from atl_observe.lib.tags import CardinalityGuard
+from atl_observe.lib.utils import (Provider, Resolver, SLIThresholds,
+                                   observe_sli_thresholds)
+
+# the outcomes of a decorated call, see atl_observe.decorator
+FINISHED = "finished"
+ACCEPTED = "accepted"
+DECLINED = "declined"
+RAISED = "raised"
+
+
+class Plan:
+    """The Plan holds everything @observe needs on each call, compiled once per decorated function.
+    """
+
+    def __init__(self,
+                 func: Callable[..., Any],
+                 metric: str,
+                 accept_on: List[Type[Exception]],  # pylint: disable=E1136
+                 decline_on: List[Type[Exception]],  # pylint: disable=E1136
+                 static_tags: List[str],  # pylint: disable=E1136
+                 tags_from: Optional[Dict[str, List[str]]] = None,  # pylint: disable=E1136
+                 trace_id_from: Optional[Dict[str, str]] = None,  # pylint: disable=E1136
+                 sample_rate: Optional[float] = None,  # pylint: disable=E1136
+                 sample_budget: Optional[float] = None,  # pylint: disable=E1136
+                 sketch: bool = False,
+                 sketch_tags: bool = False,
+                 sli_thresholds: Optional[Dict[Union[int, float], str]] = None,  # pylint: disable=E1136
+                 unit: str = UNIT_MS,
+                 clock: Optional[Clock] = None,  # pylint: disable=E1136
+                 traceback_limit: Optional[int] = None,  # pylint: disable=E1136
+                 traceback_on_accept: bool = True,
+                 max_tag_values: Union[int, Dict[str, int], None] = None,  # pylint: disable=E1136
+                 self_time: bool = False,
+                 parent_tag: bool = False,
+                 overhead: bool = False) -> None:
+        """Initializes the Plan.
+
+        Args:
+            func (Callable[..., Any]): the decorated function.
+            metric (str): the root-metric, see @observe.
+            accept_on (List[Type[Exception]]): exceptions on which the call is acknowledged.
+            decline_on (List[Type[Exception]]): exceptions on which the call is declined.
+            static_tags (List[str]): tags to be appended on each metric update.
+            tags_from (Optional[Dict[str, List[str]]], optional): tags to be extracted from **kwargs.
+            trace_id_from (Optional[Dict[str, str]], optional): the trace_id to be extracted from **kwargs.
+            sample_rate (Optional[float], optional): the sample_rate of the successful path, see Sampler. Only the
+                counts are scaled, the timing `.count` of a backend counts the reported calls.
+            sample_budget (Optional[float], optional): the reported calls per second of the successful path.
+            sketch (bool, optional): records the process time in the latency sketch of the timing metric.
+            sketch_tags (bool, optional): records one latency sketch per tags (without the sli tag).
+            sli_thresholds (Optional[Dict[Union[int, float], str]], optional): the `observed_sli` thresholds (ms).
+            unit (str, optional): the unit of the reported process time, UNIT_MS or UNIT_US. Defaults to UNIT_MS.
+            clock (Optional[Clock], optional): the clock to measure the process time. Defaults to Clock().
+            traceback_limit (Optional[int], optional): the innermost frames of logged tracebacks. Defaults to all.
+            traceback_on_accept (bool, optional): whether accepted exceptions are logged with traceback.
+            max_tag_values (Union[int, Dict[str, int], None], optional): the distinct values per 'tags_from' key.
+            self_time (bool, optional): sends the process time without nested observed calls as `self_time`.
+            parent_tag (bool, optional): tags the metrics with the metric of the enclosing observed call.
+            overhead (bool, optional): measures the overhead of @observe itself, see atl_observe.lib.overhead.
+
+        Raises:
+            ValueError: if the unit is not supported.
+        """
+        self.func = func
+        self.func_name: str = getattr(func, "__name__", repr(func))
+        # whether args[0] is the instance of a method, its clients are cached, see Provider
+        self.method: bool = Resolver.is_method(func)
+        self.accept_on: FrozenSet[Type[Exception]] = frozenset(accept_on)  # pylint: disable=E1136
+        self.decline_on: FrozenSet[Type[Exception]] = frozenset(decline_on)  # pylint: disable=E1136
+        self.static_tags: Tuple[str, ...] = tuple(static_tags)  # pylint: disable=E1136
+
+        # interned metric names, (time, time_gauge, count) per outcome
+        self.metric_start: str = sys.intern("%s.start" % metric)
+        self.metric_names: Dict[str, Tuple[str, str, str]] = {  # pylint: disable=E1136
+            FINISHED: Plan._names(metric, FINISHED, "%s.finished" % metric),
+            ACCEPTED: Plan._names(metric, ACCEPTED, "%s.exception.accepted" % metric),
+            DECLINED: Plan._names(metric, DECLINED, "%s.exception.declined" % metric),
+            RAISED: Plan._names(metric, RAISED, "%s.exception.raised" % metric),
+        }
+
+        # the span of each call, see atl_observe.lib.context, None if no self time is sent
+        self.metric: str = sys.intern(metric)
+        self.span_tag: str = sys.intern("parent_metric:%s" % metric)
+        self.parent_tag = parent_tag
+        if parent_tag:
+            # the enclosing calls open spans from now on, to be found as parent
+            context.track()
+        self.metric_self_time: Optional[Dict[str, str]] = {  # pylint: disable=E1136
+            outcome: sys.intern("%s.self_time.%s" % (metric, outcome))
+            for outcome in (FINISHED, ACCEPTED, DECLINED, RAISED)} if self_time else None
+
+        # None if the tag values are not bounded, see atl_observe.lib.tags
+        self.guard: Optional[CardinalityGuard] = (  # pylint: disable=E1136
+            CardinalityGuard(max_tag_values) if max_tag_values is not None else None)
+        self.metric_collapsed: str = sys.intern("%s.tags.collapsed" % metric)
+
+        # specialised resolvers, no-op when not configured, finding the parameters in kwargs or positional args
+        positions = Resolver.positions(func) if tags_from or trace_id_from else {}
+        self.resolve_trace_id: Callable[..., str] = Resolver.compile_trace_id(  # pylint: disable=E1136
+            trace_id_from, positions=positions)
+        self.resolve_tags: Callable[..., List[str]] = Resolver.compile_tags_from(  # pylint: disable=E1136
+            tags_from, guard=self.guard, static_tags=self.static_tags, positions=positions)
+        self.resolve_identity: Callable[..., str] = functools.partial(  # pylint: disable=E1136
+            Resolver.resolve_identity, func=func)
+
+        # the clock and the conversion of the measured nanoseconds to the reported unit
+        if unit not in NS_PER_UNIT:
+            raise ValueError("unit must be one of %s, got %r." % (", ".join(NS_PER_UNIT), unit))
+        self.now_ns: Callable[[], int] = get_now_ns(clock or Clock())  # pylint: disable=E1136
+        self.ns_per_unit: float = NS_PER_UNIT[unit]
+
+        # the traceback setup of the exception paths, see Failure
+        self.traceback_limit = traceback_limit
+        self.traceback_on_accept = traceback_on_accept
+
+        # the compiled sli thresholds, validated once
+        self.sli: SLIThresholds = (
+            observe_sli_thresholds if sli_thresholds is None else SLIThresholds(sli_thresholds))
+
+        # None if every call is reported
+        self.sampler: Optional[Sampler] = Sampler.create(sample_rate=sample_rate, budget=sample_budget)  # pylint: disable=E1136
+
+        # None if the overhead of @observe is not measured, see atl_observe.lib.overhead
+        self.overhead: Optional[OverheadCounter] = get_counter(  # pylint: disable=E1136
+            metric, self.static_tags) if overhead else None
+
+        # None if no latency sketch is maintained, see atl_observe.lib.sketch
+        self.sketches: Optional[SketchRegistry] = sketches if sketch or sketch_tags else None  # pylint: disable=E1136
+        self.sketch_tags = sketch_tags
+
+    @staticmethod
+    def _names(metric: str, outcome: str, count: str) -> Tuple[str, str, str]:  # pylint: disable=E1136
+        return (sys.intern("%s.time.%s" % (metric, outcome)),
+                sys.intern("%s.time_gauge.%s" % (metric, outcome)),
+                sys.intern(count))
+
+    def tags(self,
+             kwargs: Dict[str, Any],  # pylint: disable=E1136
+             args: Tuple[Any, ...] = (),  # pylint: disable=E1136
+             parent: Optional[Span] = None) -> List[str]:  # pylint: disable=E1136
+        """Returns a fresh list of the dynamic tags followed by the static tags, and the tag of the parent span.
+        """
+        tags = self.resolve_tags(kwargs, args)
+        if self.parent_tag and parent is not None:
+            tags.append(parent.tag)
+        return tags
+
+    def enter(self,
+              args: Tuple[Any, ...],  # pylint: disable=E1136
+              trace_id: str) -> Tuple[str, Optional[Span], Optional[Span], Any]:  # pylint: disable=E1136
+        """Opens the span of the call, see atl_observe.lib.context, publishing the resolved trace_id for nested calls.
+
+        Note: no span is opened if nothing needs it, i.e. no trace_id, no enclosing span, no self time and no
+        `parent_tag` in the process, to keep the plain call free of the context switch.
+
+        Returns:
+            Tuple[str, Optional[Span], Optional[Span], Any]: the trace_id of the call (else the inherited one), the
+                enclosing span, the span and the token to leave, the latter both None if no span was opened.
+        """
+        parent = context.current_span()
+        if parent is None and not trace_id and self.metric_self_time is None and not context.tracking():
+            return "", None, None, None
+        trace = None
+        if trace_id:
+            trace = TraceContext(trace_id, resolve=self.resolve_identity, args=args)
+        span, token = context.enter(self.metric, self.span_tag, trace)
+        return (span.trace.trace_id if span.trace is not None else ""), parent, span, token
+
+    def classify(self, ex: Exception) -> str:
+        """Returns the outcome for the raised exception, see accept_on, decline_on.
+        """
+        ex_type = type(ex)
+        if ex_type in self.accept_on:
+            return ACCEPTED
+        if ex_type in self.decline_on:
+            return DECLINED
+        return RAISED
+
+    def finished(self,
+                 imetric: Any,
+                 elapsed_ns: int,
+                 tags: List[str],  # pylint: disable=E1136
+                 span: Optional[Span] = None) -> Optional[float]:  # pylint: disable=E1136
+        """Appends the sli tag and sends the metrics of a successful call, measured in nanoseconds, if sampled.
+
+        Returns:
+            float: the weight of the call in the counts, to be passed to Plan.started, see Sampler.weight.
+        """
+        weight = self.sampler.weight() if self.sampler is not None else 1
+        process_time = elapsed_ns / self.ns_per_unit
+        if self.sketches is not None:
+            self.record(imetric, FINISHED, process_time, tags)
+        if not weight:
+            return weight
+        tags.append(self.sli.tag(elapsed_ns / 1e6))
+        self.emit(imetric, FINISHED, process_time, tags, weight, self.self_time(span, elapsed_ns))
+        return weight
+
+    def started(self, imetric: Any, tags: List[str], weight: float = 1) -> None:  # pylint: disable=E1136
+        """Sends the start metric, with the weight of the outcome, and the counts of collapsed tag values.
+        """
+        if weight:
+            imetric.increment(self.metric_start, weight, tags)
+        if self.guard is not None and self.guard.pending:
+            self.guard.emit(imetric, self.metric_collapsed)
+
+    def failed(self,
+               args: Tuple[Any, ...],  # pylint: disable=E1136
+               imetric: Any,
+               ex: Exception,
+               elapsed_ns: int,
+               tags: List[str],  # pylint: disable=E1136
+               trace_id: str,
+               span: Optional[Span] = None) -> Tuple[str, "Failure"]:  # pylint: disable=E1136
+        """Appends the exception and sli tags, logs and sends the metrics of a failed call, measured in nanoseconds.
+
+        Returns:
+            Tuple[str, Failure]: the outcome and the details of the failed call.
+        """
+        tags.append('exception:%s' % type(ex).__name__)
+        outcome = self.classify(ex)
+        process_time = elapsed_ns / self.ns_per_unit
+        if self.sketches is not None:
+            self.record(imetric, outcome, process_time, tags)
+        tags.append(self.sli.tag(elapsed_ns / 1e6))
+        failure = Failure(self, args, ex, trace_id)
+        self.report(outcome, failure)
+        self.emit(imetric, outcome, process_time, tags, self_time=self.self_time(span, elapsed_ns))
+        return outcome, failure
+
+    def self_time(self, span: Optional[Span], elapsed_ns: int) -> Optional[float]:  # pylint: disable=E1136
+        """Returns the self time of the span in the reported unit, None if not sent.
+        """
+        if self.metric_self_time is None or span is None:
+            return None
+        return span.self_ns(elapsed_ns) / self.ns_per_unit
+
+    def account(self, imetric: Any, entered_ns: int, time_start: int, elapsed_ns: int) -> None:
+        """Adds the overhead of the call, the time before time_start and after the function returned, see overhead.
+        """
+        now_ns = self.now_ns()
+        window = self.overhead.record(time_start - entered_ns, now_ns - time_start - elapsed_ns, now_ns)  # type: ignore
+        if window is not None:
+            self.overhead.emit(imetric, window, self.ns_per_unit, self.static_tags)  # type: ignore
+
+    def record(self, imetric: Any, outcome: str, process_time: float, tags: List[str]) -> None:  # pylint: disable=E1136
+        """Records the process time in the latency sketch of the timing metric of the outcome, the sketches are
+        emitted to the client of the first recorded call, see SketchRegistry.record.
+        """
+        self.sketches.record(self.metric_names[outcome][0], process_time,  # type: ignore
+                             tuple(tags) if self.sketch_tags else (), imetric)
+
+    def emit(self,
+             imetric: Any,
+             outcome: str,
+             process_time: float,
+             tags: List[str],  # pylint: disable=E1136
+             weight: float = 1,
+             self_time: Optional[float] = None) -> None:  # pylint: disable=E1136
+        """Sends the timing, gauge and count metrics for the outcome, and the self time timing if provided.
+        The count is incremented by the weight of the call, see Sampler.weight.
+        """
+        time_name, gauge_name, count_name = self.metric_names[outcome]
+        imetric.timing(time_name, process_time, tags)
+        imetric.gauge(gauge_name, process_time, tags)
+        imetric.increment(count_name, weight, tags)
+        if self_time is not None:
+            imetric.timing(self.metric_self_time[outcome], self_time, tags)  # type: ignore
+
+    def report(self, outcome: str, failure: "Failure") -> None:
+        """Logs the failure for the outcome, the traceback is only formatted if a handler builds the message.
+        """
+        logger = Provider.get_logger(*failure.args, owner=self.method)
+        level = logging.WARNING if outcome == ACCEPTED else logging.ERROR
+        if not logger.isEnabledFor(level):
+            return
+        ex = failure.ex
+        if outcome == ACCEPTED and not self.traceback_on_accept:
+            logger.log(level, "%s: %s(%s) during '%s' %s.",
+                       failure.identity, type(ex).__name__, ex, self.func_name, outcome)
+            return
+        logger.log(level, "%s: %s(%s) during '%s' %s.\n%s",
+                   failure.identity, type(ex).__name__, ex, self.func_name, outcome, Formatted(lambda: failure.traceback))
+
+    def notify(self, failure: "Failure") -> None:
+        """Sends an error notification for an unhandled exception, if a notification client is available.
+        The text is formatted when sent, not if the notification is dropped, see Slack._send.
+        """
+        slack = Provider.get_slack(*failure.args, owner=self.method)
+        if slack:
+            slack.error(header=failure.identity, title=type(failure.ex).__name__,
+                        text=Formatted(failure.format_text))  # type: ignore
+
+
+class Failure:
+    """The Failure holds the details of a failed call, the identity and the traceback are resolved lazily, only if
+    consumed by a logger or notification, and at most once.
+    """
+    __slots__ = ("plan", "args", "ex", "trace_id", "_tb", "_identity", "_traceback")
+
+    def __init__(self, plan: Plan, args: Tuple[Any, ...], ex: Exception, trace_id: str) -> None:  # pylint: disable=E1136
+        self.plan = plan
+        self.args = args
+        self.ex = ex
+        self.trace_id = trace_id
+        # the traceback as raised, it is extended if re-raised while formatted elsewhere, e.g. in another thread
+        self._tb = ex.__traceback__
+        self._identity: Optional[str] = None  # pylint: disable=E1136
+        self._traceback: Optional[str] = None  # pylint: disable=E1136
+
+    @property
+    def identity(self) -> str:
+        """Returns the identity of the call, see Resolver.resolve_identity.
+        """
+        if self._identity is None:
+            self._identity = Resolver.resolve_identity(*self.args, func=self.plan.func, trace_id=self.trace_id)
+        return self._identity
+
+    @property
+    def traceback(self) -> str:
+        """Returns the formatted traceback of the exception, the innermost frames bounded by traceback_limit.
+        """
+        if self._traceback is None:
+            ex = self.ex
+            limit = self.plan.traceback_limit
+            self._traceback = "".join(traceback.format_exception(
+                type(ex), ex, self._tb, limit=-limit if limit else None))
+        return self._traceback
+
+    def format_text(self) -> str:
+        """Returns the text of the notification, the exception and its traceback.
+        """
+        return "%s\n%s" % (self.ex, self.traceback)
+
+
+class Formatted:
+    """A log or notification argument formatted on str(), at most once, e.g. by LogRecord.getMessage which only runs
+    if a handler emits the record.
+    """
+    __slots__ = ("formatter", "_text")
+
+    def __init__(self, formatter: Callable[[], str]) -> None:
+        self.formatter = formatter
+        self._text: Optional[str] = None  # pylint: disable=E1136
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = self.formatter()
+        return self._text
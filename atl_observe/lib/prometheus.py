@@ -0,0 +1,243 @@
+"""This module defines a pull-based IMetric implementation, serving the Prometheus text format.
+
+Nothing is sent per call: increments update counters, gauges set gauges and timings are observed in fixed-bucket
+histograms, all in memory. The series are spread over lock stripes, so concurrent updates of different series rarely
+contend. A scraper reads PrometheusMetric.render, e.g. from the optional HTTP thread started by PrometheusMetric.serve.
+"""
+import re
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Text, Tuple
+
+from atl_observe.lib.metrics import IMetric
+
+# the upper bounds of the histogram buckets, in the reported unit of the timing (ms by default)
+DEFAULT_BUCKETS: Tuple[float, ...] = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # pylint: disable=E1136
+
+# the content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+_INVALID_LABEL = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def metric_name(metric: str, namespace: str = "") -> str:
+    """Returns a valid Prometheus metric name, e.g. `process.time.finished` -> `process_time_finished`.
+    """
+    name = _INVALID_NAME.sub("_", "%s_%s" % (namespace, metric) if namespace else metric)
+    return "_" + name if name[:1].isdigit() else name
+
+
+def labels(tags: Tuple[str, ...]) -> str:  # pylint: disable=E1136
+    """Returns the Prometheus labels of the tags, `key:value` -> `key="value"`, a tag without value is `tag="..."`.
+
+    Note: the distinct values of a repeated label name, e.g. `env:a` and `env:b` or two tags without value, are joined
+    by `,` into one label in order of the tags, as a label name must be unique per series.
+    """
+    values: Dict[str, List[str]] = {}  # pylint: disable=E1136
+    for tag in tags:
+        key, separator, value = tag.partition(":")
+        if not separator:
+            key, value = "tag", tag
+        key = _INVALID_LABEL.sub("_", key) or "tag"
+        if key[:1].isdigit():
+            key = "_" + key
+        joined = values.setdefault(key, [])
+        if value not in joined:
+            joined.append(value)
+    pairs = []
+    for key, joined in values.items():
+        value = ",".join(joined).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append('%s="%s"' % (key, value))
+    return ",".join(pairs)
+
+
+class _Histogram:
+    """The bucket counts, sum and count of one histogram series.
+    """
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class PrometheusMetric(IMetric):
+    """This IMetric implementation keeps counters, gauges and histograms in memory, to be scraped by Prometheus.
+
+    Counters are exposed with the suffix `_total`, timings as histograms in the unit reported by @observe.
+    """
+
+    def __init__(self,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS,  # pylint: disable=E1136
+                 stripes: int = 16,
+                 namespace: str = "") -> None:
+        """Initializes the PrometheusMetric.
+
+        Args:
+            buckets (Tuple[float, ...], optional): the upper bounds of the histogram buckets. Defaults to DEFAULT_BUCKETS.
+            stripes (int, optional): the number of locks the series are spread over. Defaults to 16.
+            namespace (str, optional): the prefix of all metric names. Defaults to "".
+
+        Raises:
+            ValueError: if the buckets are empty or not increasing, or stripes is not positive.
+        """
+        if not buckets or any(lower >= upper for lower, upper in zip(buckets, buckets[1:])):
+            raise ValueError("buckets must be increasing and not empty, got %r." % (buckets,))
+        if stripes < 1:
+            raise ValueError("stripes must be greater than 0, got %r." % stripes)
+        self.buckets = tuple(float(bucket) for bucket in buckets)
+        self.namespace = namespace
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._series: List[Dict[Tuple[str, str, Tuple[str, ...]], Any]] = [{} for _ in range(stripes)]  # pylint: disable=E1136
+        self._server: Optional[ThreadingHTTPServer] = None  # pylint: disable=E1136
+
+    def _stripe(self, key: Tuple[str, str, Tuple[str, ...]]) -> int:  # pylint: disable=E1136
+        return hash(key) % len(self._locks)
+
+    def timing(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        key = (HISTOGRAM, metric, tuple(tags or ()))
+        stripe = self._stripe(key)
+        index = bisect_left(self.buckets, value)
+        with self._locks[stripe]:
+            series = self._series[stripe]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def increment(self, metric: Text, value: float = 1, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        key = (COUNTER, metric, tuple(tags or ()))
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            series = self._series[stripe]
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        key = (GAUGE, metric, tuple(tags or ()))
+        stripe = self._stripe(key)
+        with self._locks[stripe]:
+            self._series[stripe][key] = value
+
+    def collect(self) -> Dict[Tuple[str, str, Tuple[str, ...]], Any]:  # pylint: disable=E1136
+        """Returns a consistent copy of each stripe, by (kind, metric, tags).
+        """
+        collected: Dict[Tuple[str, str, Tuple[str, ...]], Any] = {}  # pylint: disable=E1136
+        for lock, series in zip(self._locks, self._series):
+            with lock:
+                for key, value in series.items():
+                    if key[0] == HISTOGRAM:
+                        copy = _Histogram(0)
+                        copy.counts, copy.sum, copy.count = list(value.counts), value.sum, value.count
+                        value = copy
+                    collected[key] = value
+        return collected
+
+    def render(self) -> str:
+        """Returns all series in the Prometheus text format.
+
+        Note: the series rendered to the same name and labels, e.g. tags `my-key:a` and `my_key:a`, are merged.
+        """
+        families: Dict[Tuple[str, str], Dict[str, Any]] = {}  # pylint: disable=E1136
+        for (kind, metric, tags), value in self.collect().items():
+            name = metric_name(metric, self.namespace)
+            if kind == COUNTER:
+                name += "_total"
+            samples = families.setdefault((name, kind), {})
+            label = labels(tags)
+            merged = samples.get(label)
+            if merged is None or kind == GAUGE:
+                samples[label] = value
+            elif kind == COUNTER:
+                samples[label] = merged + value
+            else:
+                merged.counts = [left + right for left, right in zip(merged.counts, value.counts)]
+                merged.sum += value.sum
+                merged.count += value.count
+
+        lines: List[str] = []  # pylint: disable=E1136
+        for (name, kind), samples in sorted(families.items()):
+            lines.append("# TYPE %s %s" % (name, kind))
+            for label, value in sorted(samples.items()):
+                if kind != HISTOGRAM:
+                    lines.append("%s%s %s" % (name, "{%s}" % label if label else "", _number(value)))
+                    continue
+                cumulative = 0
+                for bucket, count in zip(self.buckets + (float("inf"),), value.counts):
+                    cumulative += count
+                    le = 'le="%s"' % ("+Inf" if bucket == float("inf") else _number(bucket))
+                    lines.append("%s_bucket{%s} %d" % (name, "%s,%s" % (label, le) if label else le, cumulative))
+                braces = "{%s}" % label if label else ""
+                lines.append("%s_sum%s %s" % (name, braces, _number(value.sum)))
+                lines.append("%s_count%s %d" % (name, braces, value.count))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self) -> None:
+        """Drops all series.
+        """
+        for lock, series in zip(self._locks, self._series):
+            with lock:
+                series.clear()
+
+    def serve(self, port: int = 9102, address: str = "127.0.0.1") -> Tuple[str, int]:  # pylint: disable=E1136
+        """Starts a daemon thread serving GET /metrics, once.
+
+        Args:
+            port (int, optional): the port, 0 picks a free port. Defaults to 9102.
+            address (str, optional): the address to bind. Defaults to "127.0.0.1", only local scrapers.
+
+        Returns:
+            Tuple[str, int]: the bound address and port.
+        """
+        if self._server is None:
+            registry = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", CONTENT_TYPE)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args: Any) -> None:
+                    pass
+
+            self._server = ThreadingHTTPServer((address, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="observe-prometheus", daemon=True).start()
+        return self._server.server_address[:2]  # type: ignore
+
+    def shutdown(self) -> None:
+        """Stops the HTTP thread, if started.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _number(value: float) -> str:
+    """Returns the value in the Prometheus text format, integral values without fraction.
+    """
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -0,0 +1,77 @@
+"""This module defines the Sampler, which decides once per call whether @observe reports a successful call.
+A reported call counts 1/sample_rate in its counters (start and outcome count), so the counts stay unbiased, its
+timing and gauge are sent as is. A dropped call sends no metric at all, so the metrics of a call never disagree, and
+no sample_rate is passed to the metric client: it would sample each metric again, independently. Only the successful
+path is sampled, exceptions are always reported.
+
+Note: the timing of a reported call is sent once, so the counts derived from timings, e.g. the `.count` of a Datadog
+histogram, are not scaled: they count the reported calls. The outcome counts are the rate-corrected call counts.
+"""
+import random
+import time
+from typing import Optional
+
+
+class Sampler:
+    """The Sampler provides the sample_rate of the successful path for one decorated function.
+
+    If a budget is set, the sample_rate adapts each window: when the calls per second exceed the budget, the
+    sample_rate is lowered to report about `budget` calls per second, never above the configured sample_rate.
+
+    Note: the calls are counted without a lock, a few lost counts under contention only affect the estimation.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, budget: Optional[float] = None, window: float = 1.0) -> None:  # pylint: disable=E1136
+        """Initializes the Sampler.
+
+        Args:
+            sample_rate (float, optional): the (maximum) sample_rate, in (0, 1]. Defaults to 1.0.
+            budget (Optional[float], optional): the reported calls per second, enables adaptive mode. Defaults to None.
+            window (float, optional): the seconds after which the adaptive sample_rate is updated. Defaults to 1.0.
+
+        Raises:
+            ValueError: if sample_rate, budget or window are out of range.
+        """
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1], got %r." % sample_rate)
+        if budget is not None and budget <= 0:
+            raise ValueError("budget must be greater than 0, got %r." % budget)
+        if window <= 0:
+            raise ValueError("window must be greater than 0, got %r." % window)
+        self.sample_rate = sample_rate
+        self.budget = budget
+        self.window = window
+        self.current: float = sample_rate
+        self._calls = 0
+        self._window_start = time.monotonic()
+
+    def rate(self) -> Optional[float]:  # pylint: disable=E1136
+        """Returns the sample_rate for this call, None if every call is reported.
+        """
+        if self.budget is not None:
+            self._calls += 1
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed >= self.window:
+                calls_per_second = self._calls / elapsed
+                self.current = min(self.sample_rate, self.budget / calls_per_second)
+                self._calls = 0
+                self._window_start = now
+        current = self.current
+        return current if current < 1 else None
+
+    def weight(self) -> float:
+        """Decides whether this call is reported, returns its weight in the counts: 1/sample_rate, 0 if dropped.
+        """
+        rate = self.rate()
+        if rate is None:
+            return 1
+        return 1 / rate if random.random() < rate else 0
+
+    @staticmethod
+    def create(sample_rate: Optional[float] = None, budget: Optional[float] = None) -> Optional["Sampler"]:  # pylint: disable=E1136
+        """Returns a Sampler, None if every call is reported (no sample_rate below 1, no budget).
+        """
+        if (sample_rate is None or sample_rate == 1) and budget is None:
+            return None
+        return Sampler(sample_rate=1.0 if sample_rate is None else sample_rate, budget=budget)
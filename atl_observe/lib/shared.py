@@ -0,0 +1,361 @@
+"""This module aggregates the metrics of forked worker processes in shared memory, e.g. gunicorn or celery prefork.
+
+The SharedMetric is created in the parent before the workers are forked. The workers write counters, gauges and
+timing histograms into an anonymous shared mmap, a fixed table of slots, one per (kind, metric, tags), found by open
+addressing within MAX_PROBES slots and claimed under one table lock. Each process remembers the slot of a series
+after its first use. The values are guarded by a few process-shared locks, each lock guards every n-th slot, so
+workers updating different series rarely contend. A single collector, a thread in the parent, flushes the aggregation to the
+metrics backend on an interval, see SharedMetric.start:
+    * increment -> one increment with the sum since the last flush
+    * gauge -> one gauge with the last value, if set since the last flush
+    * timing -> gauges `<metric>.avg`, `.min`, `.max`, `.p50`, `.p90`, `.p99` (estimated from the buckets) and
+      increment `<metric>.count`
+
+Note: a worker killed while holding a lock blocks the other workers of its stripe, the critical sections only update
+a few numbers in memory. The values dropped since the table is full are counted per process and added to the shared
+count every DROP_BATCH drops, on flush and on interpreter shutdown, see SharedMetric.dropped.
+"""
+import atexit
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import weakref
+import zlib
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Text, Tuple, Union
+
+from datadog import DogStatsd
+
+from atl_observe.lib.metrics import IMetric, get_default_metric, send_summary
+from atl_observe.lib.prometheus import DEFAULT_BUCKETS
+from atl_observe.lib.sketch import SUMMARY_QUANTILES
+
+# the maximum size of the utf-8 encoded metric and tags of a slot
+KEY_SIZE = 200
+
+COUNTER = 1
+GAUGE = 2
+HISTOGRAM = 3
+
+_KINDS = {COUNTER: "counter", GAUGE: "gauge", HISTOGRAM: "histogram"}
+
+# the header of the table, the values dropped by all processes
+_TABLE_HEADER = struct.Struct("<Q")
+
+# the slots probed for a key, beyond the key is dropped
+MAX_PROBES = 16
+
+# the drops counted per process before they are added to the shared count
+DROP_BATCH = 64
+
+# the slot header: used, kind, dirty (updated since the last flush), key length
+_HEADER = struct.Struct("<BBBxH2x")
+_EMPTY = 0
+_USED = 1
+_DIRTY = 2
+
+_METRIC_SEPARATOR = "\x1e"
+_TAG_SEPARATOR = "\x1f"
+
+
+def _encode(metric: Text, tags: Tuple[str, ...]) -> bytes:  # pylint: disable=E1136
+    return (metric + _METRIC_SEPARATOR + _TAG_SEPARATOR.join(tags)).encode("utf-8")
+
+
+def _decode(key: bytes) -> Tuple[str, Tuple[str, ...]]:  # pylint: disable=E1136
+    metric, _, tags = key.decode("utf-8").partition(_METRIC_SEPARATOR)
+    return metric, tuple(tags.split(_TAG_SEPARATOR)) if tags else ()
+
+
+def quantile(buckets: Tuple[float, ...],  # pylint: disable=E1136
+             counts: List[float],  # pylint: disable=E1136
+             minimum: float,
+             maximum: float,
+             q: float) -> float:
+    """Returns the value at the quantile q, interpolated linearly within its bucket and bounded by min and max.
+    """
+    count = sum(counts)
+    rank = q * count
+    seen = 0.0
+    lower = minimum
+    for index, bucket_count in enumerate(counts):
+        upper = buckets[index] if index < len(buckets) else maximum
+        if bucket_count and seen + bucket_count >= rank:
+            upper = min(upper, maximum)
+            lower = max(lower, minimum)
+            return lower + (upper - lower) * (rank - seen) / bucket_count
+        seen += bucket_count
+        lower = upper
+    return maximum
+
+
+class SharedMetric(IMetric):
+    """This IMetric implementation aggregates the metrics of all forked processes in shared memory, see the module
+    documentation for the layout and what is flushed.
+    """
+
+    def __init__(self,
+                 client: Union[IMetric, DogStatsd, None] = None,  # pylint: disable=E1136
+                 flush_interval: float = 10.0,
+                 slots: int = 4096,
+                 stripes: int = 64,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:  # pylint: disable=E1136
+        """Initializes the SharedMetric, to be created before the worker processes are forked.
+
+        Args:
+            client (IMetric | DogStatsd, optional): the client to flush to. Defaults to the process-wide default.
+            flush_interval (float, optional): the seconds between flushes of the collector. Defaults to 10.0.
+            slots (int, optional): the series (kind, metric, tags) kept, further series are dropped. Defaults to 4096.
+            stripes (int, optional): the process-shared locks the slots are spread over. Defaults to 64.
+            buckets (Tuple[float, ...], optional): the upper bounds of the histogram buckets. Defaults to DEFAULT_BUCKETS.
+
+        Raises:
+            ValueError: if slots or stripes are not positive, or the buckets are empty or not increasing.
+        """
+        if slots < 1 or stripes < 1:
+            raise ValueError("slots and stripes must be greater than 0, got %r, %r." % (slots, stripes))
+        if not buckets or any(lower >= upper for lower, upper in zip(buckets, buckets[1:])):
+            raise ValueError("buckets must be increasing and not empty, got %r." % (buckets,))
+        self.client = client
+        self.flush_interval = flush_interval
+        self.slots = slots
+        self.buckets = tuple(float(bucket) for bucket in buckets)
+
+        # the values of a slot: the counter or gauge value, else sum, min, max and the count per bucket (and +Inf)
+        self._values = struct.Struct("<%dd" % (3 + len(self.buckets) + 1))
+        self._value = struct.Struct("<d")
+        self._key_offset = _HEADER.size
+        self._values_offset = _HEADER.size + KEY_SIZE
+        self._slot_size = self._values_offset + self._values.size
+        self._memory = mmap.mmap(-1, _TABLE_HEADER.size + slots * self._slot_size)
+        self._locks = [multiprocessing.Lock() for _ in range(min(stripes, slots))]
+        self._table_lock = multiprocessing.Lock()
+        self._drops = 0
+        self._drops_lock = threading.Lock()
+
+        # the slot of each key per process, -1 if dropped, a slot never changes its key
+        self._cache: Dict[Tuple[int, bytes], int] = {}  # pylint: disable=E1136
+        self._max_cached = 2 * slots
+        self._owner = os.getpid()
+        self._wake = threading.Event()
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        _shared_clients.add(self)
+
+    def _slot(self, kind: int, metric: Text, tags: Optional[List[str]]) -> int:  # pylint: disable=E1136
+        """Returns the slot of the series, claims a free one on first use, -1 if the series is dropped.
+
+        Note: the dropped series are remembered per process too, so a full table never costs more than one probe.
+        """
+        key = _encode(metric, tuple(tags) if tags else ())
+        cached = self._cache.get((kind, key))
+        if cached is not None:
+            return cached
+        index = self._claim(kind, key) if len(key) <= KEY_SIZE else -1
+        if index < 0 and len(self._cache) >= self._max_cached:
+            # bounds the remembered drops, e.g. of unbounded tag values
+            self._cache = {cached_key: cached for cached_key, cached in self._cache.items() if cached >= 0}
+        self._cache[(kind, key)] = index
+        return index
+
+    def _claim(self, kind: int, key: bytes) -> int:
+        """Finds or claims the slot of the key within MAX_PROBES slots, under the table lock.
+        """
+        memory = self._memory
+        start = zlib.crc32(key) % self.slots
+        with self._table_lock:
+            for probe in range(min(MAX_PROBES, self.slots)):
+                index = (start + probe) % self.slots
+                offset = self._offset(index)
+                used, slot_kind, _, length = _HEADER.unpack_from(memory, offset)
+                if used == _EMPTY:
+                    # the key and values first, the header publishes the slot to the collector
+                    memory[offset + self._key_offset:offset + self._key_offset + len(key)] = key
+                    self._values.pack_into(memory, offset + self._values_offset, *self._initial(kind))
+                    _HEADER.pack_into(memory, offset, _USED, kind, 0, len(key))
+                    return index
+                if slot_kind == kind and length == len(key) and \
+                        memory[offset + self._key_offset:offset + self._key_offset + length] == key:
+                    return index
+        return -1
+
+    def _offset(self, index: int) -> int:
+        return _TABLE_HEADER.size + index * self._slot_size
+
+    def _drop(self) -> None:
+        """Counts a dropped value in this process, every DROP_BATCH drops they are added to the shared count.
+        """
+        with self._drops_lock:
+            self._drops += 1
+            if self._drops < DROP_BATCH:
+                return
+        self.publish_dropped()
+
+    def publish_dropped(self) -> None:
+        """Adds the values dropped by this process to the shared count, visible to the collector, see dropped.
+
+        Note: called on flush and on interpreter shutdown, a process ending with os._exit should call it before.
+        """
+        with self._drops_lock:
+            drops, self._drops = self._drops, 0
+        if not drops:
+            return
+        with self._table_lock:
+            dropped, = _TABLE_HEADER.unpack_from(self._memory, 0)
+            _TABLE_HEADER.pack_into(self._memory, 0, dropped + drops)
+
+    @property
+    def dropped(self) -> int:
+        """Returns the values dropped since the table was full or the key too long, by this process and as published
+        by the others, see publish_dropped.
+        """
+        return _TABLE_HEADER.unpack_from(self._memory, 0)[0] + self._drops
+
+    def _initial(self, kind: int) -> List[float]:  # pylint: disable=E1136
+        values = [0.0] * (self._values.size // 8)
+        if kind == HISTOGRAM:
+            values[1], values[2] = float("inf"), float("-inf")
+        return values
+
+    def timing(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        index = self._slot(HISTOGRAM, metric, tags)
+        if index < 0:
+            self._drop()
+            return
+        offset = self._offset(index)
+        values_offset = offset + self._values_offset
+        bucket = 3 + bisect_left(self.buckets, value)
+        with self._locks[index % len(self._locks)]:
+            values = list(self._values.unpack_from(self._memory, values_offset))
+            values[0] += value
+            if value < values[1]:
+                values[1] = value
+            if value > values[2]:
+                values[2] = value
+            values[bucket] += 1
+            self._values.pack_into(self._memory, values_offset, *values)
+            self._memory[offset + _DIRTY] = 1
+
+    def increment(self, metric: Text, value: float = 1, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        index = self._slot(COUNTER, metric, tags)
+        if index < 0:
+            self._drop()
+            return
+        offset = self._offset(index)
+        with self._locks[index % len(self._locks)]:
+            current, = self._value.unpack_from(self._memory, offset + self._values_offset)
+            self._value.pack_into(self._memory, offset + self._values_offset, current + value)
+            self._memory[offset + _DIRTY] = 1
+
+    def gauge(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        index = self._slot(GAUGE, metric, tags)
+        if index < 0:
+            self._drop()
+            return
+        offset = self._offset(index)
+        with self._locks[index % len(self._locks)]:
+            self._value.pack_into(self._memory, offset + self._values_offset, value)
+            self._memory[offset + _DIRTY] = 1
+
+    def collect(self, reset: bool = True) -> Dict[Tuple[str, str, Tuple[str, ...]], Any]:  # pylint: disable=E1136
+        """Returns the series updated since the last reset, by (kind, metric, tags).
+
+        The value of a counter or gauge is a float, a histogram is a dict of sum, min, max, count and the counts.
+
+        Args:
+            reset (bool, optional): resets the counters and histograms, starting the next window. Defaults to True.
+        """
+        collected: Dict[Tuple[str, str, Tuple[str, ...]], Any] = {}  # pylint: disable=E1136
+        memory = self._memory
+        for index in range(self.slots):
+            offset = self._offset(index)
+            with self._locks[index % len(self._locks)]:
+                used, kind, dirty, length = _HEADER.unpack_from(memory, offset)
+                if used == _EMPTY or not dirty:
+                    continue
+                key = memory[offset + self._key_offset:offset + self._key_offset + length]
+                values = self._values.unpack_from(memory, offset + self._values_offset)
+                if reset:
+                    memory[offset + _DIRTY] = 0
+                    if kind != GAUGE:
+                        self._values.pack_into(memory, offset + self._values_offset, *self._initial(kind))
+            metric, tags = _decode(key)
+            if kind == HISTOGRAM:
+                counts = list(values[3:])
+                collected[(_KINDS[kind], metric, tags)] = {
+                    "sum": values[0], "min": values[1], "max": values[2], "count": sum(counts), "counts": counts}
+            else:
+                collected[(_KINDS[kind], metric, tags)] = values[0]
+        return collected
+
+    def flush(self) -> None:
+        """Sends the series updated since the last flush to the client, see the module documentation.
+        """
+        self.publish_dropped()
+        client = self.client or get_default_metric()
+        for (kind, metric, tags), value in self.collect().items():
+            if kind == "counter":
+                client.increment(metric, value, list(tags))
+            elif kind == "gauge":
+                client.gauge(metric, value, list(tags))
+            elif value["count"]:
+                minimum, maximum = value["min"], value["max"]
+                send_summary(client, metric, list(tags), value["count"], value["sum"], minimum, maximum)
+                for name, q in SUMMARY_QUANTILES:
+                    client.gauge("%s.%s" % (metric, name),
+                                 quantile(self.buckets, value["counts"], minimum, maximum, q), list(tags))
+
+    def start(self) -> None:
+        """Starts the collector thread, flushing each flush_interval, in the calling process only, e.g. the parent.
+        """
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._owner = os.getpid()
+        self._worker = threading.Thread(target=self._run, name="observe-shared", daemon=True)
+        self._worker.start()
+
+    def _run(self) -> None:
+        while not self._wake.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    def stop(self) -> None:
+        """Stops the collector thread.
+        """
+        self._wake.set()
+
+    @property
+    def collector(self) -> bool:
+        """Returns whether this process flushes the aggregation, the process which created or started it.
+        """
+        return os.getpid() == self._owner
+
+
+# all SharedMetric clients, flushed on interpreter shutdown by their collector process
+_shared_clients: "weakref.WeakSet[SharedMetric]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    """Drops the unpublished drops of the parent in a forked child, those are published by the parent.
+    """
+    for client in list(_shared_clients):
+        client._drops = 0  # pylint: disable=W0212
+        client._drops_lock = threading.Lock()  # pylint: disable=W0212
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@atexit.register
+def _flush_shared() -> None:
+    for client in list(_shared_clients):
+        client.publish_dropped()
+        if client.collector:
+            try:
+                client.flush()
+            except Exception:  # pylint: disable=W0703
+                pass
@@ -0,0 +1,289 @@
+"""This module defines a mergeable, bounded-memory quantile sketch (DDSketch-style) for in-process latencies.
+The SketchRegistry maintains one sketch per timing metric (optionally per tags), see @observe(sketch=True).
+"""
+import math
+import os
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from atl_observe.lib.metrics import get_default_metric
+
+# the quantiles exposed by LatencySketch.summary and sent by SketchRegistry.emit
+SUMMARY_QUANTILES: Tuple[Tuple[str, float], ...] = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))  # pylint: disable=E1136
+
+
+class LatencySketch:
+    """A DDSketch-style quantile sketch, every quantile is accurate within the relative accuracy.
+
+    Values are counted in logarithmic bins, the memory is bounded by max_bins: if exceeded, the lowest bins are
+    collapsed, so only the accuracy of the lowest quantiles degrades. Values <= 0 are counted as 0.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048) -> None:
+        """Initializes the LatencySketch.
+
+        Args:
+            relative_accuracy (float, optional): the relative accuracy of the quantiles, in (0, 1). Defaults to 0.01.
+            max_bins (int, optional): the maximum number of bins. Defaults to 2048.
+
+        Raises:
+            ValueError: if relative_accuracy or max_bins are out of range.
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1), got %r." % relative_accuracy)
+        if max_bins < 1:
+            raise ValueError("max_bins must be greater than 0, got %r." % max_bins)
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}  # pylint: disable=E1136
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._lock = threading.Lock()
+
+    def add(self, value: float) -> None:
+        """Adds a value to the sketch.
+        """
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+            if value <= 0:
+                self.zero_count += 1
+                return
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + 1
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+
+    def merge(self, other: "LatencySketch", weight: float = 1) -> None:
+        """Merges the other sketch into this sketch, both must have the same relative accuracy.
+
+        Args:
+            other (LatencySketch): the sketch to merge.
+            weight (float, optional): the weight of each value of the other sketch, e.g. 1/sample_rate. Defaults to 1.
+
+        Raises:
+            ValueError: if the relative accuracy differs.
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("can't merge sketches with different relative accuracy.")
+        with other._lock:  # pylint: disable=W0212
+            bins = dict(other.bins)
+            zero_count, count, total = other.zero_count, other.count, other.sum
+            minimum, maximum = other.min, other.max
+        with self._lock:
+            for index, bin_count in bins.items():
+                self.bins[index] = self.bins.get(index, 0) + bin_count * weight
+            self.zero_count += zero_count * weight
+            self.count += count * weight
+            self.sum += total * weight
+            self.min = min(self.min, minimum)
+            self.max = max(self.max, maximum)
+            while len(self.bins) > self.max_bins:
+                self._collapse()
+
+    def __getstate__(self) -> Dict[str, Any]:  # pylint: disable=E1136
+        """Returns the state without the lock, e.g. to merge sketches built in other processes.
+        """
+        with self._lock:
+            state = dict(self.__dict__)
+        state["bins"] = dict(state["bins"])
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:  # pylint: disable=E1136
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _collapse(self) -> None:
+        """Collapses the two lowest bins into one.
+        """
+        lowest, second = sorted(self.bins)[:2]
+        self.bins[second] += self.bins.pop(lowest)
+
+    def quantile(self, quantile: float) -> Optional[float]:  # pylint: disable=E1136
+        """Returns the estimated value at the quantile, in [0, 1], None if the sketch is empty.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            if quantile <= 0:
+                return self.min
+            if quantile >= 1:
+                return self.max
+            rank = quantile * (self.count - 1)
+            if rank < self.zero_count:
+                return max(self.min, 0.0)
+            seen = self.zero_count
+            for index in sorted(self.bins):
+                seen += self.bins[index]
+                if seen > rank:
+                    # the middle of the bin, within the relative accuracy of all values in the bin
+                    value = 2 * self.gamma ** index / (self.gamma + 1)
+                    return min(max(value, self.min), self.max)
+            return self.max
+
+    def summary(self) -> Dict[str, float]:  # pylint: disable=E1136
+        """Returns count, p50, p90, p99 and max, empty if the sketch is empty.
+        """
+        if not self.count:
+            return {}
+        summary: Dict[str, float] = {"count": self.count}  # pylint: disable=E1136
+        for name, quantile in SUMMARY_QUANTILES:
+            summary[name] = self.quantile(quantile)  # type: ignore
+        summary["max"] = self.max
+        return summary
+
+
+class SketchRegistry:
+    """The SketchRegistry maintains one LatencySketch per timing metric and tags, bounded by max_sketches.
+
+    The emitting thread is started on the first value recorded with a client, e.g. by @observe(sketch=True), unless
+    started or stopped before, see SketchRegistry.start.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048, max_sketches: int = 1000) -> None:
+        """Initializes the SketchRegistry.
+
+        Args:
+            relative_accuracy (float, optional): see LatencySketch. Defaults to 0.01.
+            max_bins (int, optional): see LatencySketch. Defaults to 2048.
+            max_sketches (int, optional): the maximum of sketches, further values are dropped. Defaults to 1000.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.max_sketches = max_sketches
+        self.dropped = 0
+        self._sketches: Dict[Tuple[str, Tuple[str, ...]], LatencySketch] = {}  # pylint: disable=E1136
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        self._stop = threading.Event()
+        _registries.add(self)
+
+    def record(self, metric: str, value: float, tags: Tuple[str, ...] = (), imetric: Any = None) -> None:  # pylint: disable=E1136
+        """Adds the value to the sketch of the metric and tags.
+
+        Args:
+            metric (str): the timing metric.
+            value (float): the process time.
+            tags (Tuple[str, ...], optional): the tags of the sketch. Defaults to ().
+            imetric (IMetric | DogStatsd, optional): the client the emitting thread is started with, on first use.
+        """
+        if imetric is not None and self._worker is None:
+            self.start(imetric)
+        key = (metric, tags)
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            with self._lock:
+                sketch = self._sketches.get(key)
+                if sketch is None:
+                    if len(self._sketches) >= self.max_sketches:
+                        self.dropped += 1
+                        return
+                    sketch = LatencySketch(relative_accuracy=self.relative_accuracy, max_bins=self.max_bins)
+                    self._sketches[key] = sketch
+        sketch.add(value)
+
+    def get(self, metric: str, tags: Optional[List[str]] = None) -> Optional[LatencySketch]:  # pylint: disable=E1136
+        """Returns the sketch of the metric, merged over all tags if no tags were provided. None if not recorded.
+        """
+        if tags is not None:
+            return self._sketches.get((metric, tuple(tags)))
+        merged: Optional[LatencySketch] = None  # pylint: disable=E1136
+        for (name, _), sketch in list(self._sketches.items()):
+            if name != metric:
+                continue
+            if merged is None:
+                merged = LatencySketch(relative_accuracy=self.relative_accuracy, max_bins=self.max_bins)
+            merged.merge(sketch)
+        return merged
+
+    def quantile(self, metric: str, quantile: float, tags: Optional[List[str]] = None) -> Optional[float]:  # pylint: disable=E1136
+        """Returns the estimated value at the quantile for the metric, see SketchRegistry.get.
+        """
+        sketch = self.get(metric, tags=tags)
+        return sketch.quantile(quantile) if sketch is not None else None
+
+    def summaries(self) -> Dict[Tuple[str, Tuple[str, ...]], Dict[str, float]]:  # pylint: disable=E1136
+        """Returns the summary of each sketch, by (metric, tags).
+        """
+        return {key: sketch.summary() for key, sketch in list(self._sketches.items())}
+
+    def emit(self, imetric: Any, reset: bool = True) -> None:
+        """Sends the summary of each sketch as gauges `<metric>.p50`, `.p90`, `.p99`, `.max` to the client.
+
+        Args:
+            imetric (IMetric | DogStatsd): the client to send to.
+            reset (bool, optional): starts a new window after sending. Defaults to True.
+        """
+        with self._lock:
+            sketches = self._sketches
+            if reset:
+                self._sketches = {}
+        for (metric, tags), sketch in sketches.items():
+            for name, value in sketch.summary().items():
+                if name != "count":
+                    imetric.gauge("%s.%s" % (metric, name), value, list(tags))
+
+    def start(self, imetric: Any = None, interval: float = 60.0) -> None:
+        """Starts a thread which emits (and resets) the sketches each interval.
+
+        Args:
+            imetric (IMetric | DogStatsd, optional): the client to send to. Defaults to the process-wide default.
+            interval (float, optional): the seconds between emits. Defaults to 60.0.
+        """
+        def run() -> None:
+            while not self._stop.wait(interval):
+                self.emit(imetric or get_default_metric())
+
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(target=run, name="observe-sketch", daemon=True)
+            self._worker.start()
+
+    def stop(self) -> None:
+        """Stops the emitting thread.
+        """
+        self._stop.set()
+
+    def clear(self) -> None:
+        """Drops all sketches.
+        """
+        with self._lock:
+            self._sketches = {}
+
+    def _after_fork_in_child(self) -> None:
+        """Drops the sketches of the parent, those are emitted by the parent. The emitting thread is started again on
+        first use, unless stopped.
+        """
+        self._lock = threading.Lock()
+        self._sketches = {}
+        if not self._stop.is_set():
+            self._worker = None
+
+
+# all SketchRegistry instances, reset in a forked child
+_registries: "weakref.WeakSet[SketchRegistry]" = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for registry in list(_registries):
+        registry._after_fork_in_child()  # pylint: disable=W0212
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+# the process-wide registry used by @observe(sketch=True)
+sketches = SketchRegistry()
@@ -4,13 +4,26 @@ To setup your slack app, and get a webhook see:
 Ensure to add the slack web hook to the environment as "SLACK_WEB_HOOK"
 """
 
+import atexit
 import json
 import os
+import queue
+import re
+import threading
 import time
-from typing import Any, Dict, List, Optional
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
+from atl_observe.lib.metrics import get_default_metric
+
+# seconds to wait for slack to respond, see requests timeout
+DEFAULT_TIMEOUT = 5.0
+# overflow policies of the BackgroundSlack queue
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
 
 class MissingSlackWebhookException(Exception):
     """This exception is raised when no slack web hook was provided/found.
@@ -21,11 +34,12 @@ class Slack:
     """This class implements a default Slack client used by @observe decorator.
     """
 
-    def __init__(self, web_hook: Optional[str] = None) -> None:  # pylint: disable=E1136
+    def __init__(self, web_hook: Optional[str] = None, timeout: float = DEFAULT_TIMEOUT) -> None:  # pylint: disable=E1136
         """Initializes the Slack client.
 
         Args:
             web_hook (str, optional): the slack web hook to be used for notifications. Defaults to None.
+            timeout (float, optional): seconds to wait for slack to respond. Defaults to DEFAULT_TIMEOUT.
 
         Raises:
             MissingSlackWebhookException
@@ -35,6 +49,9 @@ class Slack:
             raise MissingSlackWebhookException("Failed to determine the slack web hook, please inject or add to os.environ as 'SLACK_WEB_HOOK'.\nsee: https://api.slack.com/messaging/webhooks")
         self.web_hook: str = _web_hook
         self.footer = "app_name=%s" % os.environ.get("APP_NAME", "@observe")
+        self.timeout = timeout
+        # the session of each thread, a requests.Session is not thread-safe
+        self._local = threading.local()
 
     def info(self, text: str, header: Optional[str] = None, title: Optional[str] = None) -> requests.Response:  # pylint: disable=E1136
         """Creates a colorcoded and formatted info message and pushes it to slack.
@@ -70,13 +87,372 @@ class Slack:
             }]
         }
 
-    def _post(self, payload: Dict[str, Any]) -> requests.Response:
+    def _get_session(self) -> requests.Session:
+        """Returns the pooled session of this client and the calling thread, created on first use and again in a
+        forked child.
+        """
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, "session", None) is None or local.pid != pid:
+            local.session = requests.Session()
+            local.pid = pid
+        return local.session
+
+    def _post(self, payload: Dict[str, Any]) -> Optional[requests.Response]:  # pylint: disable=E1136
         """Posts the payload to the provided SLACK_WEB_HOOK.
         """
+        return self._send(payload=payload)
+
+    def _send(self, payload: Dict[str, Any]) -> requests.Response:
+        """Sends the payload to the provided SLACK_WEB_HOOK, using the pooled session. A text which is not a str, e.g. the
+        lazily formatted traceback of @observe, is formatted here.
+        """
         kwargs = {
-            "data": json.dumps(payload),
+            "data": json.dumps(payload, default=str),
             "headers": {
                 "content-type": "application/json"
-            }
+            },
+            "timeout": self.timeout
         }
-        return requests.post(url=self.web_hook, **kwargs)
+        return self._get_session().post(url=self.web_hook, **kwargs)
+
+
+class BackgroundSlack(Slack):
+    """This class implements a Slack client which delivers the notifications in the background.
+
+    The notifications are put on a bounded queue, drained by a worker thread. If the queue is full, the notification
+    is dropped according to the overflow policy. All queued notifications are flushed on interpreter shutdown.
+
+    Metrics:
+        observe.slack.sent, observe.slack.dropped, observe.slack.failed
+    """
+
+    def __init__(self,
+                 web_hook: Optional[str] = None,  # pylint: disable=E1136
+                 timeout: float = DEFAULT_TIMEOUT,
+                 max_queue_size: int = 1000,
+                 overflow: str = DROP_NEWEST,
+                 metric: Any = None) -> None:
+        """Initializes the BackgroundSlack client.
+
+        Args:
+            web_hook (str, optional): the slack web hook to be used for notifications. Defaults to None.
+            timeout (float, optional): seconds to wait for slack to respond. Defaults to DEFAULT_TIMEOUT.
+            max_queue_size (int, optional): the maximum of queued notifications. Defaults to 1000.
+            overflow (str, optional): DROP_NEWEST or DROP_OLDEST, if the queue is full. Defaults to DROP_NEWEST.
+            metric (IMetric, optional): the client to count sent, dropped, failed. Defaults to the process default.
+
+        Raises:
+            MissingSlackWebhookException
+            ValueError: if max_queue_size is not positive, or the overflow is unknown.
+        """
+        super().__init__(web_hook=web_hook, timeout=timeout)
+        if max_queue_size <= 0:
+            raise ValueError("max_queue_size must be greater than 0, got %r." % max_queue_size)
+        if overflow not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("overflow must be one of '%s', '%s'." % (DROP_NEWEST, DROP_OLDEST))
+        self.overflow = overflow
+        self.metric = metric
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        self._lock = threading.Lock()
+        _background_clients.add(self)
+
+    def _post(self, payload: Dict[str, Any]) -> Optional[requests.Response]:  # pylint: disable=E1136
+        """Queues the payload to be sent by the worker thread.
+
+        Returns:
+            None: the response is not available in the background.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(payload)
+            return None
+        except queue.Full:
+            pass
+
+        if self.overflow == DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._queue.put_nowait(payload)
+            except (queue.Empty, queue.Full):
+                pass
+        self._count("dropped")
+        return None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:  # pylint: disable=E1136
+        """Waits until all queued notifications have been delivered (or failed).
+
+        Args:
+            timeout (Optional[float], optional): the seconds to wait at most. Defaults to None, wait forever.
+
+        Returns:
+            bool: True if the queue was drained.
+        """
+        if self._worker is None or not self._worker.is_alive():
+            return self._queue.unfinished_tasks == 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _ensure_worker(self) -> None:
+        """Starts the worker thread on first use, and again in a forked child.
+        """
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._drain, name="observe-slack", daemon=True)
+                self._worker.start()
+
+    def _drain(self) -> None:
+        """Sends the queued notifications, runs in the worker thread.
+        """
+        while True:
+            payload = self._queue.get()
+            try:
+                self._send(payload=payload).raise_for_status()
+                self._count("sent")
+            except Exception:  # pylint: disable=W0703
+                self._count("failed")
+            finally:
+                self._queue.task_done()
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        try:
+            (self.metric or get_default_metric()).increment("observe.slack.%s" % outcome, 1)
+        except Exception:  # pylint: disable=W0703
+            pass
+
+
+class _Occurrences:
+    """The occurrences of one notification fingerprint, see CoalescingSlack.
+    """
+    __slots__ = ("header", "title", "text", "count", "window_start", "last_seen")
+
+    def __init__(self, header: str, title: str, text: str, now: float) -> None:
+        self.header = header
+        self.title = title
+        self.text = text
+        self.count = 0
+        self.window_start = now
+        self.last_seen = now
+
+
+class CoalescingSlack(Slack):
+    """This class coalesces duplicate notifications in front of a Slack client.
+
+    Notifications are fingerprinted by identity (without trace_id), title (exception type) and the top frame of the
+    traceback. The first occurrence is sent immediately, duplicates are counted and rolled into one digest message per
+    fingerprint and interval. A fingerprint without duplicates for a whole interval expires, so its next occurrence is
+    sent immediately again. The fingerprints are kept in the order last seen, idle ones are expired on insert too, so
+    unique failures never fill the table while no digest thread runs.
+    """
+
+    def __init__(self,
+                 slack: Optional[Slack] = None,  # pylint: disable=E1136
+                 interval: float = 60.0,
+                 max_fingerprints: int = 1000) -> None:  # pylint: disable=W0231
+        """Initializes the CoalescingSlack client.
+
+        Args:
+            slack (Slack, optional): the client to send to, e.g. BackgroundSlack. Defaults to Slack().
+            interval (float, optional): the seconds per digest window. Defaults to 60.0.
+            max_fingerprints (int, optional): the maximum of tracked fingerprints, else sent directly. Defaults to 1000.
+
+        Raises:
+            MissingSlackWebhookException
+        """
+        self.slack = slack or Slack()
+        self.web_hook = self.slack.web_hook
+        self.footer = self.slack.footer
+        self.timeout = self.slack.timeout
+        self.interval = interval
+        self.max_fingerprints = max_fingerprints
+        self.coalesced = 0
+        self._occurrences: Dict[Tuple[str, ...], _Occurrences] = {}  # pylint: disable=E1136
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        _coalescing_clients.add(self)
+
+    def _post(self, payload: Dict[str, Any]) -> Optional[requests.Response]:  # pylint: disable=E1136
+        """Sends the first occurrence of the payload, counts duplicates for the next digest.
+        """
+        attachment = payload["attachments"][0]
+        fingerprint = CoalescingSlack.fingerprint(attachment)
+        now = time.monotonic()
+        with self._lock:
+            occurrences = self._occurrences.get(fingerprint)
+            if occurrences is not None:
+                occurrences.count += 1
+                occurrences.last_seen = now
+                self.coalesced += 1
+                duplicate = True
+                # keeps the order last seen, see _expire
+                del self._occurrences[fingerprint]
+                self._occurrences[fingerprint] = occurrences
+            else:
+                duplicate = False
+                self._expire(now)
+                if len(self._occurrences) < self.max_fingerprints:
+                    self._occurrences[fingerprint] = _Occurrences(
+                        header=attachment["author_name"], title=attachment["title"], text=attachment["text"], now=now)
+        if duplicate:
+            self._ensure_worker()
+            return None
+        return self.slack._post(payload=payload)  # pylint: disable=W0212
+
+    def _expire(self, now: float) -> None:
+        """Removes the fingerprints idle for an interval without pending duplicates, the least recently seen first.
+        Stops at the first one not idle, so an insert costs O(1) amortized. Called under the lock.
+        """
+        expired = []
+        for fingerprint, occurrences in self._occurrences.items():
+            if occurrences.count or now - occurrences.last_seen < self.interval:
+                break
+            expired.append(fingerprint)
+        for fingerprint in expired:
+            del self._occurrences[fingerprint]
+
+    @staticmethod
+    def fingerprint(attachment: Dict[str, Any]) -> Tuple[str, ...]:  # pylint: disable=E1136
+        """Returns the fingerprint of a notification: color, identity without trace_id, title and top frame.
+        """
+        header = attachment.get("author_name") or ""
+        if header.endswith(")") and "(" in header:
+            header = header[:header.rindex("(")]
+        frames = _FRAME.findall(str(attachment.get("text") or ""))
+        top_frame = frames[-1] if frames else ""
+        return (attachment.get("color") or "", header, attachment.get("title") or "", top_frame)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:  # pylint: disable=E1136,W0613
+        """Sends the digests of all pending duplicates, regardless of the interval.
+
+        Returns:
+            bool: True, the digests were handed to the client.
+        """
+        self._send_digests(now=time.monotonic(), force=True)
+        return True
+
+    def _send_digests(self, now: float, force: bool = False) -> None:
+        """Sends a digest per fingerprint with duplicates in a completed window, expires idle fingerprints.
+        """
+        digests: List[Tuple[_Occurrences, int, float]] = []  # pylint: disable=E1136
+        with self._lock:
+            for fingerprint, occurrences in list(self._occurrences.items()):
+                if not force and now - occurrences.window_start < self.interval:
+                    continue
+                if occurrences.count:
+                    digests.append((occurrences, occurrences.count, now - occurrences.window_start))
+                    occurrences.count = 0
+                    occurrences.window_start = now
+                elif now - occurrences.last_seen >= self.interval:
+                    del self._occurrences[fingerprint]
+
+        for occurrences, count, window in digests:
+            try:
+                self.slack.warning(
+                    header=occurrences.header,
+                    title="%s (%d more in %ds)" % (occurrences.title, count, window),
+                    text="%d more occurrences between %s and %s, last notification:\n%s" % (
+                        count,
+                        time.strftime("%H:%M:%S", time.localtime(time.time() - window)),
+                        time.strftime("%H:%M:%S"),
+                        occurrences.text))
+            except Exception:  # pylint: disable=W0703
+                pass
+
+    def _ensure_worker(self) -> None:
+        """Starts the digest thread on first duplicate, and again in a forked child.
+        """
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._digest, name="observe-slack-digest", daemon=True)
+                self._worker.start()
+
+    def _digest(self) -> None:
+        """Sends the digests each interval, runs in the digest thread.
+        """
+        while True:
+            time.sleep(min(self.interval, 1.0))
+            self._send_digests(now=time.monotonic())
+
+
+# the frames of a formatted traceback, the last one is the top frame (where raised)
+_FRAME = re.compile(r'File "([^"]+)", line (\d+), in (\S+)')
+
+# all CoalescingSlack and BackgroundSlack clients, flushed on interpreter shutdown
+_coalescing_clients: "weakref.WeakSet[CoalescingSlack]" = weakref.WeakSet()
+_background_clients: "weakref.WeakSet[BackgroundSlack]" = weakref.WeakSet()
+
+
+@atexit.register
+def flush_all(timeout: float = DEFAULT_TIMEOUT) -> None:
+    """Flushes all CoalescingSlack, then all BackgroundSlack clients, registered to run on interpreter shutdown.
+    """
+    for coalescing in list(_coalescing_clients):
+        coalescing.flush()
+    for client in list(_background_clients):
+        client.flush(timeout=timeout)
+
+
+# the process-wide default client, used by @observe when no client was found for a call
+_default_slack: Optional[Slack] = None  # pylint: disable=E1136
+_default_lock = threading.Lock()
+
+
+def get_default_slack(background: Optional[bool] = None) -> Slack:  # pylint: disable=E1136
+    """Returns the process-wide default Slack(), created on first use from os.environ, see SLACK_WEB_HOOK.
+
+    Args:
+        background (Optional[bool], optional): whether the default is a BackgroundSlack(). Defaults to None, a
+            BackgroundSlack if SLACK_BACKGROUND is set to "1" or "true" in os.environ.
+
+    Note: the client is created again if SLACK_WEB_HOOK, APP_NAME or the background setting changed, its sessions are
+    created again in a forked child, see Slack._get_session.
+
+    Raises:
+        MissingSlackWebhookException
+    """
+    global _default_slack  # pylint: disable=W0603
+    if background is None:
+        background = os.environ.get("SLACK_BACKGROUND", "").lower() in ("1", "true")
+    web_hook = os.environ.get("SLACK_WEB_HOOK")
+    footer = "app_name=%s" % os.environ.get("APP_NAME", "@observe")
+
+    def current(slack: Optional[Slack]) -> bool:  # pylint: disable=E1136
+        return slack is not None and slack.web_hook == web_hook and slack.footer == footer and \
+            isinstance(slack, BackgroundSlack) == background
+
+    slack = _default_slack
+    if current(slack):
+        return slack  # type: ignore
+    with _default_lock:
+        slack = _default_slack
+        if not current(slack):
+            slack = _default_slack = BackgroundSlack() if background else Slack()
+        return slack  # type: ignore
+
+
+def _after_fork_in_child() -> None:
+    global _default_lock  # pylint: disable=W0603
+    _default_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
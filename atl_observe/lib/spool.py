@@ -0,0 +1,365 @@
+"""This module spools the metrics and logs of @observe to local NDJSON files, e.g. where no statsd agent is reachable.
+
+Each record is one compact JSON line, buffered in memory and written in batches, one write per batch:
+    {"ts":1700000000.123,"kind":"timing","metric":"process.time.finished","value":12.5,"tags":["type:a"],
+     "outcome":"finished","trace_id":"abcd"}
+The kind is "timing", "increment", "gauge" or "log", the outcome and trace_id are only present if known. The files
+rotate on size and age, named `<prefix>-<utc time>-<pid>-<sequence>.ndjson` so that forked processes never share one.
+The spooled metrics are replayed into any IMetric client later, see replay.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import (Any, Deque, Dict, Iterable, Iterator, List, Optional, Text,
+                    Union)
+
+from atl_observe.lib.context import current_trace_id
+from atl_observe.lib.metrics import IMetric
+
+# the defaults of the rotation and buffering, see Spool
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 3600.0
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_BUFFERED = 100000
+
+SUFFIX = ".ndjson"
+
+# the increment spooled for the records dropped since the buffer was full, see Spool
+DROPPED_METRIC = "observe.spool.dropped"
+
+# the kinds of the spooled records
+TIMING = "timing"
+INCREMENT = "increment"
+GAUGE = "gauge"
+LOG = "log"
+
+# the outcome of a metric, by the last part of its name, see atl_observe.lib.plan
+_OUTCOMES = {"finished": "finished", "accepted": "accepted", "declined": "declined", "raised": "raised"}
+
+
+def outcome_of(metric: str) -> Optional[str]:  # pylint: disable=E1136
+    """Returns the outcome of a metric sent by @observe, e.g. `process.time.finished` -> `finished`, else None.
+    """
+    return _OUTCOMES.get(metric.rpartition(".")[2])
+
+
+class Spool:
+    """The Spool appends records to rotating NDJSON files, buffered in memory and written in batches.
+
+    The buffer is written by a daemon thread, signalled when it reaches batch_size records and each flush_interval
+    seconds, on flush and on interpreter shutdown. The caller never writes. The records are buffered up to
+    max_buffered, e.g. while a write fails because the disk is full, the oldest beyond are dropped and counted in
+    `dropped`, the failed writes in `errors`. The drops are spooled too, as an increment of `observe.spool.dropped`
+    with the next written batch, so replay reports them.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 prefix: str = "observe",
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_buffered: int = DEFAULT_MAX_BUFFERED) -> None:
+        """Initializes the Spool, creates the directory if missing.
+
+        Args:
+            directory (str): the directory of the spool files.
+            prefix (str, optional): the prefix of the spool file names. Defaults to "observe".
+            max_bytes (int, optional): the size which rotates the file. Defaults to DEFAULT_MAX_BYTES.
+            max_age (float, optional): the seconds after which the file is rotated. Defaults to DEFAULT_MAX_AGE.
+            flush_interval (float, optional): the seconds between the writes of the buffer. Defaults to 1.0.
+            batch_size (int, optional): the buffered records which trigger a write. Defaults to 1000.
+            max_buffered (int, optional): the records kept while writes fail. Defaults to 100000.
+
+        Raises:
+            ValueError: if a size or interval is not positive, or max_buffered is lower than batch_size.
+        """
+        if max_bytes <= 0 or max_age <= 0 or flush_interval <= 0 or batch_size <= 0:
+            raise ValueError("max_bytes, max_age, flush_interval and batch_size must be greater than 0.")
+        if max_buffered < batch_size:
+            raise ValueError("max_buffered must not be lower than batch_size, got %r < %r." % (max_buffered, batch_size))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self.errors = 0
+        self._sequence = 0
+        self._reset()
+        _spools.add(self)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker: Optional[threading.Thread] = None  # pylint: disable=E1136
+        self._buffer: Deque[Dict[str, Any]] = deque()  # pylint: disable=E1136
+        self._fd: Optional[int] = None  # pylint: disable=E1136
+        self._path: Optional[str] = None  # pylint: disable=E1136
+        self._size = 0
+        self._opened = 0.0
+        # the drops not yet written as observe.spool.dropped
+        self._unreported = 0
+
+    @property
+    def path(self) -> Optional[str]:  # pylint: disable=E1136
+        """Returns the path of the file written to, None before the first write.
+        """
+        return self._path
+
+    def append(self, record: Dict[str, Any]) -> None:  # pylint: disable=E1136
+        """Buffers the record, signals the flush thread if the buffer reached batch_size.
+        """
+        with self._lock:
+            self._buffer.append(record)
+            buffered = len(self._buffer)
+            if buffered > self.max_buffered:
+                self._buffer.popleft()
+                self.dropped += 1
+                self._unreported += 1
+        worker = self._worker
+        if worker is None or not worker.is_alive():
+            self._start()
+        if buffered >= self.batch_size and not self._wake.is_set():
+            self._wake.set()
+
+    def _start(self) -> None:
+        """Starts the flush thread on first use, and in a forked child.
+        """
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="observe-spool", daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered records to the spool file, in one write.
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._buffer:
+                    return
+                records, self._buffer = self._buffer, deque()
+                unreported, self._unreported = self._unreported, 0
+            data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+            if unreported:
+                data = json.dumps({"ts": time.time(), "kind": INCREMENT, "metric": DROPPED_METRIC, "value": unreported,
+                                   "tags": []}, separators=(",", ":")) + "\n" + data
+            try:
+                self._write(data.encode("utf-8"))
+            except OSError:
+                with self._lock:
+                    records.extend(self._buffer)
+                    overflow = max(len(records) - self.max_buffered, 0)
+                    for _ in range(overflow):
+                        records.popleft()
+                    self.dropped += overflow
+                    self._unreported += unreported + overflow
+                    self._buffer = records
+                    self.errors += 1
+
+    def _write(self, data: bytes) -> None:
+        now = time.time()
+        if self._fd is not None:
+            full = self._size > 0 and self._size + len(data) > self.max_bytes
+            if full or now - self._opened >= self.max_age:
+                self._close()
+        if self._fd is None:
+            self._open(now)
+        written = os.write(self._fd, data)  # type: ignore
+        while written < len(data):
+            written += os.write(self._fd, data[written:])  # type: ignore
+        self._size += len(data)
+
+    def _open(self, now: float) -> None:
+        self._sequence += 1
+        self._path = os.path.join(self.directory, "%s-%s-%d-%04d%s" % (
+            self.prefix, time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)), os.getpid(), self._sequence, SUFFIX))
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._opened = now
+
+    def _close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def close(self) -> None:
+        """Writes the buffer and closes the spool file, the next record opens a new one.
+        """
+        try:
+            self.flush()
+        finally:
+            with self._write_lock:
+                self._close()
+
+    def _after_fork_in_child(self) -> None:
+        """Drops the buffer and closes the file of the parent in the child, the parent writes them.
+        """
+        fd = self._fd
+        self._reset()
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class SpoolMetric(IMetric):
+    """This IMetric implementation spools each call to a Spool, with the outcome and the active trace_id.
+
+    Note: the sample_rate is kept in the record as `sample_rate`, replay passes it on.
+    """
+
+    def __init__(self, spool: Union[Spool, str]) -> None:  # pylint: disable=E1136
+        """Initializes the SpoolMetric.
+
+        Args:
+            spool (Union[Spool, str]): the Spool, or the directory of a Spool with the default setup.
+        """
+        self.spool = spool if isinstance(spool, Spool) else Spool(spool)
+
+    def _append(self, kind: str, metric: Text, value: float, tags: Optional[List[str]], sample_rate: Optional[float]) -> None:  # pylint: disable=E1136
+        record: Dict[str, Any] = {"ts": time.time(), "kind": kind, "metric": metric, "value": value,  # pylint: disable=E1136
+                                  "tags": list(tags) if tags else []}
+        outcome = outcome_of(metric)
+        if outcome is not None:
+            record["outcome"] = outcome
+        trace_id = current_trace_id()
+        if trace_id:
+            record["trace_id"] = trace_id
+        if sample_rate is not None:
+            record["sample_rate"] = sample_rate
+        self.spool.append(record)
+
+    def timing(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        self._append(TIMING, metric, value, tags, sample_rate)
+
+    def increment(self, metric: Text, value: float = 1, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        self._append(INCREMENT, metric, value, tags, sample_rate)
+
+    def gauge(self, metric: Text, value: float, tags: Optional[List[str]] = None, sample_rate: Optional[float] = None) -> None:  # pylint: disable=E1136
+        self._append(GAUGE, metric, value, tags, sample_rate)
+
+    def flush(self) -> None:
+        """Writes the buffered records, see Spool.flush.
+        """
+        self.spool.flush()
+
+
+class SpoolHandler(logging.Handler):
+    """This logging.Handler spools the log records, e.g. the failures logged by @observe, with the active trace_id.
+    """
+
+    def __init__(self, spool: Union[Spool, str], level: Union[int, str] = logging.NOTSET) -> None:  # pylint: disable=E1136
+        """Initializes the SpoolHandler.
+
+        Args:
+            spool (Union[Spool, str]): the Spool, or the directory of a Spool with the default setup.
+            level (Union[int, str], optional): the level of the handler. Defaults to logging.NOTSET.
+        """
+        super().__init__(level)
+        self.spool = spool if isinstance(spool, Spool) else Spool(spool)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            spooled: Dict[str, Any] = {"ts": record.created, "kind": LOG, "level": record.levelname,  # pylint: disable=E1136
+                                       "logger": record.name, "message": self.format(record)}
+            trace_id = current_trace_id()
+            if trace_id:
+                spooled["trace_id"] = trace_id
+            self.spool.append(spooled)
+        except Exception:  # pylint: disable=W0703
+            self.handleError(record)
+
+    def flush(self) -> None:
+        self.spool.flush()
+
+
+def spool_files(paths: Union[str, Iterable[str]]) -> List[str]:  # pylint: disable=E1136
+    """Returns the spool files of the paths in write order, a directory is expanded to its `*.ndjson` files.
+    """
+    files: List[str] = []  # pylint: disable=E1136
+    for path in [paths] if isinstance(paths, str) else paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*" + SUFFIX))))
+        else:
+            files.append(path)
+    return files
+
+
+def read_records(paths: Union[str, Iterable[str]]) -> Iterator[Dict[str, Any]]:  # pylint: disable=E1136
+    """Yields the records of the spool files, skipping malformed lines, e.g. a line cut by a crash.
+    """
+    for path in spool_files(paths):
+        with open(path, "rb") as spool_file:
+            for line in spool_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict):
+                    yield record
+
+
+def replay(paths: Union[str, Iterable[str]], imetric: Any) -> int:  # pylint: disable=E1136
+    """Sends the spooled metrics to the IMetric (or DogStatsd) client, the log records are skipped.
+
+    Args:
+        paths (Union[str, Iterable[str]]): the spool files or directories, see spool_files.
+        imetric (Any): the client, e.g. Metric() once the statsd agent is reachable.
+
+    Returns:
+        int: the replayed records.
+    """
+    replayed = 0
+    for record in read_records(paths):
+        kind = record.get("kind")
+        if kind not in (TIMING, INCREMENT, GAUGE):
+            continue
+        sample_rate = record.get("sample_rate")
+        if sample_rate is None:
+            getattr(imetric, kind)(record["metric"], record["value"], record.get("tags") or [])
+        else:
+            getattr(imetric, kind)(record["metric"], record["value"], record.get("tags") or [], sample_rate)
+        replayed += 1
+    return replayed
+
+
+# all spools, flushed on interpreter shutdown, reset in forked children
+_spools: "weakref.WeakSet[Spool]" = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_spools() -> None:
+    for spool in list(_spools):
+        try:
+            spool.close()
+        except Exception:  # pylint: disable=W0703
+            pass
+
+
+def _after_fork_in_child() -> None:
+    for spool in list(_spools):
+        spool._after_fork_in_child()  # pylint: disable=W0212
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,165 @@
+"""This module defines helpers for the tags created by the @observe decorator from 'tags_from'.
+"""
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple, Union
+
+# the value of a tag collapsed by the CardinalityGuard
+OTHER_VALUE = "__other__"
+
+# the maximum of cached tag value combinations per decorated function
+DEFAULT_TAG_CACHE_SIZE = 1024
+
+# the seconds after which the admitted values of a full key are dropped, see CardinalityGuard
+DEFAULT_ADMIT_WINDOW = 3600.0
+
+
+class CardinalityGuard:
+    """The CardinalityGuard bounds the number of distinct values per tag key of one metric.
+
+    The first values seen per key are admitted, up to the limit of the key. Further values are collapsed into
+    `key:__other__` and counted, the counts are sent as `<metric>.tags.collapsed` increments tagged `tag_key:<key>`.
+
+    The admitted values of a key age out per window: if a new value finds the key full and the window of the key
+    elapsed, the admitted values are dropped and a new window starts with the new value. So a key never exceeds its
+    limit within a window, and values which appear later, e.g. new tenants, are admitted again. The check only runs
+    for values not admitted, admitted values cost one set lookup.
+    """
+
+    def __init__(self,
+                 max_values: Union[int, Dict[str, int]],  # pylint: disable=E1136
+                 window: Optional[float] = DEFAULT_ADMIT_WINDOW) -> None:  # pylint: disable=E1136
+        """Initializes the CardinalityGuard.
+
+        Args:
+            max_values (Union[int, Dict[str, int]]): the limit for all keys, or the limits per key (others unlimited).
+            window (Optional[float], optional): the seconds the admitted values of a key are kept at least, None to keep
+                them until reset. Defaults to DEFAULT_ADMIT_WINDOW.
+
+        Raises:
+            ValueError: if a limit is not a positive int, or the window is not positive.
+        """
+        if window is not None and window <= 0:
+            raise ValueError("window must be greater than 0, got %r." % window)
+        limits = max_values if isinstance(max_values, dict) else {}
+        for key, limit in limits.items():
+            CardinalityGuard._validate(limit, key)
+        if not isinstance(max_values, dict):
+            CardinalityGuard._validate(max_values, "*")
+        self.default_limit: Optional[int] = None if isinstance(max_values, dict) else max_values  # pylint: disable=E1136
+        self.limits: Dict[str, int] = {str(key): limit for key, limit in limits.items()}  # pylint: disable=E1136
+        self.collapsed: Dict[str, int] = {}  # pylint: disable=E1136
+        self.pending: int = 0
+        self.window = window
+        self._admitted: Dict[str, Set[str]] = {}  # pylint: disable=E1136
+        self._window_start: Dict[str, float] = {}  # pylint: disable=E1136
+        self._pending: Dict[str, int] = {}  # pylint: disable=E1136
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _validate(limit: Any, key: str) -> None:
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+            raise ValueError("max tag values must be a positive int, got %r for '%s'." % (limit, key))
+
+    def limit(self, key: str) -> Optional[int]:  # pylint: disable=E1136
+        """Returns the limit of the key, None if unlimited.
+        """
+        return self.limits.get(key, self.default_limit)
+
+    def admit(self, key: str, value: str) -> str:
+        """Returns the value if admitted for the key, else OTHER_VALUE.
+        """
+        admitted = self._admitted.get(key)
+        if admitted is not None and value in admitted:
+            return value
+        limit = self.limit(key)
+        if limit is None:
+            return value
+        now = time.monotonic()
+        with self._lock:
+            admitted = self._admitted.get(key)
+            if admitted is None:
+                admitted = self._admitted[key] = set()
+                self._window_start[key] = now
+            if value in admitted or len(admitted) < limit:
+                admitted.add(value)
+                return value
+            if self.window is not None and now - self._window_start[key] >= self.window:
+                # a new window, the values of the last one age out
+                self._admitted[key] = {value}
+                self._window_start[key] = now
+                return value
+            self.collapsed[key] = self.collapsed.get(key, 0) + 1
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self.pending += 1
+        return OTHER_VALUE
+
+    def emit(self, imetric: Any, metric: str) -> None:
+        """Sends the counts collapsed since the last emit as increments of the metric, tagged `tag_key:<key>`.
+        """
+        with self._lock:
+            pending, self._pending, self.pending = self._pending, {}, 0
+        for key, count in pending.items():
+            imetric.increment(metric, count, ["tag_key:%s" % key])
+
+    def reset(self) -> None:
+        """Drops all admitted values and counts.
+        """
+        with self._lock:
+            self._admitted = {}
+            self._window_start = {}
+            self._pending = {}
+            self.collapsed = {}
+            self.pending = 0
+
+
+class TagCache:
+    """The TagCache maps a combination of tag values to the tuple of tags, bounded by max_size.
+
+    Repeated combinations, e.g. the same tenant, region and event type, reuse the identical tag strings and tuple.
+    The tag strings are cached per (prefix, value) too, so combinations sharing a value, e.g. the same tenant with
+    other event types, share its tag string. Both caches are cleared if full, so they adapt to the current values.
+    The tags are not interned, as the values are arbitrary and interned strings may never be freed.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_TAG_CACHE_SIZE) -> None:
+        """Initializes the TagCache.
+
+        Args:
+            max_size (int, optional): the maximum of cached combinations, and of cached tag strings. Defaults to
+                DEFAULT_TAG_CACHE_SIZE.
+        """
+        self.max_size = max_size
+        self._combinations: Dict[Tuple[Optional[str], ...], Tuple[str, ...]] = {}  # pylint: disable=E1136
+        self._tags: Dict[Tuple[str, str], str] = {}  # pylint: disable=E1136
+
+    def get(self, values: Tuple[Optional[str], ...]) -> Optional[Tuple[str, ...]]:  # pylint: disable=E1136
+        """Returns the cached tags of the values, None if not cached.
+        """
+        return self._combinations.get(values)
+
+    def put(self,
+            values: Tuple[Optional[str], ...],  # pylint: disable=E1136
+            prefixes: Tuple[str, ...],  # pylint: disable=E1136
+            static_tags: Tuple[str, ...]) -> Tuple[str, ...]:  # pylint: disable=E1136
+        """Builds, caches and returns the tags of the values: `prefix + value` for each value found, then static tags.
+        """
+        tags = tuple(self.tag(prefix, value) for prefix, value in zip(prefixes, values) if value is not None)
+        tags += static_tags
+        if len(self._combinations) >= self.max_size:
+            self._combinations.clear()
+        self._combinations[values] = tags
+        return tags
+
+    def tag(self, prefix: str, value: str) -> str:
+        """Returns the cached tag string `prefix + value`, built on first use.
+        """
+        tag = self._tags.get((prefix, value))
+        if tag is None:
+            if len(self._tags) >= self.max_size:
+                self._tags.clear()
+            tag = self._tags[(prefix, value)] = prefix + value
+        return tag
+
+    def __len__(self) -> int:
+        return len(self._combinations)
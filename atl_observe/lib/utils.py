@@ -1,13 +1,21 @@
 """This module provides utils for the @observe operator, to keep the actual implementation maintainable and readable.
 """
+import inspect
 import logging
-from typing import Any, Dict, List, Optional, Union
+import sys
+import weakref
+from bisect import bisect_left
+from typing import (Any, Callable, Dict, List, NamedTuple, Optional, Tuple,
+                    Union)
 
 from datadog.dogstatsd.base import DogStatsd
 
-from atl_observe.lib.logger import Logger
-from atl_observe.lib.metrics import IMetric, Metric
-from atl_observe.lib.slack import MissingSlackWebhookException, Slack
+from atl_observe.lib.logger import get_default_logger
+from atl_observe.lib.metrics import IMetric, get_default_metric
+from atl_observe.lib.paths import compile_path, tag_field
+from atl_observe.lib.slack import (MissingSlackWebhookException, Slack,
+                                   get_default_slack)
+from atl_observe.lib.tags import CardinalityGuard, TagCache
 
 # mapping milliseconds to tag
 observe_threshold_map: Dict[int, str] = {
@@ -38,71 +46,214 @@ observe_threshold_map: Dict[int, str] = {
 }
 
 
+class SLIThresholds:
+    """The SLIThresholds compile a threshold map, milliseconds to tag, into sorted boundaries and interned tags.
+
+    A process time is tagged with the tag of the largest threshold below it, or the tag of the smallest threshold.
+    """
+
+    def __init__(self, threshold_map: Dict[Union[int, float], str]) -> None:  # pylint: disable=E1136
+        """Initializes and validates the SLIThresholds.
+
+        Args:
+            threshold_map (Dict[Union[int, float], str]): the thresholds in ms, mapped to the tag, see observe_threshold_map.
+
+        Raises:
+            ValueError: if the map is empty, a threshold is not a number or a tag is not a non-empty string.
+        """
+        if not isinstance(threshold_map, dict) or not threshold_map:
+            raise ValueError("sli thresholds must be a non-empty dictionary, got %r." % (threshold_map,))
+        for threshold, tag in threshold_map.items():
+            if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+                raise ValueError("sli threshold must be a number of ms, got %r." % (threshold,))
+            if not isinstance(tag, str) or not tag:
+                raise ValueError("sli tag must be a non-empty string, got %r." % (tag,))
+        self.boundaries: List[Union[int, float]] = sorted(threshold_map)  # pylint: disable=E1136
+        self.tags: Tuple[str, ...] = tuple(  # pylint: disable=E1136
+            sys.intern("observed_sli:%s" % threshold_map[threshold]) for threshold in self.boundaries)
+
+    def tag(self, process_time: float) -> str:
+        """Returns the `observed_sli:[tag]` for the process time (ms).
+        """
+        index = bisect_left(self.boundaries, process_time)
+        return self.tags[index - 1] if index else self.tags[0]
+
+
+# the compiled default thresholds
+observe_sli_thresholds = SLIThresholds(observe_threshold_map)
+
+
+def _no_tags(kwargs: Dict[str, Any], args: Tuple[Any, ...] = ()) -> List[str]:  # pylint: disable=E1136,W0613
+    """The resolver used when no 'tags_from' was provided.
+    """
+    return []
+
+
+def _no_trace_id(kwargs: Dict[str, Any], args: Tuple[Any, ...] = ()) -> str:  # pylint: disable=E1136,W0613
+    """The resolver used when no 'trace_id_from' was provided.
+    """
+    return ""
+
+
+class Clients(NamedTuple):
+    """The clients an owner (args[0], e.g. the instance of a decorated method) provides, None if not provided.
+    """
+    metric: Union[IMetric, DogStatsd, None]  # pylint: disable=E1136
+    logger: Optional[logging.Logger]  # pylint: disable=E1136
+    slack: Optional[Slack]  # pylint: disable=E1136
+
+
 class Provider:
     """The Provider defines methods to find a client or default to one.
+
+    For decorated methods (owner=True) the clients provided by the owner, the instance args[0], are cached by the
+    identity of the owner until it is released, so the lookup is done once per instance. If an owner replaces its
+    clients, e.g. `self.metric = ...`, call Provider.invalidate(owner) to drop the cached clients.
     """
+    _clients: Dict[int, Clients] = {}  # pylint: disable=E1136
+    _finalizers: Dict[int, weakref.finalize] = {}  # pylint: disable=E1136
+
+    @staticmethod
+    def invalidate(owner: Any = None) -> None:
+        """Drops the cached clients of the owner, or of all owners if no owner was provided.
+        """
+        if owner is None:
+            Provider._clients.clear()
+            return
+        Provider._clients.pop(id(owner), None)
+
+    @staticmethod
+    def _release(key: int) -> None:
+        Provider._clients.pop(key, None)
+        Provider._finalizers.pop(key, None)
+
+    @staticmethod
+    def _owner_clients(args: Tuple[Any, ...], owner: bool) -> Optional[Clients]:  # pylint: disable=E1136
+        """Returns the (cached) clients of the owner args[0], None if not a method or the owner can't be cached.
+        """
+        if not owner or not args:
+            return None
+        instance = args[0]
+        key = id(instance)
+        clients = Provider._clients.get(key)
+        if clients is not None:
+            return clients
+
+        if key not in Provider._finalizers:
+            try:
+                Provider._finalizers[key] = weakref.finalize(instance, Provider._release, key)
+            except TypeError:
+                # not weak referenceable, e.g. __slots__ without __weakref__
+                return None
+        clients = Provider._clients[key] = Clients(metric=Provider._find_metric(instance),
+                                                   logger=Provider._find_logger(instance),
+                                                   slack=Provider._find_slack(instance))
+        return clients
+
+    @staticmethod
+    def _find_logger(arg: Any) -> Optional[logging.Logger]:  # pylint: disable=E1136
+        if isinstance(arg, logging.Logger):
+            return arg
+        if hasattr(arg, "logger") and isinstance(arg.logger, logging.Logger):
+            return arg.logger
+        return None
+
+    @staticmethod
+    def _find_slack(arg: Any) -> Optional[Slack]:  # pylint: disable=E1136
+        if isinstance(arg, Slack):
+            return arg
+        if hasattr(arg, "slack") and isinstance(arg.slack, Slack):
+            return arg.slack
+        return None
+
+    @staticmethod
+    def _find_metric(arg: Any) -> Union[IMetric, DogStatsd, None]:  # pylint: disable=E1136
+        if isinstance(arg, (IMetric, DogStatsd)):
+            return arg
+        if hasattr(arg, "metric") and isinstance(arg.metric, IMetric):
+            return arg.metric
+        if hasattr(arg, "statsd") and isinstance(arg.statsd, DogStatsd):
+            return arg.statsd
+        return None
+
     @staticmethod
-    def get_logger(*args: Any) -> logging.Logger:
-        """Searches the parameter list *args for an instance of logging.Logger.
+    def get_logger(*args: Any, owner: bool = False) -> logging.Logger:
+        """Searches the parameter list *args for an instance of logging.Logger, else the default logger.
+
+        Args:
+            owner (bool, optional): whether args[0] is the instance of a method, its clients are cached.
 
         Returns:
             logging.Logger
         """
+        clients = Provider._owner_clients(args, owner)
+        if clients is not None:
+            if clients.logger is not None:
+                return clients.logger
+            args = args[1:]
+
         for arg in args:
-            if isinstance(arg, logging.Logger):
-                return arg
-            if hasattr(arg, "logger") and isinstance(arg.logger, logging.Logger):
-                return arg.logger
+            logger = Provider._find_logger(arg)
+            if logger is not None:
+                return logger
 
-        return Logger(name="Observe")
+        return get_default_logger()
 
     @staticmethod
-    def get_slack(*args: Any) -> Union[Slack, None]:  # pylint: disable=E1136
-        """Searches the parameter list *args for an instance of Slack.
+    def get_slack(*args: Any, owner: bool = False) -> Union[Slack, None]:  # pylint: disable=E1136
+        """Searches the parameter list *args for an instance of Slack, else the process-wide default, see SLACK_WEB_HOOK.
+
+        Args:
+            owner (bool, optional): whether args[0] is the instance of a method, its clients are cached.
 
         Returns:
             Slack
         """
+        clients = Provider._owner_clients(args, owner)
+        if clients is not None:
+            if clients.slack is not None:
+                return clients.slack
+            args = args[1:]
+
         for arg in args:
-            if isinstance(arg, Slack):
-                return arg
-            if hasattr(arg, "slack") and isinstance(arg.slack, Slack):
-                return arg.slack
+            slack = Provider._find_slack(arg)
+            if slack is not None:
+                return slack
         try:
-            return Slack()
+            return get_default_slack()
         except MissingSlackWebhookException:
             Provider.get_logger().debug(
                 "@observe: can't send notification to slack, add 'SLACK_WEB_HOOK' to os.environ to activate.")
+        return None
 
     @staticmethod
-    def get_metric(*args: Any) -> Union[IMetric, DogStatsd]:  # pylint: disable=E1136
-        """Searches the parameter list *args for an instance of IMetric or DogStatsd
+    def get_metric(*args: Any, owner: bool = False) -> Union[IMetric, DogStatsd]:  # pylint: disable=E1136
+        """Searches the parameter list *args for an instance of IMetric or DogStatsd, else the process-wide default.
+
+        Args:
+            owner (bool, optional): whether args[0] is the instance of a method, its clients are cached.
 
         Returns:
             IMetric | DogStatsd
         """
+        clients = Provider._owner_clients(args, owner)
+        if clients is not None:
+            if clients.metric is not None:
+                return clients.metric
+            args = args[1:]
+
         for arg in args:
-            if isinstance(arg, (IMetric, DogStatsd)):
-                return arg
-            if hasattr(arg, "metric") and isinstance(arg.metric, IMetric):
-                return arg.metric
-            if hasattr(arg, "statsd") and isinstance(arg.statsd, DogStatsd):
-                return arg.statsd
+            metric = Provider._find_metric(arg)
+            if metric is not None:
+                return metric
 
-        return Metric()
+        return get_default_metric()
 
 
 class Resolver:
     """The Resolver provides methods used to process parameter passed to the @observe decorater.
     """
 
-    @staticmethod
-    def _get_str_value(key: str, message: Dict[str, Any]) -> Union[str, None]:  # pylint: disable=E1136
-        value = message.get(str(key))
-        if isinstance(value, str):
-            return value
-        return None
-
     @staticmethod
     def resolve_identity(*args: Any, func: Any, trace_id: Optional[str] = "") -> str:  # pylint: disable=E1136
 
@@ -128,6 +279,39 @@ class Resolver:
 
         return identity
 
+    @staticmethod
+    def is_method(func: Callable[..., Any]) -> bool:
+        """Returns whether the first parameter of the function is `self` or `cls`, i.e. args[0] is its owner.
+        """
+        try:
+            parameters = iter(inspect.signature(func).parameters)
+        except (TypeError, ValueError):
+            return False
+        return next(parameters, None) in ("self", "cls")
+
+    @staticmethod
+    def positions(func: Callable[..., Any]) -> Dict[str, int]:  # pylint: disable=E1136
+        """Returns the positional index of each parameter of the function, which may be passed positionally.
+
+        Note: inspects the signature once, e.g. at decoration, so the resolvers find `process(message)` by index.
+
+        Args:
+            func (Callable[..., Any]): the decorated function, including `self` for methods.
+
+        Returns:
+            Dict[str, int]: the index in args by parameter name, empty if the signature is not available.
+        """
+        try:
+            parameters = inspect.signature(func).parameters.values()
+        except (TypeError, ValueError):
+            return {}
+        positions: Dict[str, int] = {}  # pylint: disable=E1136
+        for index, parameter in enumerate(parameters):
+            if parameter.kind not in (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD):
+                break
+            positions[parameter.name] = index
+        return positions
+
     @staticmethod
     def resolve_tags_from(tags_from: Optional[Dict[str, List[str]]], **kwargs: Any) -> List[str]:  # pylint: disable=E1136
         """This methods helps to identify and create tags from **kwargs dictionaries based on 'tags_from' setup.
@@ -138,69 +322,122 @@ class Resolver:
         Returns:
             List[str]: a list of tags if found any, else empty list
         """
-        # initialize default empty list
-        tags: List[str] = []
-
-        # ff15, we don't need to find additional tags
-        if not tags_from:
-            # return empty list
-            return tags
+        return Resolver.compile_tags_from(tags_from=tags_from)(kwargs)
 
-        # iterate the tags from dictionary
-        for lookup_key, tags_keys in tags_from.items():
+    @staticmethod
+    def resolve_trace_id(trace_id_from: Optional[Dict[str, str]], **kwargs: Any) -> str:  # pylint: disable=E1136
+        """This method attempts to get a trace_id from **kwargs dictionaries based on 'trace_id_from' setup.
 
-            # ensure we work with types, we expected to get
-            if not isinstance(tags_keys, list):
-                continue
+        Args:
+            trace_id_from (Optional[Dict[str, str]]): contains the keyword and the field to be used.
 
-            # try to get the message from kwargs
-            message = kwargs.get(str(lookup_key))
+        Returns:
+            str: the trace_id if found, else empty string
+        """
+        return Resolver.compile_trace_id(trace_id_from=trace_id_from)(kwargs)
 
-            # ensure the message was available, and is a dictionary
-            if not isinstance(message, dict):
-                continue
+    @staticmethod
+    def compile_tags_from(
+            tags_from: Optional[Dict[str, List[str]]],  # pylint: disable=E1136
+            guard: Optional[CardinalityGuard] = None,  # pylint: disable=E1136
+            static_tags: Tuple[str, ...] = (),  # pylint: disable=E1136
+            cache: Optional[TagCache] = None,  # pylint: disable=E1136
+            positions: Optional[Dict[str, int]] = None) -> Callable[..., List[str]]:  # pylint: disable=E1136
+        """Compiles the 'tags_from' setup once into a resolver, which creates the tags from kwargs (and args).
 
-            # iterate all tags we supposed to find
-            for tag_key in tags_keys:
+        Args:
+            tags_from (Optional[Dict[str, List[str]]]): this is the actual `tags_from` argument from @observe decoration.
+            guard (Optional[CardinalityGuard], optional): bounds the distinct values per tag key. Defaults to None.
+            static_tags (Tuple[str, ...], optional): the tags appended after the resolved tags. Defaults to ().
+            cache (Optional[TagCache], optional): caches the tags per value combination. Defaults to a new TagCache.
+            positions (Optional[Dict[str, int]], optional): the positional index per parameter, see
+                Resolver.positions, to resolve from args if not in kwargs. Defaults to kwargs only.
 
-                # check if the tag was in the message
-                tag_value = Resolver._get_str_value(key=tag_key, message=message)
+        Returns:
+            Callable[..., List[str]]: called with (kwargs, args=()), returns a new list of tags on each call.
+        """
+        positions = positions or {}
+        # pre-build (lookup_key, position, (field, ...)) and the tag prefixes, skipping everything which can never resolve
+        lookups: List[Tuple[str, int, Tuple[Tuple[str, Callable[[Any], Any]], ...], Tuple[None, ...]]] = []  # pylint: disable=E1136
+        prefixes: List[str] = []  # pylint: disable=E1136
+        for lookup_key, tags_keys in (tags_from or {}).items():
+            # ensure we work with types, we expected to get
+            if not isinstance(tags_keys, list) or not tags_keys:
+                continue
+            fields = tuple((name, compile_path(path)) for name, path in (tag_field(str(tag_key)) for tag_key in tags_keys))
+            lookups.append((str(lookup_key), positions.get(str(lookup_key), -1), fields, (None,) * len(fields)))
+            prefixes.extend("%s:" % field for field, _ in fields)
 
-                # ensure we did get a value and the value is a string
-                if not tag_value:
+        # ff15, we don't need to find additional tags
+        if not lookups:
+            if not static_tags:
+                return _no_tags
+            return lambda kwargs, args=(): list(static_tags)
+
+        tag_prefixes = tuple(prefixes)
+        tag_cache = cache if cache is not None else TagCache()
+        admit = guard.admit if guard is not None else None
+
+        def resolve(kwargs: Dict[str, Any], args: Tuple[Any, ...] = ()) -> List[str]:  # pylint: disable=E1136
+            values: List[Optional[str]] = []  # pylint: disable=E1136
+            for lookup_key, position, fields, missing in lookups:
+                # ensure the message was available, passed by keyword or positionally
+                message = kwargs.get(lookup_key)
+                if message is None and len(args) > position >= 0:
+                    message = args[position]
+                if message is None:
+                    values.extend(missing)
                     continue
-
-                # create the tag and append
-                tags.append("%s:%s" % (tag_key, tag_value))
-
-        return tags
+                for field, get in fields:
+                    # ensure we did get a value and the value is a string
+                    tag_value = get(message)
+                    if tag_value and isinstance(tag_value, str):
+                        values.append(tag_value if admit is None else admit(field, tag_value))
+                    else:
+                        values.append(None)
+
+            # reuse the tags of known value combinations
+            combination = tuple(values)
+            tags = tag_cache.get(combination)
+            if tags is None:
+                tags = tag_cache.put(combination, tag_prefixes, static_tags)
+            return list(tags)
+
+        return resolve
 
     @staticmethod
-    def resolve_trace_id(trace_id_from: Optional[Dict[str, str]], **kwargs: Any) -> str:  # pylint: disable=E1136
-        """This method attempts to get a trace_id from **kwargs dictionaries based on 'trace_id_from' setup.
+    def compile_trace_id(
+            trace_id_from: Optional[Dict[str, str]],  # pylint: disable=E1136
+            positions: Optional[Dict[str, int]] = None) -> Callable[..., str]:  # pylint: disable=E1136
+        """Compiles the 'trace_id_from' setup once into a resolver, which finds the trace_id in kwargs (and args).
 
         Args:
             trace_id_from (Optional[Dict[str, str]]): contains the keyword and the field to be used.
+            positions (Optional[Dict[str, int]], optional): the positional index per parameter, see
+                Resolver.positions, to resolve from args if not in kwargs. Defaults to kwargs only.
 
         Returns:
-            str: [description]
+            Callable[..., str]: called with (kwargs, args=()), returns the first trace_id found, else empty string.
         """
-        trace_id = ""
-
-        if not isinstance(trace_id_from, dict):
-            return trace_id
-
-        for key, value in trace_id_from.items():
-            try:
-                # try to get the message from kwargs
-                message = kwargs.get(str(key))
-                trace_id = Resolver._get_str_value(key=value, message=message)
-                if trace_id:
-                    return trace_id
-            except Exception:
-                pass
-
-        return trace_id
+        if not isinstance(trace_id_from, dict) or not trace_id_from:
+            return _no_trace_id
+
+        positions = positions or {}
+        lookups = tuple((str(key), positions.get(str(key), -1), compile_path(str(value)))
+                        for key, value in trace_id_from.items())
+
+        def resolve(kwargs: Dict[str, Any], args: Tuple[Any, ...] = ()) -> str:  # pylint: disable=E1136
+            for lookup_key, position, get in lookups:
+                message = kwargs.get(lookup_key)
+                if message is None and len(args) > position >= 0:
+                    message = args[position]
+                if message is not None:
+                    trace_id = get(message)
+                    if trace_id and isinstance(trace_id, str):
+                        return trace_id
+            return ""
+
+        return resolve
 
     @staticmethod
     def resolve_observed_sli_tag(process_time: int, threshold_map: Dict[int, str] = observe_threshold_map) -> str:  # pylint: disable=E1136
@@ -213,15 +450,6 @@ class Resolver:
         Returns:
             str: `observed_sli:[tag]`
         """
-        # set the current value to fastest threshold
-        current_value = threshold_map[0]
-        # iterate the hash map
-        for key, value in threshold_map.items():
-            # if the processing time is smaller or equal to the value in the hashmap
-            if process_time <= key:
-                # return the current value
-                return "observed_sli:%s" % current_value
-            # update the current value
-            current_value = value
-        # return the last updated current value (slowest threshold)
-        return "observed_sli:%s" % current_value
+        if threshold_map is observe_threshold_map:
+            return observe_sli_thresholds.tag(process_time)
+        return SLIThresholds(threshold_map).tag(process_time)
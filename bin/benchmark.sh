@@ -0,0 +1,9 @@
+#!/usr/bin/env bash
+
+if [[ ! -d .ve ]]; then
+  python -m venv .ve --prompt="(observe)"
+fi
+
+source .ve/bin/activate
+
+python test/benchmark/benchmark.py "$@"
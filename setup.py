@@ -20,4 +20,7 @@ setup(
     url="https://github.com/atlassian-labs/observe",
     version=read('version'),
     install_requires=readlines('requirements/observe.in'),
+    entry_points={
+        "console_scripts": ["atl_observe=atl_observe.cli:main"],
+    },
 )
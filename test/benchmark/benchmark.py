@@ -0,0 +1,238 @@
+"""Measures the overhead of @observe per call, against the bare call, for each outcome path.
+
+Each scenario is run with and without `tags_from`/`trace_id_from`, single-threaded and under thread contention,
+reporting into an in-memory MemoryMetric. Reported per call:
+    * ns/call: the best wall time of the repeats, divided by the calls (all threads).
+    * overhead: ns/call minus the ns/call of the bare function of the same path.
+    * B/call: the peak memory allocated during a call, traced with tracemalloc.
+    * ratio: ns/call divided by the ns/call of the bare function of the same path.
+
+Usage:
+    make benchmark                                      # compares to the stored baseline
+    python test/benchmark/benchmark.py --save           # stores a new baseline
+    python test/benchmark/benchmark.py --check          # exits 1 if a scenario regressed beyond the tolerance
+
+Note: the baseline stores the ratios and B/call only, the absolute timings depend on the machine. A scenario regressed
+if its ratio grew beyond the tolerance. Notifications of the raised path are built, never posted, see SilentSlack.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from atl_observe import observe  # noqa: E402
+from atl_observe.lib.metrics import MemoryMetric  # noqa: E402
+from atl_observe.lib.slack import Slack  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+MESSAGE = {"eventId": "abcd", "type": "my_type", "schema": "my_schema"}
+TAGS_FROM = {"message": ["type", "schema"]}
+TRACE_ID_FROM = {"message": "eventId"}
+
+PATHS = ("finished", "accepted", "declined", "raised")
+
+
+class Accept(Exception):
+    pass
+
+
+class Decline(Exception):
+    pass
+
+
+class Raise(Exception):
+    pass
+
+
+def _body(path: str) -> Callable[..., Any]:
+    """Returns the bare function of the path, taking (self, message).
+    """
+    if path == "finished":
+        def finished(self: Any, message: Dict[str, Any]) -> Any:  # pylint: disable=E1136
+            return message
+        return finished
+    ex = {"accepted": Accept, "declined": Decline, "raised": Raise}[path]
+
+    def failing(self: Any, message: Dict[str, Any]) -> Any:  # pylint: disable=E1136
+        raise ex()
+    return failing
+
+
+class SilentSlack(Slack):
+    """A Slack client which builds the notification but never posts it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(web_hook="https://hooks.slack.com/services/benchmark")
+
+    def _post(self, payload: Dict[str, Any]) -> None:  # pylint: disable=E1136
+        return None
+
+
+class Engine:
+    """The owner of the benchmarked functions, providing the in-memory metric, a silent slack and logger.
+    """
+
+    def __init__(self) -> None:
+        self.metric = MemoryMetric(max_records=1000)
+        self.slack = SilentSlack()
+        self.logger = logging.getLogger("benchmark")
+        self.logger.handlers = [logging.NullHandler()]
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+
+def scenarios() -> List[Tuple[str, str, Callable[..., Any]]]:  # pylint: disable=E1136
+    """Returns (name, bare path, function) of each scenario.
+    """
+    result = []
+    for path in PATHS:
+        result.append(("bare.%s" % path, path, _body(path)))
+        for resolved in (False, True):
+            decorated = observe(metric="benchmark",
+                                accept_on=[Accept],
+                                decline_on=[Decline],
+                                tags_from=TAGS_FROM if resolved else None,
+                                trace_id_from=TRACE_ID_FROM if resolved else None)(_body(path))
+            result.append(("observe.%s%s" % (path, ".resolved" if resolved else ""), path, decorated))
+    return result
+
+
+def _loop(func: Callable[..., Any], engine: Engine, calls: int) -> None:
+    for _ in range(calls):
+        try:
+            func(engine, message=MESSAGE)
+        except Exception:  # pylint: disable=W0703
+            pass
+
+
+def measure_time(func: Callable[..., Any], calls: int, repeats: int, threads: int) -> float:
+    """Returns the best ns/call of the repeats, over all threads.
+    """
+    engine = Engine()
+    _loop(func, engine, min(calls, 1000))
+    best = float("inf")
+    for _ in range(repeats):
+        workers = [threading.Thread(target=_loop, args=(func, engine, calls)) for _ in range(threads)]
+        start = time.perf_counter_ns()
+        if threads == 1:
+            _loop(func, engine, calls)
+        else:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        best = min(best, (time.perf_counter_ns() - start) / (calls * threads))
+        engine.metric.clear()
+    return best
+
+
+def measure_memory(func: Callable[..., Any], calls: int) -> float:
+    """Returns the mean peak of the memory allocated per call, in bytes.
+    """
+    engine = Engine()
+    _loop(func, engine, 100)
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            _loop(func, engine, 1)
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / calls
+
+
+def run(calls: int, repeats: int, threads: int) -> Dict[str, Dict[str, float]]:  # pylint: disable=E1136
+    """Runs all scenarios, single-threaded and with the threads.
+    """
+    results: Dict[str, Dict[str, float]] = {}  # pylint: disable=E1136
+    for thread_count in sorted({1, threads}):
+        suffix = "" if thread_count == 1 else ".threads%d" % thread_count
+        for name, path, func in scenarios():
+            results[name + suffix] = {
+                "ns_per_call": round(measure_time(func, calls // thread_count, repeats, thread_count), 1),
+                "bytes_per_call": round(measure_memory(func, 200), 1),
+            }
+        for name, path, _ in scenarios():
+            bare = results["bare.%s%s" % (path, suffix)]["ns_per_call"]
+            results[name + suffix]["overhead_ns"] = round(results[name + suffix]["ns_per_call"] - bare, 1)
+            results[name + suffix]["ratio"] = round(results[name + suffix]["ns_per_call"] / bare, 3)
+    return results
+
+
+def report(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> None:  # pylint: disable=E1136
+    """Prints the results, compared to the baseline if available.
+    """
+    print("%-36s %12s %12s %8s %10s %10s" % ("scenario", "ns/call", "overhead", "ratio", "B/call", "baseline"))
+    for name, result in results.items():
+        compared = ""
+        if name in baseline:
+            compared = "%+.1f%%" % ((result["ratio"] / baseline[name]["ratio"] - 1) * 100)
+        print("%-36s %12.1f %12.1f %8.2f %10.1f %10s" % (
+            name, result["ns_per_call"], result["overhead_ns"], result["ratio"], result["bytes_per_call"], compared))
+
+
+def regressions(results: Dict[str, Dict[str, float]],  # pylint: disable=E1136
+                baseline: Dict[str, Dict[str, float]],  # pylint: disable=E1136
+                tolerance: float) -> List[str]:  # pylint: disable=E1136
+    """Returns the decorated scenarios, whose ratio to the bare call grew beyond the tolerance.
+    """
+    regressed = []
+    for name, result in results.items():
+        if not name.startswith("observe.") or name not in baseline:
+            continue
+        if result["ratio"] > baseline[name]["ratio"] * (1 + tolerance):
+            regressed.append(name)
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measures the overhead of @observe per call.")
+    parser.add_argument("--calls", type=int, default=5000, help="the calls per repeat")
+    parser.add_argument("--repeats", type=int, default=3, help="the repeats, the best is reported")
+    parser.add_argument("--threads", type=int, default=4, help="the threads of the contention scenarios")
+    parser.add_argument("--baseline", default=BASELINE, help="the baseline file")
+    parser.add_argument("--save", action="store_true", help="stores the results as baseline")
+    parser.add_argument("--check", action="store_true", help="exits 1 on a regression beyond the tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="the tolerated slowdown, 0.25 is 25%%")
+    options = parser.parse_args()
+
+    baseline: Dict[str, Dict[str, float]] = {}  # pylint: disable=E1136
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as baseline_file:
+            # a baseline of absolute timings, stored before the ratios, is not comparable
+            baseline = {name: result for name, result in json.load(baseline_file)["results"].items() if "ratio" in result}
+
+    results = run(options.calls, options.repeats, options.threads)
+    report(results, baseline)
+
+    if options.save:
+        with open(options.baseline, "w") as baseline_file:
+            stored = {name: {"ratio": result["ratio"], "bytes_per_call": result["bytes_per_call"]}
+                      for name, result in results.items()}
+            json.dump({"python": platform.python_version(), "results": stored}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print("baseline stored in %s" % options.baseline)
+
+    if options.check:
+        regressed = regressions(results, baseline, options.tolerance)
+        if regressed:
+            print("regressed beyond %.0f%%: %s" % (options.tolerance * 100, ", ".join(regressed)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
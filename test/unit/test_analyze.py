@@ -0,0 +1,179 @@
+"""Defines tests for analyze.Analysis and the atl_observe command
+"""
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest import TestCase
+
+from atl_observe import observe
+from atl_observe.cli import main
+from atl_observe.lib.analyze import Analysis, analyze, iter_lines, parse_time
+from atl_observe.lib.spool import Spool, SpoolMetric
+
+
+class Declined(Exception):
+    pass
+
+
+class TestAnalysis(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def spool(self, records, name="observe-1.ndjson"):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as spool_file:
+            for record in records:
+                spool_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        return path
+
+    def timing(self, metric, value, tags, ts=1000.0):
+        return {"ts": ts, "kind": "timing", "metric": metric, "value": value, "tags": tags}
+
+    def test_parse_time(self):
+        # act, assert
+        self.assertEqual(parse_time("1700000000.5"), 1700000000.5)
+        self.assertEqual(parse_time("2026-10-18T10:00:00+00:00"), 1792317600.0)
+        self.assertEqual(parse_time("10:15"), datetime.now().replace(hour=10, minute=15, second=0,
+                                                                     microsecond=0).timestamp())
+        self.assertRaises(ValueError, parse_time, "noon")
+
+    def test_iter_lines(self):
+        # arrange
+        path = self.spool([{"index": 0}, {"index": 1}])
+        empty = self.spool([], name="observe-2.ndjson")
+        # act, assert
+        self.assertEqual(list(iter_lines(path)), [b'{"index":0}\n', b'{"index":1}\n'])
+        self.assertEqual(list(iter_lines(empty)), [])
+
+    def test_groups_by_metric_and_tags(self):
+        # arrange
+        path = self.spool([
+            self.timing("process.time.finished", 10, ["tenant:a", "observed_sli:100ms"]),
+            self.timing("process.time.finished", 30, ["tenant:a", "observed_sli:100ms"]),
+            self.timing("process.time.raised", 300, ["tenant:a", "exception:ValueError", "observed_sli:500ms"]),
+            self.timing("process.time.finished", 5, ["tenant:b", "observed_sli:100ms"]),
+            self.timing("process.self_time.finished", 5, ["tenant:b"]),
+            {"ts": 1000.0, "kind": "increment", "metric": "process.start", "value": 1, "tags": ["tenant:a"]},
+        ])
+        analysis = Analysis(by=["tenant"])
+        # act
+        rows = analysis.add_file(path).rows()
+        # assert
+        self.assertEqual([(row["metric"], row["tags"], row["count"]) for row in rows], [
+            ("process", ["tenant:a"], 3), ("process", ["tenant:b"], 1)])
+        tenant_a = rows[0]
+        self.assertEqual((tenant_a["finished"], tenant_a["raised"]), (2, 1))
+        self.assertAlmostEqual(tenant_a["raised_ratio"], 1 / 3)
+        self.assertAlmostEqual(tenant_a["max"], 300)
+        self.assertAlmostEqual(tenant_a["p50"], 30, delta=0.3)
+        self.assertEqual(tenant_a["sli"], {"100ms": 2 / 3, "500ms": 1 / 3})
+
+    def test_weights_sampled_calls(self):
+        # arrange, 1000 calls sampled at 0.1, 10 raised calls always reported, all reported calls spool both records
+        records = []
+        for index in range(100):
+            tags = ["tenant:a", "observed_sli:100ms"]
+            records.append(self.timing("process.time.finished", 10 + index % 10, tags))
+            records.append({"ts": 1000.0, "kind": "increment", "metric": "process.finished", "value": 10.0, "tags": tags})
+        for index in range(10):
+            tags = ["tenant:a", "exception:ValueError", "observed_sli:1s"]
+            records.append(self.timing("process.time.raised", 900, tags))
+            records.append({"ts": 1000.0, "kind": "increment", "metric": "process.exception.raised", "value": 1,
+                            "tags": tags})
+        path = self.spool(records)
+        # act
+        row = Analysis(by=["tenant"]).add_file(path).rows()[0]
+        # assert
+        self.assertEqual((row["count"], row["finished"], row["raised"]), (1010, 1000, 10))
+        self.assertAlmostEqual(row["raised_ratio"], 10 / 1010)
+        self.assertEqual(row["sli"], {"100ms": 1000 / 1010, "1s": 10 / 1010})
+        self.assertLess(row["p99"], 900)
+
+    def test_filters(self):
+        # arrange
+        path = self.spool([
+            self.timing("process.time.finished", 10, ["type:a"], ts=900.0),
+            self.timing("process.time.finished", 20, ["type:a"], ts=1000.0),
+            self.timing("process.time.finished", 30, ["type:b"], ts=1000.0),
+            self.timing("other.time.finished", 40, ["type:a"], ts=1000.0),
+            self.timing("process.time.finished", 50, ["type:a"], ts=1100.0),
+        ])
+        analysis = Analysis(metric="process", tags=["type:a"], since=1000.0, until=1100.0)
+        # act
+        rows = analysis.add_file(path).rows()
+        # assert
+        self.assertEqual([(row["metric"], row["count"], row["max"]) for row in rows], [("process", 1, 20)])
+
+    def test_skips_malformed_lines(self):
+        # arrange
+        path = os.path.join(self.directory.name, "observe-1.ndjson")
+        with open(path, "w") as spool_file:
+            spool_file.write('{"ts":1,"kind":"timing","metric":"process.time.finished","value":1,"tags":[]}\n')
+            spool_file.write('{"ts":1,"kind":"timing","metr')
+        analysis = Analysis()
+        # act
+        analysis.add_file(path)
+        # assert
+        self.assertEqual(analysis.skipped, 1)
+        self.assertEqual(analysis.rows()[0]["count"], 1)
+
+    def test_parallel_equals_sequential(self):
+        # arrange
+        for index in range(4):
+            self.spool([self.timing("process.time.finished", value, ["tenant:%d" % (value % 2)])
+                        for value in range(index * 100, (index + 1) * 100)], name="observe-%d.ndjson" % index)
+        # act
+        sequential = analyze([self.directory.name], Analysis(by=["tenant"])).rows()
+        parallel = analyze([self.directory.name], Analysis(by=["tenant"]), jobs=2).rows()
+        # assert
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(sum(row["count"] for row in parallel), 400)
+
+
+class TestCommand(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.metric = SpoolMetric(Spool(self.directory.name, flush_interval=60))
+
+        @observe(metric="process", decline_on=[Declined], tags_from={"message": ["tenant"]})
+        def process(self, message):
+            if message.get("decline"):
+                raise Declined()
+            return True
+
+        for index in range(10):
+            process(self, message={"tenant": "a" if index % 2 else "b", "decline": index == 3})
+        self.metric.spool.close()
+
+    def run_main(self, *argv):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            code = main(list(argv))
+        return code, stdout.getvalue()
+
+    def test_analyze_table(self):
+        # act
+        code, output = self.run_main("analyze", self.directory.name, "--by", "tenant")
+        # assert
+        lines = output.splitlines()
+        self.assertEqual(code, 0)
+        self.assertEqual(lines[0].split()[:7], ["metric", "tags", "count", "finished", "accepted", "declined", "raised"])
+        self.assertEqual(lines[1].split()[:7], ["process", "tenant:a", "5", "80.0%", "0.0%", "20.0%", "0.0%"])
+        self.assertEqual(lines[2].split()[:4], ["process", "tenant:b", "5", "100.0%"])
+
+    def test_analyze_json(self):
+        # act
+        code, output = self.run_main("analyze", self.directory.name, "--json", "--tag", "tenant:a")
+        # assert
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(code, 0)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]["count"], rows[0]["declined"]), (5, 1))
+        self.assertEqual(list(rows[0]["sli"]), ["100ms"])
@@ -0,0 +1,265 @@
+"""Defines tests for the trace and span propagation of atl_observe.lib.context
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib import context
+from atl_observe.lib.clock import ManualClock
+from atl_observe.lib.metrics import IMetric
+
+
+class Inner:
+    def __init__(self, metric):
+        self.metric = metric
+        self.logger = Mock(spec=logging.Logger)
+
+    @observe(metric="inner", accept_on=[ValueError])
+    def process(self, item: str):
+        raise ValueError(item)
+
+    @observe(metric="inner")
+    def trace(self):
+        return context.current()
+
+
+class Outer:
+    def __init__(self, metric):
+        self.metric = metric
+        self.inner = Inner(metric)
+
+    @observe(metric="outer", trace_id_from={"message": "eventId"})
+    def process(self, message: dict):
+        return self.inner.process("item")
+
+    @observe(metric="outer", trace_id_from={"message": "eventId"})
+    def trace(self, message: dict):
+        return self.inner.trace()
+
+    @observe(metric="outer", trace_id_from={"message": "eventId"})
+    def in_thread(self, message: dict):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            plain = executor.submit(context.current_trace_id).result()
+            carried = context.submit(executor, context.current_trace_id).result()
+            wrapped = executor.submit(context.wrap(context.current_identity)).result()
+        return plain, carried, wrapped
+
+    @observe(metric="outer", trace_id_from={"message": "eventId"})
+    def in_pool(self, message: dict):
+        def current(_):
+            time.sleep(0.01)
+            return context.current_trace_id()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            return list(executor.map(context.wrap(current), range(16)))
+
+    @observe(metric="outer", trace_id_from={"message": "eventId"})
+    async def in_task(self, message: dict):
+        task = await asyncio.get_running_loop().create_task(self._current())
+        executor = await context.run_in_executor(None, context.current_trace_id)
+        return task, executor
+
+    async def _current(self):
+        return context.current_trace_id()
+
+
+class TestContext(TestCase):
+
+    def setUp(self):
+        self.metric = Mock(spec=IMetric)
+        self.metric.gauge = Mock()
+
+    def test_nested_call_inherits_trace(self):
+        # arrange
+        outer = Outer(self.metric)
+        # act
+        outer.process(message={"eventId": "abcd"})
+        trace = outer.trace(message={"eventId": "abcd"})
+        # assert
+        self.assertIn("Inner(abcd)", outer.inner.logger.log.call_args.args)
+        self.assertEqual(trace, context.TraceContext("abcd", "Outer(abcd)"))
+
+    def test_identity_resolved_lazily(self):
+        # arrange
+        resolve = Mock(return_value="Outer(abcd)")
+        trace = context.TraceContext("abcd", resolve=resolve, args=("self",))
+        # act, assert
+        resolve.assert_not_called()
+        self.assertEqual(trace.identity, "Outer(abcd)")
+        self.assertEqual(trace.identity, "Outer(abcd)")
+        resolve.assert_called_once_with("self", trace_id="abcd")
+
+    def test_identity_not_resolved_on_success(self):
+        # arrange
+        with patch("atl_observe.lib.plan.Resolver.resolve_identity") as resolve:
+            class Traced:
+                metric = self.metric
+
+                @observe(metric="traced", trace_id_from={"message": "eventId"})
+                def process(self, message: dict):
+                    return context.current_trace_id()
+
+            # act
+            trace_id = Traced().process(message={"eventId": "abcd"})
+        # assert
+        self.assertEqual(trace_id, "abcd")
+        resolve.assert_not_called()
+
+    def test_restored_after_call(self):
+        # act
+        Outer(self.metric).trace(message={"eventId": "abcd"})
+        # assert
+        self.assertIsNone(context.current())
+        self.assertEqual(context.current_trace_id(), "")
+        self.assertEqual(context.current_identity(), "")
+        self.assertIsNone(Inner(self.metric).trace())
+
+    def test_carried_into_threads(self):
+        # act
+        plain, carried, wrapped = Outer(self.metric).in_thread(message={"eventId": "abcd"})
+        # assert
+        self.assertEqual(plain, "")
+        self.assertEqual(carried, "abcd")
+        self.assertEqual(wrapped, "Outer(abcd)")
+
+    def test_wrapped_runs_concurrently(self):
+        # act
+        trace_ids = Outer(self.metric).in_pool(message={"eventId": "abcd"})
+        # assert
+        self.assertEqual(trace_ids, ["abcd"] * 16)
+
+    def test_carried_into_tasks_and_executor(self):
+        # act
+        task, executor = asyncio.run(Outer(self.metric).in_task(message={"eventId": "abcd"}))
+        # assert
+        self.assertEqual(task, "abcd")
+        self.assertEqual(executor, "abcd")
+
+
+class TestSpans(TestCase):
+
+    def setUp(self):
+        self.metric = Mock(spec=IMetric)
+        self.metric.gauge = Mock()
+        self.clock = ManualClock()
+
+    def timings(self):
+        return {call.args[0]: (call.args[1], call.args[2]) for call in self.metric.timing.call_args_list}
+
+    def test_self_time_excludes_nested_calls(self):
+        # arrange
+        clock = self.clock
+
+        @observe(metric="inner", clock=clock, self_time=True, parent_tag=True)
+        def inner():
+            clock.advance(milliseconds=3)
+
+        @observe(metric="outer", clock=clock, self_time=True, parent_tag=True)
+        def outer():
+            clock.advance(milliseconds=2)
+            inner()
+            clock.advance(milliseconds=1)
+        # act
+        with patch("atl_observe.lib.utils.get_default_metric", return_value=self.metric):
+            outer()
+        # assert
+        timings = self.timings()
+        self.assertEqual(timings["outer.time.finished"][0], 6.0)
+        self.assertEqual(timings["outer.self_time.finished"][0], 3.0)
+        self.assertEqual(timings["inner.time.finished"][0], 3.0)
+        self.assertEqual(timings["inner.self_time.finished"][0], 3.0)
+        self.assertIn("parent_metric:outer", timings["inner.time.finished"][1])
+        self.assertNotIn("parent_metric:outer", timings["outer.time.finished"][1])
+        self.assertIsNone(context.current_span())
+
+    def test_self_time_of_failed_call(self):
+        # arrange
+        clock = self.clock
+
+        @observe(metric="inner", clock=clock)
+        def inner():
+            clock.advance(milliseconds=4)
+
+        @observe(metric="outer", clock=clock, self_time=True, accept_on=[ValueError])
+        def outer():
+            inner()
+            clock.advance(milliseconds=1)
+            raise ValueError("accept")
+        # act
+        with patch("atl_observe.lib.utils.get_default_metric", return_value=self.metric), \
+                patch("atl_observe.lib.utils.get_default_logger"):
+            outer()
+        # assert
+        timings = self.timings()
+        self.assertEqual(timings["outer.time.accepted"][0], 5.0)
+        self.assertEqual(timings["outer.self_time.accepted"][0], 1.0)
+        self.assertNotIn("inner.self_time.finished", timings)
+
+    def test_async_generator_counts_to_enclosing_span(self):
+        # arrange
+        clock = self.clock
+
+        @observe(metric="inner", clock=clock)
+        async def inner():
+            clock.advance(milliseconds=2)
+
+        @observe(metric="stream", clock=clock, parent_tag=True)
+        async def stream():
+            await inner()
+            yield 1
+
+        @observe(metric="outer", clock=clock, self_time=True)
+        async def outer():
+            return [item async for item in stream()]
+        # act
+        with patch("atl_observe.lib.utils.get_default_metric", return_value=self.metric):
+            asyncio.run(outer())
+        # assert
+        timings = self.timings()
+        self.assertEqual(timings["outer.self_time.finished"][0], 0.0)
+        self.assertIn("parent_metric:outer", timings["stream.time.finished"][1])
+
+    def test_plain_call_opens_no_span(self):
+        # arrange
+        @observe(metric="plain")
+        def plain():
+            return context.current_span()
+
+        # act
+        with patch("atl_observe.lib.utils.get_default_metric", return_value=self.metric), \
+                patch("atl_observe.lib.context._tracking", False), \
+                patch("atl_observe.lib.context.enter", wraps=context.enter) as enter:
+            span = plain()
+        # assert
+        self.assertIsNone(span)
+        enter.assert_not_called()
+        self.metric.timing.assert_called_once()
+
+    def test_parent_tag_finds_plain_parent(self):
+        # arrange
+        @observe(metric="inner", parent_tag=True)
+        def inner():
+            pass
+
+        @observe(metric="outer")
+        def outer():
+            inner()
+        # act
+        with patch("atl_observe.lib.utils.get_default_metric", return_value=self.metric), \
+                patch("atl_observe.lib.context._tracking", False):
+            context.track()
+            outer()
+        # assert
+        self.assertIn("parent_metric:outer", self.timings()["inner.time.finished"][1])
+
+    def test_self_ns_never_negative(self):
+        # arrange
+        span = context.Span("outer", "parent_metric:outer")
+        span.child_ns = 10
+        # act, assert
+        self.assertEqual(span.self_ns(4), 0)
+        self.assertEqual(span.self_ns(14), 4)
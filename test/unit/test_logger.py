@@ -0,0 +1,95 @@
+"""Defines tests for the default logger of logger module
+"""
+import logging
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.logger import configure_default_logger, get_default_logger
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.utils import Provider
+
+
+class TestDefaultLogger(TestCase):
+    """Defines tests for get_default_logger and configure_default_logger.
+    """
+
+    def tearDown(self) -> None:
+        configure_default_logger()
+
+    def reset(self):
+        logger = logging.getLogger("Observe")
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+        logger.propagate = True
+        return logger
+
+    def test_cached(self):
+        # act
+        logger = get_default_logger()
+        # assert
+        self.assertIs(logger, logging.getLogger("Observe"))
+        self.assertIs(Provider.get_logger(None), logger)
+        self.assertIs(Provider.get_logger(), get_default_logger())
+        # the test runner may attach its own capture handlers
+        self.assertEqual(len([handler for handler in logger.handlers if type(handler) is logging.StreamHandler]), 1)
+
+    def test_level_from_environment(self):
+        # arrange
+        with patch.dict('os.environ', {'LOG_LEVEL': 'ERROR'}):
+            # act
+            logger = configure_default_logger()
+        # assert
+        self.assertEqual(logger.level, logging.ERROR)
+
+    def test_route_through_own_handlers(self):
+        # arrange
+        class Collect(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.records = []
+
+            def emit(self, record):
+                self.records.append(record)
+        handler = Collect()
+        # act
+        logger = configure_default_logger(level=logging.DEBUG, handlers=[handler])
+        Provider.get_logger().debug("routed")
+        # assert
+        self.assertEqual(logger.handlers, [handler])
+        self.assertEqual([record.getMessage() for record in handler.records], ["routed"])
+
+    def test_first_use_keeps_own_handlers(self):
+        # arrange, a handler attached by the application before the first failure
+        logger = self.reset()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+
+        class A:
+            @observe(metric="my_metric", accept_on=[ValueError])
+            def process(self):
+                raise ValueError("accepted")
+        # act
+        with patch("atl_observe.lib.logger._default_logger", None), \
+                patch("atl_observe.lib.utils.get_default_metric", return_value=Mock(spec=IMetric, gauge=Mock())):
+            A().process()
+        # assert
+        self.assertEqual(logger.handlers, [handler])
+        self.assertTrue(logger.propagate)
+        self.assertEqual(len(records), 1)
+        self.assertIn("during 'process' accepted", records[0].getMessage())
+
+    def test_first_use_configures_bare_logger(self):
+        # arrange
+        logger = self.reset()
+        # act
+        with patch("atl_observe.lib.logger._default_logger", None), patch.dict('os.environ', {'LOG_LEVEL': 'ERROR'}):
+            default = get_default_logger()
+        # assert
+        self.assertIs(default, logger)
+        self.assertEqual(logger.level, logging.ERROR)
+        self.assertEqual([type(handler) for handler in logger.handlers], [logging.StreamHandler])
@@ -1,11 +1,19 @@
 """Defines tests for metric.Metric class
 """
-from unittest import TestCase
+import os
+import threading
+import time
+from unittest import TestCase, skipIf
 
 from datadog import DogStatsd
-from mock import patch
+from mock import Mock, patch
 
-from atl_observe.lib.metrics import IMetric, Metric
+from atl_observe import observe
+from atl_observe.lib import metrics
+from atl_observe.lib.metrics import (AggregatedMetric, IMetric, MemoryMetric,
+                                     Metric, get_default_metric,
+                                     set_default_metric)
+from atl_observe.lib.utils import Provider
 
 
 class TestMetricInitialization(TestCase):
@@ -72,3 +80,196 @@ class TestMetricInitialization(TestCase):
         self.assertEqual(client.port, 1337)
         self.assertEqual(client.constant_tags, ["observe"])
         self.assertEqual(client.namespace, "observe")
+
+
+class TestDefaultMetric(TestCase):
+    """Defines tests for the process-wide default client.
+    """
+
+    def tearDown(self) -> None:
+        set_default_metric(None)
+
+    def test_lazily_created_once(self):
+        # arrange
+        set_default_metric(None)
+        # act
+        metric = get_default_metric()
+        # assert
+        self.assertIsInstance(metric, Metric)
+        self.assertIs(get_default_metric(), metric)
+        self.assertIs(Provider.get_metric(None, {}), metric)
+
+    def test_registered(self):
+        # arrange
+        registered = Metric(host="registered")
+        # act
+        set_default_metric(registered)
+        # assert
+        self.assertIs(get_default_metric(), registered)
+        self.assertIs(Provider.get_metric(), registered)
+
+    @skipIf(not hasattr(os, "fork"), reason="os.fork is not available.")
+    def test_dropped_in_forked_child(self):
+        # arrange
+        parent = get_default_metric()
+        read, write = os.pipe()
+        # act
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            os.close(read)
+            child_default = metrics._default_metric
+            os.write(write, b"1" if child_default is None and get_default_metric() is not parent else b"0")
+            os._exit(0)
+        os.close(write)
+        result = os.read(read, 1)
+        os.close(read)
+        os.waitpid(pid, 0)
+        # assert
+        self.assertEqual(result, b"1")
+        self.assertIs(get_default_metric(), parent)
+
+
+class TestAggregatedMetric(TestCase):
+    """Defines tests for the AggregatedMetric client.
+    """
+
+    def setUp(self) -> None:
+        self.client = Mock()
+        self.metric = AggregatedMetric(client=self.client, flush_interval=60.0)
+        self.addCleanup(self.metric.close)
+
+    def test_aggregates_until_flush(self):
+        # act
+        for value in (10, 20, 30):
+            self.metric.timing("my.time", value, ["a:1"])
+            self.metric.gauge("my.gauge", value, ["a:1"])
+            self.metric.increment("my.count", 1, ["a:1"])
+        self.metric.increment("my.count", 1, ["a:2"])
+        # assert, nothing sent yet
+        self.client.increment.assert_not_called()
+        # act
+        self.metric.flush()
+        # assert
+        self.assertEqual(sorted(c.args for c in self.client.increment.call_args_list),
+                         [("my.count", 1, ["a:2"]), ("my.count", 3, ["a:1"]), ("my.time.count", 3, ["a:1"])])
+        self.assertEqual(sorted(c.args for c in self.client.gauge.call_args_list),
+                         [("my.gauge", 30, ["a:1"]), ("my.time.avg", 20.0, ["a:1"]),
+                          ("my.time.max", 30, ["a:1"]), ("my.time.min", 10, ["a:1"])])
+
+    def test_flush_resets(self):
+        # arrange
+        self.metric.increment("my.count", 1)
+        self.metric.flush()
+        # act
+        self.metric.flush()
+        # assert
+        self.client.increment.assert_called_once_with("my.count", 1, [])
+
+    def test_close_flushes_and_joins(self):
+        # arrange
+        self.metric.increment("my.count", 1)
+        worker = self.metric._worker
+        # act
+        self.metric.close(timeout=5.0)
+        # assert, no thread started after close, the values are sent on flush
+        self.assertFalse(worker.is_alive())
+        self.client.increment.assert_called_once_with("my.count", 1, [])
+        self.metric.increment("my.count", 2)
+        self.assertIs(self.metric._worker, worker)
+        self.metric.flush()
+        self.client.increment.assert_called_with("my.count", 2, [])
+
+    def test_ignores_sample_rate(self):
+        # act
+        self.metric.increment("my.count", 1, sample_rate=0.5)
+        self.metric.increment("my.count", 1, sample_rate=0.5)
+        self.metric.flush()
+        # assert, every value aggregated exactly
+        self.client.increment.assert_called_once_with("my.count", 2, [])
+
+    def test_flushes_early_on_max_contexts(self):
+        # arrange
+        metric = AggregatedMetric(client=self.client, flush_interval=60.0, max_contexts=2)
+        self.addCleanup(metric.close)
+        # act
+        metric.increment("my.count", 1, ["a:1"])
+        metric.increment("my.count", 1, ["a:2"])
+        for _ in range(100):
+            if self.client.increment.call_count == 2:
+                break
+            time.sleep(0.01)
+        # assert
+        self.assertEqual(self.client.increment.call_count, 2)
+
+    def test_thread_safe(self):
+        # arrange
+        def work():
+            for _ in range(1000):
+                self.metric.increment("my.count", 1, ["a:1"])
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        # act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.metric.flush()
+        # assert
+        self.client.increment.assert_called_once_with("my.count", 8000, ["a:1"])
+
+    def test_observe_with_aggregated_metric(self):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric")
+            def process(self):
+                pass
+        a = A(self.metric)
+        # act
+        for _ in range(10):
+            a.process()
+        self.metric.flush()
+        # assert
+        counts = {c.args[0]: c.args[1] for c in self.client.increment.call_args_list}
+        self.assertEqual(counts["my_metric.start"], 10)
+        self.assertEqual(counts["my_metric.finished"], 10)
+        self.assertEqual(counts["my_metric.time.finished.count"], 10)
+
+
+class TestMemoryMetric(TestCase):
+    """Defines tests for the MemoryMetric, the in-memory sink used in tests and benchmarks.
+    """
+
+    def test_records_observe(self):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = MemoryMetric()
+
+            @observe(metric="my_metric")
+            def process(self):
+                pass
+        a = A()
+        # act
+        a.process()
+        # assert
+        self.assertEqual([(kind, metric) for kind, metric, _, _ in a.metric.records], [
+            ("timing", "my_metric.time.finished"),
+            ("gauge", "my_metric.time_gauge.finished"),
+            ("increment", "my_metric.finished"),
+            ("increment", "my_metric.start"),
+        ])
+        self.assertEqual(a.metric.count, 4)
+
+    def test_bounded_and_cleared(self):
+        # arrange
+        metric = MemoryMetric(max_records=2)
+        # act
+        for value in range(3):
+            metric.increment("my_metric", value)
+        # assert
+        self.assertEqual([record[2] for record in metric.records], [1, 2])
+        self.assertEqual(metric.count, 3)
+        metric.clear()
+        self.assertEqual((len(metric.records), metric.count), (0, 0))
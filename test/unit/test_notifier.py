@@ -0,0 +1,77 @@
+"""Defines tests for the notifier of coroutines and async generators.
+"""
+import asyncio
+import threading
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import Slack, observe
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.notifier import Notifier, notifier
+
+
+class TestNotifier(TestCase):
+    """Defines tests for the Notifier.
+    """
+
+    def test_resolved_before_hand_off(self):
+        # arrange
+        threads = []
+        slack = Mock(spec=Slack)
+        slack.error.side_effect = lambda **kwargs: threads.append(threading.current_thread().name)
+
+        class Engine:
+            def __init__(self):
+                self.identity = "engine"
+                self.metric = Mock(spec=IMetric)
+                self.slack = slack
+
+            @observe(metric="process", trace_id_from={"message": "eventId"})
+            async def process(self, message: dict) -> None:
+                await asyncio.sleep(0)
+                raise ValueError("... uhuh ...")
+
+        engine = Engine()
+
+        async def run():
+            with self.assertRaises(ValueError):
+                await engine.process(message={"eventId": "abcd"})
+            # modified after the failure, before the notification is sent
+            engine.identity = "modified"
+        # act
+        asyncio.run(run())
+        notifier.flush(timeout=1.0)
+        # assert
+        self.assertEqual(slack.error.call_args.kwargs["header"], "engine(abcd)")
+        self.assertEqual(threads, ["observe-notify"])
+
+    @patch("atl_observe.lib.notifier.get_default_metric")
+    def test_drops_when_full(self, get_default_metric):
+        # arrange
+        started, release = threading.Event(), threading.Event()
+
+        def notify(failure):
+            started.set()
+            release.wait(1.0)
+        failure = Mock()
+        failure.plan.notify.side_effect = notify
+        bounded = Notifier(max_queue_size=1)
+        # act
+        sending = bounded.submit(failure)
+        started.wait(1.0)
+        queued = bounded.submit(failure)
+        dropped = bounded.submit(failure)
+        release.set()
+        flushed = bounded.flush(timeout=1.0)
+        # assert
+        self.assertEqual((sending, queued, dropped), (True, True, False))
+        self.assertEqual(bounded.dropped, 1)
+        self.assertTrue(flushed)
+        self.assertEqual(failure.plan.notify.call_count, 2)
+        get_default_metric.return_value.increment.assert_called_once_with("observe.notify.dropped", 1)
+
+    def test_rejects_empty_queue(self):
+        # act, assert
+        with self.assertRaises(ValueError):
+            Notifier(max_queue_size=0)
@@ -1,11 +1,15 @@
 """Defines tests for the @observe decorator.
 """
+import asyncio
+import logging
+import time
 from typing import Any, Dict
 from unittest import TestCase
 
 from mock import Mock, patch
 
 from atl_observe import observe
+from atl_observe.lib.clock import ManualClock
 from atl_observe.lib.metrics import (IMetric, IncrementNotImplementedError,
                                      TimingNotTImplementedError)
 
@@ -196,6 +200,7 @@ class TestDecoratorExceptions(TestCase):
         # act
         self.assertRaises(TestDecoratorExceptions.CustomException, process)
 
+    @patch("atl_observe.lib.slack._default_slack", None)
     @patch("atl_observe.lib.slack.requests")
     def test_method_raises(self, requests):
         # arrange patch
@@ -211,6 +216,143 @@ class TestDecoratorExceptions(TestCase):
             self.assertRaises(TestDecoratorExceptions.CustomException, A().process)
 
 
+class TestDecoratorSLIThresholds(TestCase):
+    """Defines tests for @observe(sli_thresholds=...).
+    """
+
+    def test_custom_sli_thresholds(self):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+
+            @observe(metric="my_metric", sli_thresholds={0: "fast", 1000: "slow"})
+            def process(self):
+                pass
+        a = A()
+        # act
+        a.process()
+        # assert
+        self.assertIn("observed_sli:fast", a.metric.increment.call_args_list[0].args[2])
+
+    def test_invalid_sli_thresholds_raise_at_decoration(self):
+        # act, assert
+        with self.assertRaises(ValueError):
+            @observe(metric="my_metric", sli_thresholds={})
+            def process():
+                pass
+
+
+class TestDecoratorTiming(TestCase):
+    """Defines tests for the process time measured by @observe, using an injected clock.
+    """
+
+    def setUp(self) -> None:
+        self.clock = ManualClock()
+        self.metric = Mock(spec=IMetric)
+        self.metric.gauge = Mock()
+
+    def _arrange(self, milliseconds: float, **kwargs):
+        clock = self.clock
+
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric", clock=clock, **kwargs)
+            def process(self):
+                clock.advance(milliseconds=milliseconds)
+        return A(self.metric)
+
+    def test_sub_second_milliseconds(self):
+        # arrange
+        a = self._arrange(milliseconds=2.5)
+        # act
+        a.process()
+        # assert
+        time_name, process_time, tags = self.metric.timing.call_args.args
+        self.assertEqual(time_name, "my_metric.time.finished")
+        self.assertEqual(process_time, 2.5)
+        self.assertEqual(self.metric.gauge.call_args.args[1], 2.5)
+        self.assertIn("observed_sli:100ms", tags)
+
+    def test_sli_bucket_from_milliseconds(self):
+        # arrange
+        a = self._arrange(milliseconds=150)
+        # act
+        a.process()
+        # assert
+        self.assertIn("observed_sli:200ms", self.metric.timing.call_args.args[2])
+
+    def test_microseconds(self):
+        # arrange
+        a = self._arrange(milliseconds=150, unit="us")
+        # act
+        a.process()
+        # assert, sli thresholds stay in ms
+        self.assertEqual(self.metric.timing.call_args.args[1], 150000.0)
+        self.assertIn("observed_sli:200ms", self.metric.timing.call_args.args[2])
+
+    def test_unknown_unit_raises_at_decoration(self):
+        # act, assert
+        self.assertRaises(ValueError, self._arrange, milliseconds=1, unit="s")
+
+    def test_default_clock_measures(self):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric")
+            def process(self):
+                time.sleep(0.01)
+        # act
+        A(self.metric).process()
+        # assert
+        self.assertGreaterEqual(self.metric.timing.call_args.args[1], 10)
+
+
+class TestDecoratorPositionalArgs(TestCase):
+    """Defines tests for @observe use-cases where the tags_from and trace_id_from parameters are passed positionally.
+    """
+
+    def setUp(self):
+        self.metric = Mock(spec=IMetric)
+        self.metric.gauge = Mock()
+
+    def test_method_positional_message(self):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+                self.logger = Mock(spec=logging.Logger)
+
+            @observe(metric="my_metric",
+                     tags_from={"message": ["type"]},
+                     trace_id_from={"message": "eventId"},
+                     accept_on=[ValueError])
+            def process(self, message: Dict[str, Any]):
+                raise ValueError("accept")
+        a = A(self.metric)
+        # act
+        a.process({"type": "a", "eventId": "abcd"})
+        # assert
+        self.assertIn("type:a", self.metric.timing.call_args.args[2])
+        self.assertIn("A(abcd)", a.logger.log.call_args.args)
+
+    def test_function_keyword_preferred_over_positional(self):
+        # arrange
+        @observe(metric="my_metric", tags_from={"message": ["type"], "other": ["kind"]})
+        def process(other, message=None):
+            pass
+        # act
+        with patch("atl_observe.lib.utils.get_default_metric", return_value=self.metric):
+            process({"kind": "b"}, message={"type": "a"})
+        # assert
+        self.assertEqual(self.metric.timing.call_args.args[2][:2], ["type:a", "kind:b"])
+
+
 class TestDecoratorIMetricExceptions(TestCase):
     """Defines tests for @observe use-cases where IMetric was used incorrect
     """
@@ -234,3 +376,106 @@ class TestDecoratorIMetricExceptions(TestCase):
         }
         # act
         self.assertRaises((TimingNotTImplementedError, IncrementNotImplementedError), A().process, **kwargs)
+
+
+class TestDecoratorAsync(TestCase):
+    """Defines tests for @observe use-cases with `async def` functions and generators.
+    """
+
+    class AcceptOnException(Exception):
+        """If raised, message should be acknowledged.
+        """
+
+    class DeclineOnException(Exception):
+        """If raised, message should not be acknowledged.
+        """
+
+    def setUp(self) -> None:
+        self.metric = Mock(spec=IMetric)
+        self.metric.gauge = Mock()
+
+    def _counted(self):
+        return [call.args[0] for call in self.metric.increment.call_args_list]
+
+    def test_coroutine_awaited_finished(self):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric")
+            async def process(self, message: dict) -> dict:
+                await asyncio.sleep(0)
+                return message
+        # act
+        response = asyncio.run(A(self.metric).process(message={"a": 1}))
+        # assert
+        self.assertEqual(response, {"a": 1})
+        self.assertEqual(self._counted(), ["my_metric.finished", "my_metric.start"])
+
+    def test_coroutine_accepts_declines_on(self):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric",
+                     accept_on=[TestDecoratorAsync.AcceptOnException],
+                     decline_on=[TestDecoratorAsync.DeclineOnException])
+            async def process(self, ex: Exception) -> None:
+                await asyncio.sleep(0)
+                raise ex
+        # act
+        accepted = asyncio.run(A(self.metric).process(TestDecoratorAsync.AcceptOnException()))
+        declined = asyncio.run(A(self.metric).process(TestDecoratorAsync.DeclineOnException()))
+        # assert
+        self.assertIs(accepted, True)
+        self.assertIs(declined, False)
+        self.assertEqual(self._counted(), ["my_metric.exception.accepted", "my_metric.start",
+                                           "my_metric.exception.declined", "my_metric.start"])
+
+    @patch("atl_observe.lib.slack._default_slack", None)
+    @patch("atl_observe.lib.slack.requests")
+    def test_coroutine_raises(self, requests):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric")
+            async def process(self) -> None:
+                await asyncio.sleep(0)
+                raise ValueError("... uhuh ...")
+
+        async def run():
+            with self.assertRaises(ValueError):
+                await A(self.metric).process()
+            # let the notifier deliver the notification
+            await asyncio.sleep(0.1)
+        # act
+        with patch.dict('os.environ', {'SLACK_WEB_HOOK': 'https://hooks.slack.com/services/top_secret_1'}):
+            asyncio.run(run())
+        # assert
+        self.assertEqual(self._counted(), ["my_metric.exception.raised", "my_metric.start"])
+        requests.Session.return_value.post.assert_called_once()
+
+    def test_async_generator(self):
+        # arrange
+        class A:
+            def __init__(self, metric):
+                self.metric = metric
+
+            @observe(metric="my_metric", accept_on=[TestDecoratorAsync.AcceptOnException])
+            async def stream(self, count: int):
+                for i in range(count):
+                    await asyncio.sleep(0)
+                    yield i
+                raise TestDecoratorAsync.AcceptOnException()
+
+        async def run():
+            return [item async for item in A(self.metric).stream(3)]
+        # act
+        items = asyncio.run(run())
+        # assert
+        self.assertEqual(items, [0, 1, 2])
+        self.assertEqual(self._counted(), ["my_metric.exception.accepted", "my_metric.start"])
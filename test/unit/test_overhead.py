@@ -0,0 +1,151 @@
+"""Defines tests for the self-instrumentation of @observe, see overhead.OverheadCounter
+"""
+import asyncio
+from unittest import TestCase
+
+from mock import Mock
+
+from atl_observe import observe
+from atl_observe.lib import overhead
+from atl_observe.lib.clock import Clock
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.overhead import OverheadCounter
+
+
+class SteppingClock(Clock):
+    """Advances by 1ms on each read.
+    """
+
+    def __init__(self):
+        self.time_ns = 0
+
+    def now_ns(self):
+        now = self.time_ns
+        self.time_ns += 1000000
+        return now
+
+
+class TestOverheadCounter(TestCase):
+
+    def test_record_returns_window_after_interval(self):
+        # arrange
+        counter = OverheadCounter("my_metric", interval_ns=10)
+        # act
+        first = counter.record(1, 2, now_ns=100)
+        second = counter.record(3, 4, now_ns=105)
+        third = counter.record(5, 0, now_ns=110)
+        fourth = counter.record(1, 1, now_ns=111)
+        # assert
+        self.assertIsNone(first)
+        self.assertIsNone(second)
+        self.assertEqual(third, [3, 9, 6, 7])
+        self.assertIsNone(fourth)
+        self.assertEqual(counter.summary(), {"count": 4, "pre_ns": 10, "post_ns": 7, "max_ns": 7, "mean_ns": 4.25})
+
+    def test_emit_gauges(self):
+        # arrange
+        counter = OverheadCounter("my_metric")
+        imetric = Mock(spec=IMetric)
+        imetric.gauge = Mock()
+        # act
+        counter.emit(imetric, [2, 4000000, 2000000, 5000000], 1e6, ("layer:process",))
+        # assert
+        self.assertEqual([call.args[:2] for call in imetric.gauge.call_args_list], [
+            ("my_metric.observe_overhead", 3.0),
+            ("my_metric.observe_overhead.max", 5.0),
+            ("my_metric.observe_overhead.pre", 2.0),
+            ("my_metric.observe_overhead.post", 1.0),
+        ])
+        self.assertEqual(imetric.gauge.call_args.args[2], ["layer:process"])
+
+    def test_reset(self):
+        # arrange
+        counter = OverheadCounter("my_metric")
+        counter.record(1, 1, now_ns=0)
+        # act
+        counter.reset()
+        # assert
+        self.assertEqual(counter.summary()["count"], 0)
+
+
+class TestObserveOverhead(TestCase):
+
+    def setUp(self):
+        overhead.reset()
+        self.metric = Mock(spec=IMetric)
+        self.metric.gauge = Mock()
+
+    def test_measures_before_and_after_the_call(self):
+        # arrange
+        metric = self.metric
+
+        class A:
+            def __init__(self):
+                self.metric = metric
+
+            @observe(metric="overhead_sync", clock=SteppingClock(), overhead=True)
+            def process(self):
+                pass
+        # act
+        A().process()
+        A().process()
+        # assert, each read advances 1ms: entered, started, returned, accounted
+        self.assertEqual(overhead.snapshot()["overhead_sync"], {
+            "count": 2, "pre_ns": 2000000, "post_ns": 2000000, "max_ns": 2000000, "mean_ns": 2000000.0})
+        gauges = [call.args[0] for call in metric.gauge.call_args_list]
+        self.assertNotIn("overhead_sync.observe_overhead", gauges)
+
+    def test_sends_aggregate_after_interval(self):
+        # arrange
+        metric = self.metric
+
+        class A:
+            def __init__(self):
+                self.metric = metric
+
+            @observe(metric="overhead_async", clock=SteppingClock(), overhead=True)
+            async def process(self):
+                pass
+        overhead.get_counter("overhead_async").interval_ns = 0
+        # act
+        asyncio.run(A().process())
+        # assert
+        gauges = {call.args[0]: call.args[1] for call in metric.gauge.call_args_list}
+        self.assertEqual(gauges["overhead_async.observe_overhead"], 2.0)
+        self.assertEqual(gauges["overhead_async.observe_overhead.pre"], 1.0)
+
+    def test_counter_per_static_tags(self):
+        # arrange
+        metric = self.metric
+
+        class A:
+            def __init__(self):
+                self.metric = metric
+
+            @observe(metric="overhead_shared", static_tags=["layer:a"], clock=SteppingClock(), overhead=True)
+            def first(self):
+                pass
+
+            @observe(metric="overhead_shared", static_tags=["layer:b"], clock=SteppingClock(), overhead=True)
+            def second(self):
+                pass
+        overhead.get_counter("overhead_shared", ("layer:a",)).interval_ns = 0
+        # act
+        A().first()
+        A().second()
+        # assert, only the window of first is sent, tagged with its static tags
+        self.assertEqual([call.args[2] for call in metric.gauge.call_args_list
+                          if call.args[0] == "overhead_shared.observe_overhead"], [["layer:a"]])
+        self.assertIsNot(overhead.get_counter("overhead_shared", ("layer:a",)),
+                         overhead.get_counter("overhead_shared", ("layer:b",)))
+        self.assertEqual(overhead.snapshot()["overhead_shared"]["count"], 2)
+
+    def test_disabled_by_default(self):
+        # arrange
+        @observe(metric="overhead_disabled")
+        def process():
+            pass
+        # act
+        process()
+        # assert
+        self.assertNotIn("overhead_disabled", overhead.snapshot())
@@ -0,0 +1,120 @@
+"""Defines tests for paths.parse_path and paths.compile_path functions
+"""
+import logging
+from dataclasses import dataclass
+from unittest import TestCase
+
+from mock import Mock
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.paths import compile_path, parse_path, tag_field
+
+
+@dataclass
+class Headers:
+    trace_id: str
+
+
+class TestPaths(TestCase):
+
+    def test_parse_path(self):
+        # act, assert
+        self.assertEqual(parse_path("type"), [("type", None)])
+        self.assertEqual(parse_path("records[0].user.id"), [("records", None), (None, 0), ("user", None), ("id", None)])
+        self.assertEqual(parse_path("[-1]"), [(None, -1)])
+
+    def test_parse_invalid_path_raises(self):
+        # act, assert
+        for path in ("", ".type", "a..b", "a.", "a[x]", "a[0]b", "a]"):
+            self.assertRaises(ValueError, parse_path, path)
+
+    def test_compile_path_reads_dicts_lists_and_attributes(self):
+        # arrange
+        message = {"headers": Headers(trace_id="abcd"), "records": [{"type": "a"}, {"type": "b"}]}
+        # act, assert
+        self.assertEqual(compile_path("headers.trace_id")(message), "abcd")
+        self.assertEqual(compile_path("records[1].type")(message), "b")
+        self.assertEqual(compile_path("records[-2].type")(message), "a")
+        self.assertEqual(compile_path("trace_id")(Headers(trace_id="abcd")), "abcd")
+
+    def test_compile_path_misses_gracefully(self):
+        # arrange
+        class Broken:
+            @property
+            def value(self):
+                raise RuntimeError("broken")
+        message = {"records": [], "headers": None, "broken": Broken()}
+        # act, assert
+        self.assertIsNone(compile_path("records[0].type")(message))
+        self.assertIsNone(compile_path("headers.trace_id")(message))
+        self.assertIsNone(compile_path("unknown.trace_id")(message))
+        self.assertIsNone(compile_path("type[0]")({"type": "a"}))
+        self.assertIsNone(compile_path("broken.value")(message))
+        self.assertIsNone(compile_path("value")(Broken()))
+        self.assertIsNone(compile_path("type")(None))
+
+    def test_compile_malformed_path_reads_key(self):
+        # act, assert
+        self.assertEqual(compile_path("a..b")({"a..b": "value"}), "value")
+        self.assertIsNone(compile_path("a..b")({"a": {"b": "value"}}))
+        self.assertIsNone(compile_path("[]")(Headers(trace_id="abcd")))
+
+    def test_compile_path_reads_literal_key_first(self):
+        # arrange
+        message = {"a.b": "literal", "a": {"b": "nested"}, "records[0]": "listed"}
+        # act, assert
+        self.assertEqual(compile_path("a.b")(message), "literal")
+        self.assertEqual(compile_path("a.b")({"a": {"b": "nested"}}), "nested")
+        self.assertEqual(compile_path("records[0]")(message), "listed")
+
+    def test_tag_field(self):
+        # act, assert
+        self.assertEqual(tag_field("type"), ("type", "type"))
+        self.assertEqual(tag_field("a.b"), ("a.b", "a.b"))
+        self.assertEqual(tag_field("records[0].type"), ("records.type", "records[0].type"))
+        self.assertEqual(tag_field("tenant=headers.tenantId"), ("tenant", "headers.tenantId"))
+        self.assertEqual(tag_field("[0]"), ("[0]", "[0]"))
+
+    def test_observe_with_literal_dotted_keys_and_alias(self):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+                self.logger = Mock(spec=logging.Logger)
+
+            @observe(metric="my_metric",
+                     tags_from={"message": ["event.type", "tenant=headers.tenantId"]},
+                     trace_id_from={"message": "event.id"},
+                     accept_on=[ValueError])
+            def process(self, message: dict):
+                raise ValueError("accept")
+        a = A()
+        # act
+        a.process(message={"event.type": "a", "event.id": "abcd", "headers": {"tenantId": "t1"}})
+        # assert
+        self.assertIn("event.type:a", a.metric.timing.call_args.args[2])
+        self.assertIn("tenant:t1", a.metric.timing.call_args.args[2])
+        self.assertIn("A(abcd)", a.logger.log.call_args.args)
+
+    def test_observe_with_paths(self):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+                self.logger = Mock(spec=logging.Logger)
+
+            @observe(metric="my_metric",
+                     tags_from={"message": ["records[0].type"]},
+                     trace_id_from={"message": "headers.trace_id"},
+                     accept_on=[ValueError])
+            def process(self, message: dict):
+                raise ValueError("accept")
+        a = A()
+        # act
+        a.process(message={"headers": Headers(trace_id="abcd"), "records": [{"type": "a"}]})
+        # assert
+        self.assertIn("records.type:a", a.metric.timing.call_args.args[2])
+        self.assertIn("A(abcd)", a.logger.log.call_args.args)
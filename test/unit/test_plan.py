@@ -0,0 +1,151 @@
+"""Defines tests for plan.Plan class
+"""
+import logging
+import traceback
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.plan import ACCEPTED, DECLINED, FINISHED, RAISED, Plan
+
+
+class TestPlanCompile(TestCase):
+    """Defines tests for the Plan.__init__ method, everything is compiled once.
+    """
+
+    def setUp(self) -> None:
+        def process(message):
+            return message
+        self.plan = Plan(func=process,
+                         metric="my_metric",
+                         accept_on=[KeyError],
+                         decline_on=[ValueError],
+                         static_tags=["layer:process"],
+                         tags_from={"message": ["type"]},
+                         trace_id_from={"message": "eventId"})
+
+    def test_metric_names(self):
+        # assert
+        self.assertEqual(self.plan.metric_start, "my_metric.start")
+        self.assertEqual(self.plan.metric_names[FINISHED],
+                         ("my_metric.time.finished", "my_metric.time_gauge.finished", "my_metric.finished"))
+        self.assertEqual(self.plan.metric_names[ACCEPTED],
+                         ("my_metric.time.accepted", "my_metric.time_gauge.accepted", "my_metric.exception.accepted"))
+        self.assertEqual(self.plan.metric_names[DECLINED],
+                         ("my_metric.time.declined", "my_metric.time_gauge.declined", "my_metric.exception.declined"))
+        self.assertEqual(self.plan.metric_names[RAISED],
+                         ("my_metric.time.raised", "my_metric.time_gauge.raised", "my_metric.exception.raised"))
+
+    def test_tags_are_fresh_lists(self):
+        # act
+        tags_a = self.plan.tags({"message": {"type": "my_type"}})
+        tags_b = self.plan.tags({})
+        tags_b.append("observed_sli:100ms")
+        # assert
+        self.assertEqual(tags_a, ["type:my_type", "layer:process"])
+        self.assertEqual(self.plan.tags({}), ["layer:process"])
+        self.assertEqual(self.plan.static_tags, ("layer:process",))
+
+    def test_classify(self):
+        # act, assert
+        self.assertEqual(self.plan.classify(KeyError()), ACCEPTED)
+        self.assertEqual(self.plan.classify(ValueError()), DECLINED)
+        self.assertEqual(self.plan.classify(Exception()), RAISED)
+
+    def test_emit(self):
+        # arrange
+        imetric = Mock()
+        # act
+        self.plan.emit(imetric, FINISHED, 100, ["layer:process"])
+        # assert
+        imetric.timing.assert_called_once_with("my_metric.time.finished", 100, ["layer:process"])
+        imetric.gauge.assert_called_once_with("my_metric.time_gauge.finished", 100, ["layer:process"])
+        imetric.increment.assert_called_once_with("my_metric.finished", 1, ["layer:process"])
+
+
+class TestPlanFailure(TestCase):
+    """Defines tests for the lazy, bounded traceback of the exception paths.
+    """
+
+    def setUp(self) -> None:
+        self.logger = logging.getLogger("TestPlanFailure")
+        self.logger.handlers = []
+        self.logger.propagate = False
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = self.records.append
+        self.logger.addHandler(handler)
+
+    def _fail(self, depth: int = 3, **kwargs):
+        logger = self.logger
+
+        class A:
+            def __init__(self):
+                self.logger = logger
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+
+            @observe(metric="my_metric", accept_on=[KeyError], decline_on=[ValueError], **kwargs)
+            def process(self, ex):
+                def nested(level):
+                    if level:
+                        nested(level - 1)
+                    raise ex
+                nested(depth)
+        return A()
+
+    def test_not_formatted_when_logger_disabled(self):
+        # arrange
+        self.logger.setLevel(logging.CRITICAL)
+        # act
+        with patch("atl_observe.lib.plan.traceback") as traceback:
+            self._fail().process(ValueError("declined"))
+        # assert
+        traceback.format_exception.assert_not_called()
+        self.assertEqual(self.records, [])
+
+    def test_not_formatted_when_no_handler_builds_the_message(self):
+        # arrange
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.handlers = [logging.NullHandler()]
+        # act
+        with patch("atl_observe.lib.plan.traceback") as traceback:
+            self._fail().process(KeyError("accepted"))
+            self._fail().process(ValueError("declined"))
+        # assert
+        traceback.format_exception.assert_not_called()
+
+    @patch("atl_observe.lib.slack._default_slack", None)
+    @patch("atl_observe.lib.slack.requests")
+    def test_formatted_once_for_log_and_notification(self, requests):
+        # arrange
+        self.logger.setLevel(logging.DEBUG)
+        # act
+        with patch.dict('os.environ', {'SLACK_WEB_HOOK': 'https://hooks.slack.com/services/top_secret_1'}):
+            with patch("atl_observe.lib.plan.traceback.format_exception", wraps=traceback.format_exception) as format_exception:
+                self.assertRaises(RuntimeError, self._fail().process, RuntimeError("raised"))
+        # assert
+        self.assertEqual(format_exception.call_count, 1)
+        self.assertIn("Traceback (most recent call last)", self.records[0].getMessage())
+        requests.Session.return_value.post.assert_called_once()
+
+    def test_traceback_limit_keeps_innermost_frames(self):
+        # arrange
+        self.logger.setLevel(logging.DEBUG)
+        # act
+        self._fail(depth=10, traceback_limit=2).process(ValueError("declined"))
+        # assert
+        message = self.records[0].getMessage()
+        self.assertEqual(message.count('File "'), 2)
+        self.assertIn("in nested", message)
+
+    def test_no_traceback_on_accept(self):
+        # arrange
+        self.logger.setLevel(logging.DEBUG)
+        # act
+        self._fail(traceback_on_accept=False).process(KeyError("accepted"))
+        # assert
+        self.assertTrue(self.records[0].getMessage().endswith("during 'process' accepted."))
+        self.assertEqual(self.records[0].levelno, logging.WARNING)
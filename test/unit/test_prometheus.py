@@ -0,0 +1,127 @@
+"""Defines tests for prometheus.PrometheusMetric class
+"""
+import threading
+import urllib.error
+import urllib.request
+from unittest import TestCase
+
+from atl_observe import observe
+from atl_observe.lib.prometheus import (CONTENT_TYPE, PrometheusMetric, labels,
+                                        metric_name)
+
+
+class TestPrometheusFormat(TestCase):
+
+    def test_metric_name(self):
+        # act, assert
+        self.assertEqual(metric_name("process.time.finished"), "process_time_finished")
+        self.assertEqual(metric_name("process.start", namespace="app"), "app_process_start")
+        self.assertEqual(metric_name("1-process"), "_1_process")
+
+    def test_labels(self):
+        # act, assert
+        self.assertEqual(labels(("type:a", "schema:b:c")), 'type="a",schema="b:c"')
+        self.assertEqual(labels(("flag", "my-key:x\"y")), 'tag="flag",my_key="x\\"y"')
+        self.assertEqual(labels(()), "")
+
+    def test_labels_unique_per_series(self):
+        # act, assert
+        self.assertEqual(labels(("env:a", "type:x", "env:b")), 'env="a,b",type="x"')
+        self.assertEqual(labels(("flag", "canary")), 'tag="flag,canary"')
+        self.assertEqual(labels(("env:a", "env:a", "my-key:1", "my_key:2")), 'env="a",my_key="1,2"')
+
+    def test_render(self):
+        # arrange
+        metric = PrometheusMetric(buckets=(10, 100))
+        # act
+        metric.increment("process.finished", 1, ["type:a"])
+        metric.increment("process.finished", 2, ["type:a"])
+        metric.gauge("process.time_gauge.finished", 12.5, ["type:a"])
+        metric.timing("process.time.finished", 5, ["type:a"])
+        metric.timing("process.time.finished", 10, ["type:a"])
+        metric.timing("process.time.finished", 500, ["type:a"])
+        # assert
+        self.assertEqual(metric.render(), "\n".join([
+            "# TYPE process_finished_total counter",
+            'process_finished_total{type="a"} 3',
+            "# TYPE process_time_finished histogram",
+            'process_time_finished_bucket{type="a",le="10"} 2',
+            'process_time_finished_bucket{type="a",le="100"} 2',
+            'process_time_finished_bucket{type="a",le="+Inf"} 3',
+            'process_time_finished_sum{type="a"} 515',
+            'process_time_finished_count{type="a"} 3',
+            "# TYPE process_time_gauge_finished gauge",
+            'process_time_gauge_finished{type="a"} 12.5',
+        ]) + "\n")
+
+    def test_render_merges_equal_labels(self):
+        # arrange
+        metric = PrometheusMetric(buckets=(10,))
+        # act
+        metric.increment("process.finished", 1, ["env:a", "env:b"])
+        metric.increment("process.finished", 2, ["env:a", "env:a", "env:b"])
+        metric.timing("process.time.finished", 5, ["my-key:x"])
+        metric.timing("process.time.finished", 50, ["my_key:x"])
+        # assert
+        self.assertEqual(metric.render(), "\n".join([
+            "# TYPE process_finished_total counter",
+            'process_finished_total{env="a,b"} 3',
+            "# TYPE process_time_finished histogram",
+            'process_time_finished_bucket{my_key="x",le="10"} 1',
+            'process_time_finished_bucket{my_key="x",le="+Inf"} 2',
+            'process_time_finished_sum{my_key="x"} 55',
+            'process_time_finished_count{my_key="x"} 2',
+        ]) + "\n")
+
+    def test_invalid_setup_raises(self):
+        # act, assert
+        self.assertRaises(ValueError, PrometheusMetric, buckets=())
+        self.assertRaises(ValueError, PrometheusMetric, buckets=(10, 5))
+        self.assertRaises(ValueError, PrometheusMetric, stripes=0)
+
+
+class TestPrometheusMetric(TestCase):
+
+    def test_concurrent_updates(self):
+        # arrange
+        metric = PrometheusMetric(stripes=4)
+
+        def work():
+            for index in range(1000):
+                metric.increment("process.finished", 1, ["worker:%d" % (index % 8)])
+                metric.timing("process.time.finished", index % 20)
+        workers = [threading.Thread(target=work) for _ in range(8)]
+        # act
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # assert
+        collected = metric.collect()
+        self.assertEqual(sum(value for (kind, _, _), value in collected.items() if kind == "counter"), 8000)
+        self.assertEqual(collected[("histogram", "process.time.finished", ())].count, 8000)
+
+    def test_observe_and_serve(self):
+        # arrange
+        metric = PrometheusMetric()
+
+        class A:
+            def __init__(self):
+                self.metric = metric
+
+            @observe(metric="process", static_tags=["layer:process"])
+            def process(self):
+                pass
+        address, port = metric.serve(port=0)
+        self.addCleanup(metric.shutdown)
+        # act
+        A().process()
+        with urllib.request.urlopen("http://%s:%d/metrics" % (address, port)) as response:
+            content_type = response.headers["Content-Type"]
+            body = response.read().decode("utf-8")
+        # assert
+        self.assertEqual(content_type, CONTENT_TYPE)
+        self.assertIn('process_start_total{layer="process",observed_sli="100ms"} 1', body)
+        self.assertIn('process_time_finished_count{layer="process",observed_sli="100ms"} 1', body)
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen("http://%s:%d/other" % (address, port))
@@ -1,15 +1,17 @@
 """Defines tests for utils.Provider class
 """
 import logging
+from dataclasses import dataclass, field
 from logging import Logger
 from unittest import TestCase
 
 from datadog.dogstatsd.base import DogStatsd
-from mock import patch
+from mock import Mock, patch
 
-from atl_observe import Slack
+from atl_observe import BackgroundSlack, Slack, observe
 from atl_observe.lib.logger import Logger as CustomLogger
 from atl_observe.lib.metrics import IMetric, Metric
+from atl_observe.lib.slack import get_default_slack
 from atl_observe.lib.utils import Provider
 
 
@@ -81,6 +83,31 @@ class TestProviderGetSlack(TestCase):
         self.assertIsInstance(slack, Slack)
         self.assertEqual(slack.web_hook, "http://slack-web-hook")
 
+    def test_default_slack_created_once(self):
+        # arrange os environ patch
+        with self.env_with_slack:
+            # act
+            slacks = [Provider.get_slack() for _ in range(3)]
+        with patch.dict('os.environ', {'SLACK_WEB_HOOK': 'http://slack-web-hook-2'}):
+            changed = Provider.get_slack()
+        # assert
+        self.assertIs(slacks[0], slacks[1])
+        self.assertIs(slacks[0], slacks[2])
+        self.assertEqual(changed.web_hook, "http://slack-web-hook-2")
+
+    def test_default_slack_in_background(self):
+        # arrange os environ patch
+        with patch.dict('os.environ', {'SLACK_WEB_HOOK': 'http://slack-web-hook', 'SLACK_BACKGROUND': 'true'}):
+            # act
+            background = Provider.get_slack()
+        with self.env_with_slack:
+            synchronous = Provider.get_slack()
+            explicit = get_default_slack(background=True)
+        # assert
+        self.assertIsInstance(background, BackgroundSlack)
+        self.assertNotIsInstance(synchronous, BackgroundSlack)
+        self.assertIsInstance(explicit, BackgroundSlack)
+
     def test_when_args_have_slack(self):
         # arrange, act
         slack = Provider.get_slack(Slack(web_hook="slack-web-hook"))
@@ -155,3 +182,92 @@ class TestProviderGetMetric(TestCase):
         # assert
         self.assertIsInstance(metric, DogStatsd)
         self.assertEqual(metric.host, "custom_dog_in_class")
+
+
+class TestProviderCache(TestCase):
+    """Defines tests for the clients cached per owner, and Provider.invalidate.
+    """
+
+    def setUp(self) -> None:
+        class A:
+            def __init__(self):
+                self.metric = Metric(host="cached_metric")
+                self.logger = Logger(name="cached_logger")
+                self.slack = Slack(web_hook="cached-web-hook")
+        self.owner = A()
+
+    def tearDown(self) -> None:
+        Provider.invalidate()
+
+    def test_owner_clients_are_cached(self):
+        # act
+        metric = Provider.get_metric(self.owner, owner=True)
+        self.owner.metric = Metric(host="replaced_metric")
+        # assert, still the cached client
+        self.assertIs(Provider.get_metric(self.owner, owner=True), metric)
+        self.assertIs(Provider.get_logger(self.owner, owner=True), self.owner.logger)
+        self.assertIs(Provider.get_slack(self.owner, owner=True), self.owner.slack)
+
+    def test_not_cached_without_owner(self):
+        # act
+        Provider.get_metric(self.owner)
+        self.owner.metric = Metric(host="replaced_metric")
+        # assert
+        self.assertEqual(Provider.get_metric(self.owner).host, "replaced_metric")
+        self.assertEqual(Provider._clients, {})
+
+    def test_equal_owners_are_distinct(self):
+        # arrange
+        @dataclass(frozen=True)
+        class Engine:
+            name: str
+            metric: Metric = field(compare=False)
+
+            @observe(metric="process")
+            def process(self):
+                return True
+        first = Engine("engine", Mock(spec=Metric))
+        second = Engine("engine", Mock(spec=Metric))
+        # act
+        first.process()
+        second.process()
+        # assert
+        self.assertEqual(first, second)
+        first.metric.increment.assert_called()
+        second.metric.increment.assert_called()
+        self.assertIs(Provider.get_metric(second, owner=True), second.metric)
+
+    def test_invalidate_owner(self):
+        # arrange
+        Provider.get_metric(self.owner, owner=True)
+        self.owner.metric = Metric(host="replaced_metric")
+        # act
+        Provider.invalidate(self.owner)
+        # assert
+        self.assertEqual(Provider.get_metric(self.owner, owner=True).host, "replaced_metric")
+
+    def test_owner_without_clients_searches_remaining_args(self):
+        # arrange
+        class B:
+            pass
+        owner = B()
+        # act
+        Provider.get_logger(owner, owner=True)
+        logger = Provider.get_logger(owner, Logger(name="second_arg"), owner=True)
+        # assert
+        self.assertEqual(logger.name, "second_arg")
+
+    def test_owner_is_released(self):
+        # arrange
+        Provider.get_metric(self.owner, owner=True)
+        self.assertIn(id(self.owner), Provider._clients)
+        cached = len(Provider._clients)
+        # act
+        del self.owner
+        # assert
+        self.assertEqual(len(Provider._clients), cached - 1)
+
+    def test_uncacheable_owner(self):
+        # act, assert, assertion provided by no exception
+        Provider.invalidate({})
+        self.assertEqual(Provider.get_metric({}, Metric(host="second_arg"), owner=True).host, "second_arg")
@@ -3,7 +3,9 @@
 
 from unittest import TestCase
 
-from atl_observe.lib.utils import Resolver, observe_threshold_map
+from atl_observe.lib.tags import TagCache
+from atl_observe.lib.utils import (Resolver, SLIThresholds,
+                                   observe_threshold_map)
 
 
 class TestResolverTagsFromEmpty(TestCase):
@@ -327,3 +329,101 @@ class TestResolverSLITag(TestCase):
         tag = Resolver.resolve_observed_sli_tag(process_time=process_time)
         # assert
         self.assertEqual(tag, "observed_sli:OVER_30min")
+
+
+class TestResolverCompile(TestCase):
+    """Defines tests for the Resolver.compile_tags_from and Resolver.compile_trace_id staticmethods.
+    """
+
+    def test_compile_without_setup_returns_no_op(self):
+        # act
+        resolve_tags = Resolver.compile_tags_from(tags_from=None)
+        resolve_trace_id = Resolver.compile_trace_id(trace_id_from=None)
+        # assert
+        self.assertIs(resolve_tags, Resolver.compile_tags_from(tags_from={"message": []}))
+        self.assertIs(resolve_trace_id, Resolver.compile_trace_id(trace_id_from={}))
+        self.assertEqual(resolve_tags({"message": {"type": "my_type"}}), [])
+        self.assertEqual(resolve_trace_id({"message": {"eventId": "abcd"}}), "")
+
+    def test_compile_resolves_on_each_call(self):
+        # arrange
+        resolve_tags = Resolver.compile_tags_from(tags_from={"message": ["type"]})
+        resolve_trace_id = Resolver.compile_trace_id(trace_id_from={"message": "eventId"})
+        # act, assert
+        self.assertEqual(resolve_tags({"message": {"type": "a"}}), ["type:a"])
+        self.assertEqual(resolve_tags({"message": {"type": "b"}}), ["type:b"])
+        self.assertEqual(resolve_trace_id({"message": {"eventId": "abcd"}}), "abcd")
+        self.assertEqual(resolve_trace_id({"message": {}}), "")
+
+    def test_compile_reuses_cached_tags(self):
+        # arrange
+        cache = TagCache()
+        resolve_tags = Resolver.compile_tags_from(
+            tags_from={"message": ["type", "region"]}, static_tags=("env:test",), cache=cache)
+        # act
+        first = resolve_tags({"message": {"type": "a", "region": "eu"}})
+        second = resolve_tags({"message": {"type": "a", "region": "eu"}})
+        missing = resolve_tags({"message": {"region": "eu"}})
+        # assert
+        self.assertEqual(first, ["type:a", "region:eu", "env:test"])
+        self.assertEqual(missing, ["region:eu", "env:test"])
+        self.assertIsNot(first, second)
+        self.assertIs(first[0], second[0])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(resolve_tags({}), ["env:test"])
+
+    def test_positions(self):
+        # arrange
+        def process(self, message, event=None, *args, other=None, **kwargs):
+            pass
+        # act, assert
+        self.assertEqual(Resolver.positions(process), {"self": 0, "message": 1, "event": 2})
+        self.assertEqual(Resolver.positions(len), {"obj": 0})
+        self.assertEqual(Resolver.positions(object()), {})
+
+    def test_compile_resolves_from_positional_args(self):
+        # arrange
+        positions = {"self": 0, "message": 1}
+        resolve_tags = Resolver.compile_tags_from(tags_from={"message": ["type"]}, positions=positions)
+        resolve_trace_id = Resolver.compile_trace_id(trace_id_from={"message": "eventId"}, positions=positions)
+        message = {"type": "a", "eventId": "abcd"}
+        # act, assert
+        self.assertEqual(resolve_tags({}, (None, message)), ["type:a"])
+        self.assertEqual(resolve_tags({}, (None,)), [])
+        self.assertEqual(resolve_trace_id({}, (None, message)), "abcd")
+        self.assertEqual(resolve_trace_id({}), "")
+
+
+class TestSLIThresholds(TestCase):
+    """Defines tests for the SLIThresholds, compiled custom threshold maps.
+    """
+
+    def test_matches_linear_scan(self):
+        # arrange
+        def linear(process_time, threshold_map):
+            current_value = threshold_map[0]
+            for key, value in threshold_map.items():
+                if process_time <= key:
+                    return "observed_sli:%s" % current_value
+                current_value = value
+            return "observed_sli:%s" % current_value
+        thresholds = SLIThresholds(observe_threshold_map)
+        # act, assert
+        for process_time in list(range(-5, 2500, 7)) + [0.5, 99.9, 100.1, 1799999, 1800000, 1800001, 10 ** 9]:
+            self.assertEqual(thresholds.tag(process_time), linear(process_time, observe_threshold_map))
+
+    def test_custom_unsorted_map(self):
+        # arrange
+        thresholds = SLIThresholds({50: "slow", 0: "fast", 10.5: "ok"})
+        # act, assert
+        self.assertEqual(thresholds.tag(5), "observed_sli:fast")
+        self.assertEqual(thresholds.tag(10.5), "observed_sli:fast")
+        self.assertEqual(thresholds.tag(11), "observed_sli:ok")
+        self.assertEqual(thresholds.tag(51), "observed_sli:slow")
+        self.assertEqual(Resolver.resolve_observed_sli_tag(process_time=11, threshold_map={50: "slow", 0: "fast", 10.5: "ok"}),
+                         "observed_sli:ok")
+
+    def test_invalid_maps_raise(self):
+        # act, assert
+        for threshold_map in ({}, None, {"10": "a"}, {True: "a"}, {10: ""}, {10: None}):
+            self.assertRaises(ValueError, SLIThresholds, threshold_map)
@@ -0,0 +1,106 @@
+"""Defines tests for sampling.Sampler class
+"""
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.sampling import Sampler
+
+
+class TestSampler(TestCase):
+    """Defines tests for the Sampler, fixed and adaptive.
+    """
+
+    def test_create_returns_none_when_all_reported(self):
+        # act, assert
+        self.assertIsNone(Sampler.create())
+        self.assertIsNone(Sampler.create(sample_rate=1))
+        self.assertIsNotNone(Sampler.create(sample_rate=0.5))
+        self.assertIsNotNone(Sampler.create(budget=100))
+
+    def test_raises_out_of_range(self):
+        # act, assert
+        self.assertRaises(ValueError, Sampler, sample_rate=0)
+        self.assertRaises(ValueError, Sampler, sample_rate=1.5)
+        self.assertRaises(ValueError, Sampler, budget=0)
+
+    def test_fixed_rate(self):
+        # act, assert
+        self.assertEqual(Sampler(sample_rate=0.25).rate(), 0.25)
+
+    @patch("atl_observe.lib.sampling.random.random", side_effect=[0.1, 0.3])
+    def test_weight(self, _):
+        # arrange
+        sampler = Sampler(sample_rate=0.25)
+        # act, assert
+        self.assertEqual(sampler.weight(), 4)
+        self.assertEqual(sampler.weight(), 0)
+        self.assertEqual(Sampler(budget=100).weight(), 1)
+
+    @patch("atl_observe.lib.sampling.time")
+    def test_adaptive_rate(self, time):
+        # arrange, 1000 calls in the first second, budget of 100 per second
+        time.monotonic.return_value = 0.0
+        sampler = Sampler(budget=100)
+        for _ in range(999):
+            self.assertIsNone(sampler.rate())
+        # act, window completed
+        time.monotonic.return_value = 1.0
+        rate = sampler.rate()
+        # assert
+        self.assertAlmostEqual(rate, 0.1)
+        # act, traffic dropped below budget
+        time.monotonic.return_value = 2.0
+        self.assertIsNone(sampler.rate())
+
+    @patch("atl_observe.lib.sampling.time")
+    def test_adaptive_rate_capped_by_sample_rate(self, time):
+        # arrange
+        time.monotonic.return_value = 0.0
+        sampler = Sampler(sample_rate=0.5, budget=1000)
+        # act
+        time.monotonic.return_value = 1.0
+        # assert
+        self.assertEqual(sampler.rate(), 0.5)
+
+
+class TestObserveSampling(TestCase):
+    """Defines tests for @observe(sample_rate=...), exceptions are always reported.
+    """
+
+    @patch("atl_observe.lib.sampling.random.random", side_effect=[0.05, 0.5])
+    def test_sample_rate_on_successful_path_only(self, _):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+
+            @observe(metric="my_metric", sample_rate=0.1, decline_on=[ValueError])
+            def process(self, fail: bool):
+                if fail:
+                    raise ValueError()
+        a = A()
+        # act, reported, dropped, failed
+        a.process(fail=False)
+        a.process(fail=False)
+        a.process(fail=True)
+        # assert, the counts of the reported call are scaled, no sample_rate is passed to the client
+        increments = [c.args for c in a.metric.increment.call_args_list]
+        self.assertEqual(increments, [
+            ("my_metric.finished", 10, increments[0][2]),
+            ("my_metric.start", 10, increments[1][2]),
+            ("my_metric.exception.declined", 1, increments[2][2]),
+            ("my_metric.start", 1, increments[3][2])])
+        self.assertEqual([c.args[0] for c in a.metric.timing.call_args_list],
+                         ["my_metric.time.finished", "my_metric.time.declined"])
+        self.assertEqual(len(a.metric.timing.call_args_list[0].args), 3)
+
+    def test_invalid_sample_rate_raises_at_decoration(self):
+        # act, assert
+        with self.assertRaises(ValueError):
+            @observe(metric="my_metric", sample_rate=2)
+            def process():
+                pass
@@ -0,0 +1,205 @@
+"""Defines tests for shared.SharedMetric class
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from unittest import TestCase, skipIf
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric, MemoryMetric
+from atl_observe.lib.shared import (DROP_BATCH, MAX_PROBES, SharedMetric,
+                                    quantile)
+
+
+def _work(metric, worker, calls):
+    for index in range(calls):
+        metric.increment("process.finished", 1, ["worker:%d" % (worker % 2)])
+        metric.timing("process.time.finished", index % 100)
+    metric.gauge("process.workers", worker)
+    # the process ends with os._exit, skipping the interpreter shutdown
+    metric.publish_dropped()
+
+
+class TestSharedMetric(TestCase):
+
+    def test_aggregates(self):
+        # arrange
+        metric = SharedMetric(buckets=(10, 100))
+        # act
+        metric.increment("process.finished", 1, ["type:a"])
+        metric.increment("process.finished", 2, ["type:a"])
+        metric.gauge("process.time_gauge.finished", 12.5)
+        for value in (5, 50, 500):
+            metric.timing("process.time.finished", value, ["type:a"])
+        collected = metric.collect()
+        # assert
+        self.assertEqual(collected[("counter", "process.finished", ("type:a",))], 3)
+        self.assertEqual(collected[("gauge", "process.time_gauge.finished", ())], 12.5)
+        self.assertEqual(collected[("histogram", "process.time.finished", ("type:a",))], {
+            "sum": 555, "min": 5, "max": 500, "count": 3, "counts": [1, 1, 1]})
+
+    def test_collect_resets(self):
+        # arrange
+        metric = SharedMetric()
+        metric.increment("process.finished")
+        metric.gauge("process.workers", 4)
+        metric.collect()
+        # act
+        metric.increment("process.finished")
+        collected = metric.collect()
+        # assert, the gauge was not set again
+        self.assertEqual(collected, {("counter", "process.finished", ()): 1})
+        self.assertEqual(metric.collect(), {})
+
+    def test_table_full_drops(self):
+        # arrange
+        metric = SharedMetric(slots=2, stripes=1)
+        # act
+        for index in range(3):
+            metric.increment("process.finished", 1, ["type:%d" % index])
+        metric.increment("process.%s" % ("x" * 300))
+        # assert
+        self.assertEqual(len(metric.collect()), 2)
+        self.assertEqual(metric.dropped, 2)
+
+    def test_dropped_series_probed_once(self):
+        # arrange
+        metric = SharedMetric(slots=1, stripes=1)
+        metric.increment("process.start")
+        # act
+        with patch.object(metric, "_claim", wraps=metric._claim) as claim:
+            for _ in range(100):
+                metric.increment("process.finished")
+                metric.increment("process.start")
+        # assert
+        self.assertEqual(claim.call_count, 1)
+        self.assertEqual(metric.dropped, 100)
+
+    def test_drops_published_in_batches(self):
+        # arrange, a full table, the dropped series remembered
+        metric = SharedMetric(slots=1, stripes=1)
+        metric.increment("process.start")
+        metric.increment("process.finished")
+        # act
+        with patch.object(metric, "_table_lock", wraps=metric._table_lock) as table_lock:
+            for _ in range(DROP_BATCH - 1):
+                metric.increment("process.finished")
+        # assert, the table lock is taken once per batch
+        self.assertEqual(table_lock.__enter__.call_count, 1)
+        self.assertEqual(metric._drops, 0)
+        self.assertEqual(metric.dropped, DROP_BATCH)
+
+    def test_probes_are_bounded(self):
+        # arrange, a full table
+        metric = SharedMetric(slots=MAX_PROBES * 4, stripes=1)
+        index = 0
+        while len(metric.collect(reset=False)) < metric.slots:
+            metric.increment("process.finished", 1, ["type:%d" % index])
+            index += 1
+        # act
+        with patch.object(metric, "_offset", wraps=metric._offset) as offset:
+            metric.increment("process.declined")
+        # assert
+        self.assertEqual(offset.call_count, MAX_PROBES)
+        self.assertEqual(len(metric.collect()) + metric.dropped, index + 1)
+
+    @skipIf(not hasattr(os, "fork"), "requires fork")
+    def test_dropped_counted_across_processes(self):
+        # arrange
+        metric = SharedMetric(slots=1, stripes=1)
+        metric.increment("process.start")
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=_work, args=(metric, worker, 10)) for worker in range(2)]
+        # act
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # assert, each worker dropped 10 increments, 10 timings and one gauge
+        self.assertEqual(metric.dropped, 42)
+
+    def test_flush(self):
+        # arrange
+        client = MemoryMetric()
+        metric = SharedMetric(client=client, buckets=(10, 100))
+        metric.increment("process.finished", 1, ["type:a"])
+        for value in (5, 50, 60, 500):
+            metric.timing("process.time.finished", value)
+        # act
+        metric.flush()
+        # assert
+        sent = {(kind, name): value for kind, name, value, _ in client.records}
+        self.assertEqual(sent[("increment", "process.finished")], 1)
+        self.assertEqual(sent[("gauge", "process.time.finished.avg")], 153.75)
+        self.assertEqual(sent[("gauge", "process.time.finished.min")], 5)
+        self.assertEqual(sent[("gauge", "process.time.finished.max")], 500)
+        self.assertEqual(sent[("increment", "process.time.finished.count")], 4)
+        self.assertTrue(10 <= sent[("gauge", "process.time.finished.p50")] <= 100)
+        self.assertEqual(sent[("gauge", "process.time.finished.p99")], 500 - (500 - 100) * 0.04)
+
+    def test_quantile(self):
+        # act, assert
+        self.assertEqual(quantile((10, 100), [0, 4, 0], 20, 60, 0.5), 40)
+        self.assertEqual(quantile((10, 100), [2, 0, 2], 5, 200, 1), 200)
+
+    def test_invalid_setup_raises(self):
+        # act, assert
+        self.assertRaises(ValueError, SharedMetric, slots=0)
+        self.assertRaises(ValueError, SharedMetric, buckets=(10, 5))
+
+    def test_concurrent_threads(self):
+        # arrange
+        metric = SharedMetric(stripes=4)
+        workers = [threading.Thread(target=_work, args=(metric, worker, 1000)) for worker in range(4)]
+        # act
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # assert
+        collected = metric.collect()
+        self.assertEqual(sum(value for (kind, _, _), value in collected.items() if kind == "counter"), 4000)
+        self.assertEqual(collected[("histogram", "process.time.finished", ())]["count"], 4000)
+
+    @skipIf(not hasattr(os, "fork"), "requires fork")
+    def test_forked_processes(self):
+        # arrange
+        metric = SharedMetric(stripes=4)
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=_work, args=(metric, worker, 1000)) for worker in range(4)]
+        # act
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # assert
+        collected = metric.collect()
+        self.assertEqual([worker.exitcode for worker in workers], [0, 0, 0, 0])
+        self.assertEqual(collected[("counter", "process.finished", ("worker:0",))], 2000)
+        self.assertEqual(collected[("counter", "process.finished", ("worker:1",))], 2000)
+        self.assertEqual(collected[("histogram", "process.time.finished", ())]["count"], 4000)
+        self.assertIn(collected[("gauge", "process.workers", ())], (0, 1, 2, 3))
+        self.assertTrue(metric.collector)
+
+    def test_observe(self):
+        # arrange
+        self.metric = SharedMetric()
+        self.logger = Mock(spec=logging.Logger)
+
+        @observe(metric="process")
+        def process(self):
+            return True
+
+        # act
+        process(self)
+        process(self)
+        client = Mock(spec=IMetric)
+        client.gauge = Mock()
+        self.metric.client = client
+        self.metric.flush()
+        # assert
+        client.increment.assert_any_call("process.start", 2, ["observed_sli:100ms"])
+        client.increment.assert_any_call("process.time.finished.count", 2, ["observed_sli:100ms"])
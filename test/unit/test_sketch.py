@@ -0,0 +1,162 @@
+"""Defines tests for sketch.LatencySketch and sketch.SketchRegistry classes
+"""
+import random
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.sketch import LatencySketch, SketchRegistry, sketches
+
+
+class TestLatencySketch(TestCase):
+    """Defines tests for the LatencySketch accuracy, merge and memory bound.
+    """
+
+    def test_empty(self):
+        # arrange
+        sketch = LatencySketch()
+        # act, assert
+        self.assertIsNone(sketch.quantile(0.5))
+        self.assertEqual(sketch.summary(), {})
+
+    def test_quantiles_within_relative_accuracy(self):
+        # arrange
+        values = [random.lognormvariate(3, 1) for _ in range(10000)]
+        sketch = LatencySketch(relative_accuracy=0.01)
+        # act
+        for value in values:
+            sketch.add(value)
+        # assert
+        values.sort()
+        for quantile in (0.5, 0.9, 0.99):
+            expected = values[int(quantile * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(quantile) - expected) / expected, 0.01 + 1e-9)
+        self.assertEqual(sketch.quantile(1), values[-1])
+        self.assertEqual(sketch.summary()["max"], values[-1])
+        self.assertEqual(sketch.summary()["count"], 10000)
+
+    def test_zero_values(self):
+        # arrange
+        sketch = LatencySketch()
+        # act
+        for value in (0, 0, 10, 10):
+            sketch.add(value)
+        # assert
+        self.assertEqual(sketch.quantile(0.5), 0)
+        self.assertAlmostEqual(sketch.quantile(0.99), 10, delta=0.1)
+
+    def test_merge(self):
+        # arrange
+        low, high, both = LatencySketch(), LatencySketch(), LatencySketch()
+        for value in range(1, 101):
+            low.add(value)
+            both.add(value)
+        for value in range(101, 201):
+            high.add(value)
+            both.add(value)
+        # act
+        low.merge(high)
+        # assert
+        self.assertEqual(low.summary(), both.summary())
+        self.assertRaises(ValueError, low.merge, LatencySketch(relative_accuracy=0.05))
+
+    def test_bounded_bins(self):
+        # arrange
+        sketch = LatencySketch(max_bins=10)
+        # act
+        for value in range(1, 10000):
+            sketch.add(value)
+        # assert, only the lowest quantiles degrade
+        self.assertEqual(len(sketch.bins), 10)
+        self.assertAlmostEqual(sketch.quantile(0.99), 9900, delta=99)
+
+
+class TestSketchRegistry(TestCase):
+    """Defines tests for the SketchRegistry and @observe(sketch=True).
+    """
+
+    def tearDown(self) -> None:
+        sketches.clear()
+
+    def test_per_tags_merged(self):
+        # arrange
+        registry = SketchRegistry()
+        # act
+        registry.record("my.time", 10, ("a:1",))
+        registry.record("my.time", 20, ("a:2",))
+        # assert
+        self.assertEqual(registry.get("my.time", ["a:1"]).count, 1)
+        self.assertEqual(registry.get("my.time").count, 2)
+        self.assertIsNone(registry.get("other.time"))
+
+    def test_bounded_sketches(self):
+        # arrange
+        registry = SketchRegistry(max_sketches=1)
+        # act
+        registry.record("my.time", 10, ("a:1",))
+        registry.record("my.time", 10, ("a:2",))
+        # assert
+        self.assertEqual(registry.dropped, 1)
+
+    def test_emit_resets(self):
+        # arrange
+        registry = SketchRegistry()
+        registry.record("my.time", 10, ("a:1",))
+        imetric = Mock()
+        # act
+        registry.emit(imetric)
+        # assert
+        self.assertEqual(sorted(c.args[0] for c in imetric.gauge.call_args_list),
+                         ["my.time.max", "my.time.p50", "my.time.p90", "my.time.p99"])
+        self.assertEqual(imetric.gauge.call_args_list[0].args[2], ["a:1"])
+        self.assertIsNone(registry.get("my.time"))
+
+    def test_started_on_first_record(self):
+        # arrange
+        registry = SketchRegistry()
+        imetric = Mock()
+        # act
+        registry.record("my.time", 10)
+        self.assertIsNone(registry._worker)
+        with patch.object(registry, "emit") as emit, patch.object(registry._stop, "wait", side_effect=[False, True]):
+            registry.record("my.time", 10, imetric=imetric)
+            registry.record("my.time", 20, imetric=Mock())
+            registry._worker.join(1)
+        # assert
+        emit.assert_called_once_with(imetric)
+
+    def test_not_started_once_stopped(self):
+        # arrange
+        registry = SketchRegistry()
+        registry.start(interval=60.0)
+        registry.stop()
+        registry._worker.join(1)
+        # act
+        with patch.object(registry, "start") as start:
+            registry.record("my.time", 10, imetric=Mock())
+        # assert
+        start.assert_not_called()
+
+    def test_observe_sketch(self):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+
+            @observe(metric="sketched", static_tags=["layer:a"], sketch_tags=True, decline_on=[ValueError])
+            def process(self, fail: bool):
+                if fail:
+                    raise ValueError()
+        a = A()
+        # act
+        with patch.object(sketches, "_worker", None), patch.object(sketches, "start") as start:
+            for fail in (False, False, True):
+                a.process(fail=fail)
+        # assert
+        self.assertEqual(sketches.get("sketched.time.finished", ["layer:a"]).count, 2)
+        self.assertEqual(sketches.get("sketched.time.declined", ["layer:a", "exception:ValueError"]).count, 1)
+        self.assertIsNotNone(sketches.quantile("sketched.time.finished", 0.99))
+        start.assert_called_with(a.metric)
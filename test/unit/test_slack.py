@@ -1,11 +1,18 @@
 """Defines tests for slack.Slack class
 """
+import json
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import TestCase, skipIf
 
-from mock import patch
+from mock import Mock, patch
 
-from atl_observe.lib.slack import MissingSlackWebhookException, Slack
+from atl_observe.lib.slack import (DROP_OLDEST, BackgroundSlack,
+                                   CoalescingSlack,
+                                   MissingSlackWebhookException, Slack)
+from atl_observe.lib.utils import Provider
 
 slack_web_hook_required = skipIf(
     condition=bool(not os.environ.get('SLACK_WEB_HOOK')),
@@ -62,3 +69,240 @@ class TestSlackNotification(TestCase):
         slack.warning(header="This is the header", title="This is the title", text="This is coming from https://github.com/atlassian-labs/observe build!")
         slack.error(header="This is the header", title="This is the title", text="This is coming from https://github.com/atlassian-labs/observe build!")
         # assert, assertion provided by no exception
+
+
+class SlackStandIn(ThreadingHTTPServer):
+    """A local HTTP stand-in for the slack web hook, records the posted payloads.
+    """
+
+    def __init__(self, delay: float = 0.0, status: int = 200):
+        self.delay = delay
+        self.status = status
+        self.payloads = []
+        self.release = threading.Event()
+        self.release.set()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server = self.server
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                server.release.wait()
+                time.sleep(server.delay)
+                server.payloads.append(json.loads(body))
+                self.send_response(server.status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.web_hook = "http://127.0.0.1:%s/hook" % self.server_address[1]
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+
+class TestSlackSession(TestCase):
+    """Defines tests for the pooled session of the Slack client.
+    """
+
+    def setUp(self) -> None:
+        self.stand_in = SlackStandIn()
+
+    def tearDown(self) -> None:
+        self.stand_in.shutdown()
+        self.stand_in.server_close()
+
+    def test_session_reused_with_timeout(self):
+        # arrange
+        slack = Slack(web_hook=self.stand_in.web_hook, timeout=1.5)
+        # act
+        response = slack.error("first")
+        session = slack._get_session()
+        slack.error("second")
+        # assert
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(slack._get_session(), session)
+        self.assertEqual([p["attachments"][0]["text"] for p in self.stand_in.payloads], ["first", "second"])
+
+    def test_session_per_thread(self):
+        # arrange
+        slack = Slack(web_hook=self.stand_in.web_hook)
+        sessions = [slack._get_session()]
+
+        def send():
+            slack.error("in a thread")
+            sessions.append(slack._get_session())
+        threads = [threading.Thread(target=send) for _ in range(2)]
+        # act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # assert
+        self.assertEqual(len(set(map(id, sessions))), 3)
+        self.assertEqual(len(self.stand_in.payloads), 2)
+
+
+class TestBackgroundSlack(TestCase):
+    """Defines tests for the BackgroundSlack client, using a local HTTP stand-in.
+    """
+
+    def setUp(self) -> None:
+        self.stand_in = SlackStandIn()
+        self.metric = Mock()
+
+    def tearDown(self) -> None:
+        self.stand_in.release.set()
+        self.stand_in.shutdown()
+        self.stand_in.server_close()
+
+    def _counted(self):
+        return [call.args[0] for call in self.metric.increment.call_args_list]
+
+    def test_does_not_block_and_flushes(self):
+        # arrange
+        self.stand_in.delay = 0.2
+        slack = BackgroundSlack(web_hook=self.stand_in.web_hook, metric=self.metric)
+        # act
+        time_start = time.monotonic()
+        response = slack.error("in the background")
+        elapsed = time.monotonic() - time_start
+        drained = slack.flush(timeout=5)
+        # assert
+        self.assertIsNone(response)
+        self.assertLess(elapsed, 0.2)
+        self.assertTrue(drained)
+        self.assertEqual(slack.sent, 1)
+        self.assertEqual(self._counted(), ["observe.slack.sent"])
+        self.assertEqual(self.stand_in.payloads[0]["attachments"][0]["text"], "in the background")
+
+    def test_drops_newest_on_overflow(self):
+        # arrange, the worker blocks on the first notification
+        self.stand_in.release.clear()
+        slack = BackgroundSlack(web_hook=self.stand_in.web_hook, max_queue_size=1, metric=self.metric)
+        slack.error("1")
+        while slack._queue.qsize():
+            time.sleep(0.01)
+        # act
+        slack.error("2")
+        slack.error("3")
+        self.stand_in.release.set()
+        slack.flush(timeout=5)
+        # assert
+        self.assertEqual(slack.dropped, 1)
+        self.assertEqual([p["attachments"][0]["text"] for p in self.stand_in.payloads], ["1", "2"])
+
+    def test_drops_oldest_on_overflow(self):
+        # arrange, the worker blocks on the first notification
+        self.stand_in.release.clear()
+        slack = BackgroundSlack(web_hook=self.stand_in.web_hook, max_queue_size=1, overflow=DROP_OLDEST, metric=self.metric)
+        slack.error("1")
+        while slack._queue.qsize():
+            time.sleep(0.01)
+        # act
+        slack.error("2")
+        slack.error("3")
+        self.stand_in.release.set()
+        slack.flush(timeout=5)
+        # assert
+        self.assertEqual(slack.dropped, 1)
+        self.assertEqual([p["attachments"][0]["text"] for p in self.stand_in.payloads], ["1", "3"])
+
+    def test_counts_failed(self):
+        # arrange
+        self.stand_in.status = 500
+        slack = BackgroundSlack(web_hook=self.stand_in.web_hook, metric=self.metric)
+        # act
+        slack.error("fails")
+        slack.flush(timeout=5)
+        # assert
+        self.assertEqual(slack.failed, 1)
+        self.assertEqual(self._counted(), ["observe.slack.failed"])
+
+    def test_raises_on_invalid_setup(self):
+        # act, assert
+        self.assertRaises(ValueError, BackgroundSlack, web_hook=self.stand_in.web_hook, overflow="block")
+        self.assertRaises(ValueError, BackgroundSlack, web_hook=self.stand_in.web_hook, max_queue_size=0)
+
+
+class RecordingSlack(Slack):
+    """A Slack client which records the payloads instead of posting them.
+    """
+
+    def __init__(self):
+        super().__init__(web_hook="recording-web-hook")
+        self.payloads = []
+
+    def _post(self, payload):
+        self.payloads.append(payload["attachments"][0])
+
+
+class TestCoalescingSlack(TestCase):
+    """Defines tests for the CoalescingSlack client.
+    """
+
+    def setUp(self) -> None:
+        self.recording = RecordingSlack()
+        self.slack = CoalescingSlack(slack=self.recording, interval=60.0)
+
+    @staticmethod
+    def _traceback(line: int) -> str:
+        return 'boom\nTraceback (most recent call last):\n  File "engine.py", line %d, in process\nValueError: boom' % line
+
+    def test_first_sent_duplicates_digested(self):
+        # act
+        for trace_id in range(5):
+            self.slack.error(header="Engine(%s)" % trace_id, title="ValueError", text=self._traceback(10))
+        self.slack.flush()
+        # assert
+        self.assertEqual(len(self.recording.payloads), 2)
+        self.assertEqual(self.recording.payloads[0]["author_name"], "Engine(0)")
+        self.assertEqual(self.recording.payloads[1]["title"], "ValueError (4 more in 0s)")
+        self.assertTrue(self.recording.payloads[1]["text"].startswith("4 more occurrences between"))
+        self.assertEqual(self.slack.coalesced, 4)
+
+    def test_distinct_fingerprints_sent(self):
+        # act
+        self.slack.error(header="Engine(a)", title="ValueError", text=self._traceback(10))
+        self.slack.error(header="Engine(b)", title="ValueError", text=self._traceback(20))
+        self.slack.error(header="Engine(c)", title="KeyError", text=self._traceback(10))
+        self.slack.error(header="Loader(d)", title="ValueError", text=self._traceback(10))
+        self.slack.flush()
+        # assert
+        self.assertEqual(len(self.recording.payloads), 4)
+
+    def test_digest_per_window_and_expiry(self):
+        # arrange
+        self.slack.error(header="Engine(a)", title="ValueError", text=self._traceback(10))
+        self.slack.error(header="Engine(b)", title="ValueError", text=self._traceback(10))
+        now = time.monotonic()
+        # act, window completed
+        self.slack._send_digests(now=now + 61)
+        # act, idle window, fingerprint expires
+        self.slack._send_digests(now=now + 200)
+        self.slack.error(header="Engine(c)", title="ValueError", text=self._traceback(10))
+        # assert
+        self.assertEqual([p["author_name"] for p in self.recording.payloads], ["Engine(a)", "Engine(a)", "Engine(c)"])
+
+    def test_unique_failures_expire_on_insert(self):
+        # arrange, no duplicates, so no digest thread
+        slack = CoalescingSlack(slack=self.recording, interval=60.0, max_fingerprints=2)
+        now = time.monotonic()
+        with patch("atl_observe.lib.slack.time.monotonic", return_value=now):
+            slack.error(header="Engine(a)", title="ValueError", text=self._traceback(10))
+            slack.error(header="Engine(b)", title="ValueError", text=self._traceback(20))
+        # act, both idle for an interval
+        with patch("atl_observe.lib.slack.time.monotonic", return_value=now + 61):
+            slack.error(header="Engine(c)", title="ValueError", text=self._traceback(30))
+            slack.error(header="Engine(d)", title="ValueError", text=self._traceback(30))
+        # assert, the new fingerprint is tracked and its duplicate coalesced
+        self.assertEqual(len(slack._occurrences), 1)
+        self.assertEqual(slack.coalesced, 1)
+        self.assertEqual([p["author_name"] for p in self.recording.payloads], ["Engine(a)", "Engine(b)", "Engine(c)"])
+
+    def test_provider_finds_coalescing_slack(self):
+        # arrange
+        class A:
+            def __init__(self, slack):
+                self.slack = slack
+        # act, assert
+        self.assertIs(Provider.get_slack(A(self.slack)), self.slack)
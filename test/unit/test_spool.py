@@ -0,0 +1,216 @@
+"""Defines tests for spool.Spool, SpoolMetric and SpoolHandler classes
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric, MemoryMetric
+from atl_observe.lib.spool import (Spool, SpoolHandler, SpoolMetric,
+                                   outcome_of, read_records, replay,
+                                   spool_files)
+
+
+class TestSpool(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def lines(self):
+        lines = []
+        for path in spool_files(self.directory.name):
+            with open(path) as spool_file:
+                lines.extend(spool_file.readlines())
+        return lines
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_batched_writes(self):
+        # arrange
+        spool = Spool(self.directory.name, batch_size=3, flush_interval=60)
+        self.addCleanup(spool.close)
+        write, threads = os.write, []
+
+        def record_thread(fd, data):
+            threads.append(threading.current_thread())
+            return write(fd, data)
+        # act
+        with patch("atl_observe.lib.spool.os.write", side_effect=record_thread):
+            spool.append({"index": 0})
+            spool.append({"index": 1})
+            self.assertEqual(threads, [])
+            spool.append({"index": 2})
+            self.wait_for(lambda: len(self.lines()) == 3)
+        # assert, one write per batch by the flush thread, compact lines
+        self.assertEqual(threads, [spool._worker])
+        self.assertEqual(self.lines(), ['{"index":0}\n', '{"index":1}\n', '{"index":2}\n'])
+
+    def test_rotate_on_size(self):
+        # arrange
+        spool = Spool(self.directory.name, max_bytes=30, flush_interval=60)
+        self.addCleanup(spool.close)
+        # act, written in batches of two records
+        for index in range(6):
+            spool.append({"index": index})
+            if index % 2:
+                spool.flush()
+        # assert
+        self.assertEqual(len(spool_files(self.directory.name)), 3)
+        self.assertEqual([record["index"] for record in read_records(self.directory.name)], list(range(6)))
+
+    def test_rotate_on_age(self):
+        # arrange
+        spool = Spool(self.directory.name, max_age=10, flush_interval=60)
+        self.addCleanup(spool.close)
+        # act
+        with patch("atl_observe.lib.spool.time.time", return_value=1000.0):
+            spool.append({"index": 0})
+            spool.flush()
+        with patch("atl_observe.lib.spool.time.time", return_value=1010.0):
+            spool.append({"index": 1})
+            spool.flush()
+        # assert
+        self.assertEqual(len(spool_files(self.directory.name)), 2)
+
+    def test_failed_write_is_bounded(self):
+        # arrange, no flush thread
+        spool = Spool(self.directory.name, batch_size=2, max_buffered=3, flush_interval=60)
+        self.addCleanup(spool.close)
+        # act
+        with patch.object(spool, "_start"), patch("atl_observe.lib.spool.os.write", side_effect=OSError("disk full")):
+            for index in range(2):
+                spool.append({"index": index})
+            spool.flush()
+            for index in range(2, 5):
+                spool.append({"index": index})
+            spool.flush()
+        spool.flush()
+        # assert, the oldest records are dropped and counted, the others written on the next flush
+        records = list(read_records(self.directory.name))
+        self.assertEqual(spool.errors, 2)
+        self.assertEqual(spool.dropped, 2)
+        self.assertEqual((records[0]["metric"], records[0]["value"]), ("observe.spool.dropped", 2))
+        self.assertEqual([record["index"] for record in records[1:]], [2, 3, 4])
+
+    def test_child_closes_inherited_file(self):
+        # arrange
+        spool = Spool(self.directory.name, flush_interval=60)
+        self.addCleanup(spool.close)
+        spool.append({"index": 0})
+        spool.flush()
+        fd = spool._fd
+        # act
+        spool._after_fork_in_child()
+        # assert
+        self.assertIsNone(spool._fd)
+        self.assertRaises(OSError, os.fstat, fd)
+
+    def test_read_skips_malformed_lines(self):
+        # arrange
+        path = os.path.join(self.directory.name, "observe-crashed.ndjson")
+        with open(path, "w") as spool_file:
+            spool_file.write('{"index":0}\n[1]\n{"ind')
+        # act, assert
+        self.assertEqual(list(read_records(path)), [{"index": 0}])
+
+    def test_invalid_setup_raises(self):
+        # act, assert
+        self.assertRaises(ValueError, Spool, self.directory.name, max_bytes=0)
+        self.assertRaises(ValueError, Spool, self.directory.name, batch_size=10, max_buffered=5)
+
+
+class TestSpoolMetric(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.metric = SpoolMetric(Spool(self.directory.name, flush_interval=60))
+        self.addCleanup(self.metric.spool.close)
+        self.logger = Mock(spec=logging.Logger)
+
+    def test_outcome_of(self):
+        # act, assert
+        self.assertEqual(outcome_of("process.time.finished"), "finished")
+        self.assertEqual(outcome_of("process.exception.declined"), "declined")
+        self.assertIsNone(outcome_of("process.start"))
+
+    def test_observe_spools_records(self):
+        # arrange
+        @observe(metric="process", tags_from={"message": ["type"]}, trace_id_from={"message": "eventId"})
+        def process(self, message):
+            return True
+
+        # act
+        process(self, message={"type": "a", "eventId": "abcd"})
+        self.metric.flush()
+        # assert
+        records = {record["metric"]: record for record in read_records(self.directory.name)}
+        timing = records["process.time.finished"]
+        self.assertEqual(timing["kind"], "timing")
+        self.assertEqual(timing["outcome"], "finished")
+        self.assertEqual(timing["trace_id"], "abcd")
+        self.assertEqual(timing["tags"][0], "type:a")
+        self.assertIsInstance(timing["ts"], float)
+        self.assertEqual(records["process.start"]["kind"], "increment")
+        self.assertNotIn("outcome", records["process.start"])
+
+    def test_replay(self):
+        # arrange
+        self.metric.increment("process.start", 1, ["type:a"])
+        self.metric.timing("process.time.finished", 12.5, ["type:a"], 0.5)
+        self.metric.gauge("process.time_gauge.finished", 12.5)
+        self.metric.flush()
+        target = MemoryMetric()
+        # act
+        replayed = replay(self.directory.name, target)
+        # assert
+        self.assertEqual(replayed, 3)
+        self.assertEqual(list(target.records), [
+            ("increment", "process.start", 1, ["type:a"]),
+            ("timing", "process.time.finished", 12.5, ["type:a"]),
+            ("gauge", "process.time_gauge.finished", 12.5, []),
+        ])
+
+    def test_replay_passes_sample_rate(self):
+        # arrange
+        self.metric.timing("process.time.finished", 12.5, ["type:a"], 0.5)
+        self.metric.flush()
+        target = Mock(spec=IMetric)
+        # act
+        replay(self.directory.name, target)
+        # assert
+        target.timing.assert_called_once_with("process.time.finished", 12.5, ["type:a"], 0.5)
+
+
+class TestSpoolHandler(TestCase):
+
+    def test_spools_logs(self):
+        # arrange
+        with tempfile.TemporaryDirectory() as directory:
+            handler = SpoolHandler(directory)
+            logger = logging.getLogger("test_spool_handler")
+            logger.propagate = False
+            logger.addHandler(handler)
+            self.addCleanup(logger.removeHandler, handler)
+            # act
+            logger.error("failed %s", "abcd")
+            handler.flush()
+            handler.spool.close()
+            # assert
+            records = list(read_records(directory))
+            replayed = replay(directory, Mock(spec=IMetric))
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["kind"], "log")
+        self.assertEqual(records[0]["level"], "ERROR")
+        self.assertEqual(records[0]["message"], "failed abcd")
+        self.assertEqual(replayed, 0)
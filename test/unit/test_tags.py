@@ -0,0 +1,154 @@
+"""Defines tests for tags.CardinalityGuard and tags.TagCache classes
+"""
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from atl_observe import observe
+from atl_observe.lib.metrics import IMetric
+from atl_observe.lib.tags import OTHER_VALUE, CardinalityGuard, TagCache
+
+
+class TestCardinalityGuard(TestCase):
+    """Defines tests for the CardinalityGuard admission and counts.
+    """
+
+    def test_admits_up_to_limit(self):
+        # arrange
+        guard = CardinalityGuard(max_values=2)
+        # act
+        values = [guard.admit("userId", value) for value in ("a", "b", "c", "a", "d")]
+        # assert
+        self.assertEqual(values, ["a", "b", OTHER_VALUE, "a", OTHER_VALUE])
+        self.assertEqual(guard.collapsed, {"userId": 2})
+
+    def test_limits_per_key(self):
+        # arrange
+        guard = CardinalityGuard(max_values={"userId": 1})
+        # act, assert
+        self.assertEqual(guard.admit("userId", "a"), "a")
+        self.assertEqual(guard.admit("userId", "b"), OTHER_VALUE)
+        self.assertEqual(guard.admit("region", "b"), "b")
+        self.assertEqual(guard.admit("region", "c"), "c")
+
+    def test_emit_pending(self):
+        # arrange
+        guard = CardinalityGuard(max_values=1)
+        imetric = Mock()
+        for value in ("a", "b", "c"):
+            guard.admit("userId", value)
+        # act
+        guard.emit(imetric, "my_metric.tags.collapsed")
+        guard.emit(imetric, "my_metric.tags.collapsed")
+        # assert
+        imetric.increment.assert_called_once_with("my_metric.tags.collapsed", 2, ["tag_key:userId"])
+        self.assertEqual(guard.pending, 0)
+        self.assertEqual(guard.collapsed, {"userId": 2})
+
+    def test_reset(self):
+        # arrange
+        guard = CardinalityGuard(max_values=1)
+        guard.admit("userId", "a")
+        # act
+        guard.reset()
+        # assert
+        self.assertEqual(guard.admit("userId", "b"), "b")
+
+    def test_admitted_values_age_out_per_window(self):
+        # arrange
+        guard = CardinalityGuard(max_values=2, window=60.0)
+        with patch("atl_observe.lib.tags.time.monotonic", return_value=1000.0):
+            guard.admit("userId", "a")
+            guard.admit("userId", "b")
+            within = guard.admit("userId", "c")
+        # act
+        with patch("atl_observe.lib.tags.time.monotonic", return_value=1060.0):
+            aged = [guard.admit("userId", value) for value in ("c", "a", "b")]
+        # assert, the values of the last window were dropped, the new window admits up to the limit
+        self.assertEqual(within, OTHER_VALUE)
+        self.assertEqual(aged, ["c", "a", OTHER_VALUE])
+        self.assertEqual(guard.collapsed, {"userId": 2})
+
+    def test_without_window_admitted_values_are_kept(self):
+        # arrange
+        guard = CardinalityGuard(max_values=1, window=None)
+        with patch("atl_observe.lib.tags.time.monotonic", return_value=0.0):
+            guard.admit("userId", "a")
+        # act
+        with patch("atl_observe.lib.tags.time.monotonic", return_value=10.0 ** 9):
+            admitted = guard.admit("userId", "b")
+        # assert
+        self.assertEqual(admitted, OTHER_VALUE)
+
+    def test_invalid_limits_raise(self):
+        # act, assert
+        for max_values in (0, -1, True, "10", {"userId": 0}):
+            self.assertRaises(ValueError, CardinalityGuard, max_values)
+        self.assertRaises(ValueError, CardinalityGuard, 10, window=0)
+
+    def test_observe_max_tag_values(self):
+        # arrange
+        class A:
+            def __init__(self):
+                self.metric = Mock(spec=IMetric)
+                self.metric.gauge = Mock()
+
+            @observe(metric="my_metric", tags_from={"message": ["userId", "type"]}, max_tag_values={"userId": 1})
+            def process(self, message: dict):
+                pass
+        a = A()
+        # act
+        a.process(message={"userId": "1", "type": "a"})
+        a.process(message={"userId": "2", "type": "b"})
+        # assert
+        tags = a.metric.timing.call_args.args[2]
+        self.assertIn("userId:__other__", tags)
+        self.assertIn("type:b", tags)
+        self.assertEqual(a.metric.increment.call_args.args, ("my_metric.tags.collapsed", 1, ["tag_key:userId"]))
+
+
+class TestTagCache(TestCase):
+    """Defines tests for the TagCache, the tags per value combination.
+    """
+
+    def test_put_builds_tags_and_get_returns_them(self):
+        # arrange
+        cache = TagCache()
+        # act
+        tags = cache.put(("a", None, "eu"), ("type:", "userId:", "region:"), ("env:test",))
+        # assert
+        self.assertEqual(tags, ("type:a", "region:eu", "env:test"))
+        self.assertIs(cache.get(("a", None, "eu")), tags)
+        self.assertIsNone(cache.get(("b", None, "eu")))
+
+    def test_cleared_when_full(self):
+        # arrange
+        cache = TagCache(max_size=2)
+        cache.put(("a",), ("type:",), ())
+        cache.put(("b",), ("type:",), ())
+        # act
+        cache.put(("c",), ("type:",), ())
+        # assert
+        self.assertEqual(len(cache), 1)
+        self.assertIsNone(cache.get(("a",)))
+        self.assertEqual(cache.get(("c",)), ("type:c",))
+
+    def test_tag_strings_shared_across_combinations(self):
+        # arrange
+        cache = TagCache()
+        first = cache.put(("tenant-%d" % 1, "a"), ("tenant:", "type:"), ())
+        # act
+        second = cache.put(("tenant-%d" % 1, "b"), ("tenant:", "type:"), ())
+        # assert
+        self.assertEqual(second, ("tenant:tenant-1", "type:b"))
+        self.assertIs(second[0], first[0])
+
+    def test_tag_strings_cleared_when_full(self):
+        # arrange
+        cache = TagCache(max_size=2)
+        first = cache.tag("type:", "a")
+        cache.tag("type:", "b")
+        # act
+        cache.tag("type:", "c")
+        # assert, built again
+        self.assertIsNot(cache.tag("type:", "a"), first)